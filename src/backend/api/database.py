@@ -22,20 +22,29 @@ class PubSub:
         self.message_buffer: Dict[str, List[str]] = {}
         self.buffer_limit = 20
 
-    async def publish(self, channel: str, message: str):
-        """Publish a message to a channel."""
-        # Store message in buffer
-        if channel not in self.message_buffer:
-            self.message_buffer[channel] = []
-
-        self.message_buffer[channel].append(message)
-        # Limit buffer size
-        if len(self.message_buffer[channel]) > self.buffer_limit:
-            self.message_buffer[channel] = self.message_buffer[channel][
-                -self.buffer_limit :
-            ]
-
-        logger.info(f"Publishing message to channel: {channel}")
+    async def publish(self, channel: str, message: str, buffer: bool = True):
+        """
+        Publish a message to a channel.
+
+        Transient messages (e.g. streamed token deltas) should be published with
+        buffer=False so they are not replayed to new subscribers and do not push
+        complete messages out of the replay buffer.
+        """
+        if buffer:
+            # Store message in buffer
+            if channel not in self.message_buffer:
+                self.message_buffer[channel] = []
+
+            self.message_buffer[channel].append(message)
+            # Limit buffer size
+            if len(self.message_buffer[channel]) > self.buffer_limit:
+                self.message_buffer[channel] = self.message_buffer[channel][
+                    -self.buffer_limit :
+                ]
+
+            logger.info(f"Publishing message to channel: {channel}")
+        else:
+            logger.debug(f"Publishing transient message to channel: {channel}")
 
         if channel in self.subscribers and self.subscribers[channel]:
             for callback in list(self.subscribers[channel]):
@@ -45,7 +54,7 @@ class PubSub:
                     logger.error(f"Error in pubsub callback ({channel}): {e}")
                     # Remove failed callback
                     self.subscribers[channel].remove(callback)
-        else:
+        elif buffer:
             logger.info(f"No subscribers for channel: {channel}")
 
     def subscribe(self, channel: str, callback: Callable):
@@ -106,6 +115,15 @@ async def connect_to_mongodb():
         raise
 
 
+async def ensure_indexes():
+    """Create the indexes that lookups by message uid rely on."""
+    if client is None:
+        return
+    for collection_name in ("messages", "global_messages"):
+        await db[collection_name].create_index("message_uid")
+    logger.info("Ensured message_uid indexes exist")
+
+
 async def close_mongodb_connection():
     """Close MongoDB connection."""
     global client
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, APIRouter
 import uvicorn
+import asyncio
 import logging
 import os
 from fastapi.middleware.cors import CORSMiddleware
@@ -17,8 +18,18 @@ from api.routers import (
 )
 from api.routers.wakeword_router import router as wakeword_router
 from api.routers.settings_router import router as settings_router
-from ttsModule.ttsModule import tts as tts_model
-from api.database import connect_to_mongodb, close_mongodb_connection
+from ttsModule.ttsModule import get_model_status, start_background_load
+from api.database import (
+    connect_to_mongodb,
+    close_mongodb_connection,
+    ensure_indexes,
+)
+from api.services.llm_service import (
+    init_ollama_client,
+    close_ollama_client,
+    warm_up_models,
+)
+from api.services.tts_service import synthesis_executor, audio_encoder
 
 # Setup basic logging configuration
 logging.basicConfig(
@@ -45,25 +56,16 @@ app.add_middleware(
 )
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Ensure the TTS model is loaded on app startup and connect to MongoDB."""
-    logger.info("Startup: Loading TTS model...")
-
-    try:
-        from ttsModule.ttsModule import tts
+# Keep references to startup tasks so they are not garbage collected mid-run
+_background_tasks = set()
 
-        if tts is None:
-            logger.error(
-                "TTS model failed to load! API TTS endpoints will return errors."
-            )
-            logger.error("Check the ttsModule.py code and logs for details.")
-        else:
-            logger.info("TTS model loaded successfully!")
 
-    except Exception as e:
-        logger.error(f"Error importing TTS module: {e}")
-        logger.error("API TTS endpoints will return errors.")
+@app.on_event("startup")
+async def startup_event():
+    """Start loading the TTS model in the background and connect to MongoDB."""
+    # The model takes a long time to load; everything except /tts is served meanwhile
+    logger.info("Startup: Loading TTS model in the background...")
+    start_background_load()
 
     os.makedirs("ttsModule/output", exist_ok=True)
     os.makedirs("ttsModule/voicelines/cleaned", exist_ok=True)
@@ -76,14 +78,32 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
         logger.warning("API will continue without database functionality")
+    else:
+        try:
+            await ensure_indexes()
+        except Exception as e:
+            logger.warning(f"Failed to create MongoDB indexes: {e}")
+
+    await init_ollama_client()
+
+    # Load the models used by agents in the background so startup is not blocked
+    task = asyncio.create_task(warm_up_models())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    logger.info("Startup: Started model warm-up")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close the MongoDB connection when the app shuts down."""
+    """Close the MongoDB connection and Ollama client when the app shuts down."""
     await close_mongodb_connection()
     logger.info("MongoDB connection closed")
 
+    await close_ollama_client()
+
+    synthesis_executor.shutdown()
+    audio_encoder.shutdown()
+
 
 api_router = APIRouter(prefix="/mirai/api")
 
@@ -115,6 +135,17 @@ async def read_root():
     return {"message": "Welcome to the MirAI API"}
 
 
+@app.get("/mirai/api/health", tags=["Health Check"])
+async def health_check():
+    """Report readiness of the API and of the TTS model."""
+    tts_status = get_model_status()
+    return {
+        "status": "ok",
+        "tts": tts_status["status"],
+        "tts_model": tts_status,
+    }
+
+
 if __name__ == "__main__":
     logger.info("Starting MirAI API server with uvicorn...")
     uvicorn.run(app, host="0.0.0.0", port=8001, log_level="info")
@@ -177,6 +177,7 @@ class LlmModelInfo(BaseModel):
 
     name: str
     size: int
+    digest: Optional[str] = None
     modified_at: str
     details: Dict[str, Any] = {}
 
@@ -187,6 +188,14 @@ class LlmModelListResponse(BaseModel):
     models: List[LlmModelInfo]
 
 
+class LlmBatchGenerateRequest(BaseModel):
+    """Request model for generating responses to many prompts."""
+
+    config_uid: str
+    prompts: List[str] = Field(..., min_length=1)
+    concurrency: int = Field(4, ge=1)
+
+
 # --- Agent Models ---
 
 
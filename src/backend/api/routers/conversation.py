@@ -1,4 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+import asyncio
+import functools
 import logging
 import os
 import uuid
@@ -32,11 +34,26 @@ from ..services.conversation_service import (
     add_message,
     get_message,
     update_message_rating,
-    get_conversation_messages,
+    get_recent_messages,
+    get_conversation_summary,
+    get_unsummarized_messages,
+    schedule_summary_update,
+    turn_registry,
+    llm_context_fingerprint,
+    get_reusable_llm_context,
+    save_llm_context,
+    DEFAULT_NUM_CTX,
 )
 from ..services.agent_service import get_agent
-from ..services.llm_service import get_llm_config, generate_text
-from ..services.tts_service import generate_voice
+from ..services.llm_service import (
+    get_llm_config,
+    generate_text_stream,
+    get_generation_stats,
+    llm_scheduler,
+    LLMQueueFullError,
+    PRIORITY_VOICE,
+)
+from ..services.tts_service import generate_voice, SpeechPipeline, TTS_PIPELINE
 from promptBuilderModule.prompt_builder import PromptBuilder
 from ..database import db, pubsub_client
 from ..services.rag_service import augment_conversation_context
@@ -73,25 +90,75 @@ def build_prompt(
     agent_config: Dict[str, Any],
     tts_instructions: Optional[str] = None,
     rag_context: Optional[str] = None,
+    summary: Optional[str] = None,
+    num_ctx: int = DEFAULT_NUM_CTX,
 ) -> str:
-    """Build a prompt for the LLM using the conversation history and agent personality."""
+    """Build a prompt for the LLM using the conversation history, its summary and agent personality."""
     # Serialize agent_config using json_util
     agent_config_bson = json_util.dumps(agent_config)
     agent_config_json = json.loads(agent_config_bson)
 
-    # Limit conversation history to last 6 messages to keep the context focused
-    recent_messages = (
-        conversation_messages[-6:]
-        if len(conversation_messages) > 6
-        else conversation_messages
-    )
-
+    # The prompt is fitted to the model's context window, history filled newest first
     return PromptBuilder.create_prompt(
         personality_prompt=agent_config_json["personality_prompt"],
-        messages=recent_messages,
+        messages=conversation_messages,
         current_message=user_message,
         tts_instructions=tts_instructions,
         rag_context=rag_context,
+        summary=summary,
+        num_ctx=num_ctx,
+    )
+
+
+async def publish_response_delta(conversation_uid: str, message_uid: str, delta: str):
+    """Publish a chunk of a streamed agent response for websocket clients."""
+    if not pubsub_client:
+        return
+
+    try:
+        await pubsub_client.publish(
+            f"conversation:{conversation_uid}:messages",
+            json.dumps(
+                {
+                    "type": "agent_response_delta",
+                    "message_uid": message_uid,
+                    "delta": delta,
+                    "conversation_uid": conversation_uid,
+                }
+            ),
+            buffer=False,
+        )
+    except Exception as e:
+        logger.warning(f"Failed to publish agent response delta: {str(e)}")
+
+
+async def publish_audio_segment(
+    conversation_uid: str,
+    message_uid: str,
+    index: int,
+    path: str,
+    duration: float,
+    text: str,
+):
+    """Publish a voiced sentence of an agent response as soon as its audio is ready."""
+    if not pubsub_client:
+        return
+
+    await pubsub_client.publish(
+        f"conversation:{conversation_uid}:messages",
+        json.dumps(
+            {
+                "type": "agent_audio_segment",
+                "message_uid": message_uid,
+                "segment": index,
+                "text": text,
+                "audio_duration": duration,
+                "audio_url": f"/mirai/api/tts/stream/{message_uid}/segment/{index}?conversation_uid={conversation_uid}",
+                "stream_url": f"/mirai/api/tts/stream/{message_uid}?conversation_uid={conversation_uid}",
+                "conversation_uid": conversation_uid,
+            }
+        ),
+        buffer=False,
     )
 
 
@@ -352,11 +419,25 @@ async def send_message(
                 detail="LLM configuration not found for this agent",
             )
 
+        # Reject the message straight away if the model's queue is full
+        try:
+            llm_scheduler.check_capacity(llm_config["model"])
+        except LLMQueueFullError as e:
+            logger.warning(f"Rejecting message: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=str(e),
+                headers={"Retry-After": "5"},
+            )
+
         # Start response time tracking
         start_time = time.time()
 
         conversation_uid = conversation["conversation_uid"]
 
+        # A new message supersedes the reply still being generated
+        turn_registry.cancel(conversation_uid, "superseded by a newer message")
+
         # Add user message to the conversation
         logger.info(f"Adding user message to conversation: {conversation_uid}")
         user_message = await add_message(
@@ -366,11 +447,13 @@ async def send_message(
         )
 
         # Get conversation history
-        conversation_messages = await get_conversation_messages(conversation_uid)
+        conversation_messages = await get_recent_messages(conversation_uid)
 
         # Process the message and generate a response using a background task to avoid blocking
         logger.info(f"Starting background task for conversation: {conversation_uid}")
         background_tasks.add_task(
+            turn_registry.run,
+            conversation_uid,
             process_agent_response,
             conversation_uid=conversation_uid,
             user_message=user_message["content"],
@@ -399,6 +482,7 @@ async def process_agent_response(
     start_time: float = None,
 ):
     """Process an agent response to a user message."""
+    speech_pipeline = None
     try:
         # Log conversation UID to help debug issues
         logger.info(f"Processing agent response for conversation: {conversation_uid}")
@@ -410,7 +494,7 @@ async def process_agent_response(
 
         # Get conversation messages if not provided
         if conversation_messages is None:
-            conversation_messages = await get_conversation_messages(conversation_uid)
+            conversation_messages = await get_recent_messages(conversation_uid)
 
         agent_config = await get_agent(agent_uid)
 
@@ -525,14 +609,43 @@ async def process_agent_response(
             except Exception as e:
                 logger.warning(f"Failed to update message with RAG metadata: {str(e)}")
 
-        prompt = build_prompt(
-            user_message,
-            conversation_messages_json,
-            agent_config,
+        additional_params = llm_config_json.get("additional_params") or {}
+        num_ctx = additional_params.get("num_ctx", DEFAULT_NUM_CTX)
+
+        # Continue the context Ollama already evaluated for this conversation
+        # when possible, so only the new turn has to be evaluated
+        context_fingerprint = llm_context_fingerprint(
+            llm_config_json["model"],
+            agent_config.get("personality_prompt"),
             tts_instructions,
-            rag_context if rag_context else api_module_context,
+        )
+        llm_context = get_reusable_llm_context(
+            conversation,
+            context_fingerprint,
+            num_ctx,
         )
 
+        if llm_context:
+            logger.info(
+                f"Continuing stored LLM context of {len(llm_context)} tokens for conversation: {conversation_uid}"
+            )
+            prompt = PromptBuilder.build_turn_prompt(
+                user_message,
+                rag_context if rag_context else api_module_context,
+                num_ctx,
+            )
+        else:
+            # Messages the summary covers are left out of the history
+            prompt = build_prompt(
+                user_message,
+                get_unsummarized_messages(conversation, conversation_messages_json),
+                agent_config,
+                tts_instructions,
+                rag_context if rag_context else api_module_context,
+                get_conversation_summary(conversation),
+                num_ctx,
+            )
+
         # Generate a message uid
         message_uid = str(uuid.uuid4())
 
@@ -549,8 +662,27 @@ async def process_agent_response(
         except Exception as e:
             logger.error(f"Failed to save prompt to file: {str(e)}")
 
-        # Generate response from LLM
-        response_text = await generate_text(
+        # Voice the response sentence by sentence while it streams in
+        custom_voice_path = agent_config.get("custom_voice_path")
+        if custom_voice_path:
+            logger.info(f"Agent has custom voice path: {custom_voice_path}")
+
+        if TTS_PIPELINE:
+            speech_pipeline = SpeechPipeline(
+                voice_speaker=agent_config["voice_speaker"],
+                message_uid=message_uid,
+                conversation_uid=conversation_uid,
+                custom_voice_path=custom_voice_path,
+                on_segment=functools.partial(
+                    publish_audio_segment, conversation_uid, message_uid
+                ),
+            )
+            speech_pipeline.start()
+
+        # Stream the response from the LLM, publishing each chunk as it arrives
+        response_chunks = []
+        generation_result = {}
+        async for chunk in generate_text_stream(
             model=llm_config_json["model"],
             prompt=prompt,
             temperature=llm_config_json.get("temperature", 0.7),
@@ -561,26 +693,54 @@ async def process_agent_response(
             presence_penalty=llm_config_json.get("presence_penalty", 0.0),
             frequency_penalty=llm_config_json.get("frequency_penalty", 0.0),
             stop=llm_config_json.get("stop_sequences", []),
-        )
+            context=llm_context,
+            final=generation_result,
+            priority=PRIORITY_VOICE,
+            **additional_params,
+        ):
+            response_chunks.append(chunk)
+            await publish_response_delta(conversation_uid, message_uid, chunk)
+            if speech_pipeline:
+                speech_pipeline.feed(chunk)
+
+        response_text = "".join(response_chunks)
         logger.info(f"Generated response for conversation: {conversation_uid}")
 
+        # Keep the evaluated context for the next turn. It covers every message
+        # up to and including the agent message added below.
+        if generation_result.get("context"):
+            try:
+                await save_llm_context(
+                    conversation_uid,
+                    generation_result["context"],
+                    context_fingerprint,
+                    conversation.get("message_count", 0) + 1,
+                )
+            except Exception as e:
+                logger.warning(f"Failed to save LLM context: {str(e)}")
+
         logger.info(
             f"Generating voice for message_uid: {message_uid} in conversation: {conversation_uid}"
         )
 
-        # Get custom voice path if exists
-        custom_voice_path = agent_config.get("custom_voice_path")
-        if custom_voice_path:
-            logger.info(f"Agent has custom voice path: {custom_voice_path}")
-
-        # Generate wav for the response
-        voice_path, audio_duration = await generate_voice(
-            text=response_text,
-            voice_speaker=agent_config["voice_speaker"],
-            message_uid=message_uid,
-            conversation_uid=conversation_uid,
-            custom_voice_path=custom_voice_path,
-        )
+        # Generate voice for the response. The reply is stored without voice
+        # when synthesis fails, since its text has already been streamed
+        voice_path, audio_duration = None, 0.0
+        try:
+            if speech_pipeline:
+                voice_path, audio_duration = await speech_pipeline.finish()
+            else:
+                voice_path, audio_duration = await generate_voice(
+                    text=response_text,
+                    voice_speaker=agent_config["voice_speaker"],
+                    message_uid=message_uid,
+                    conversation_uid=conversation_uid,
+                    custom_voice_path=custom_voice_path,
+                )
+        except Exception as e:
+            logger.error(
+                f"Storing reply {message_uid} without voice, synthesis failed: {str(e)}"
+            )
         logger.info(f"Generated voice at path: {voice_path}")
 
         # Calculate response time
@@ -594,6 +754,8 @@ async def process_agent_response(
         # Generate a stream URL for the audio
         audio_stream_url = (
             f"/mirai/api/tts/stream/{message_uid}?conversation_uid={conversation_uid}"
+            if voice_path
+            else None
         )
 
         metadata = {}
@@ -606,6 +768,14 @@ async def process_agent_response(
             metadata["rag_applied"] = True
             metadata["query_type"] = rag_result["query_type"]
 
+        if llm_context:
+            metadata["llm_context_reused"] = True
+
+        # Token counts and timings reported by Ollama for this generation
+        llm_stats = get_generation_stats(generation_result)
+        if llm_stats:
+            metadata["llm_stats"] = llm_stats
+
         # Add prompt path to metadata
         if prompt_path:
             metadata["prompt_path"] = prompt_path
@@ -648,6 +818,9 @@ async def process_agent_response(
 
         logger.info(f"Agent response added to conversation: {conversation_uid}")
 
+        # Fold older messages into the rolling summary when enough turns have passed
+        schedule_summary_update(conversation_uid, llm_config_json["model"])
+
         # Publish the agent's message to a message queue for websocket notifications
         if pubsub_client:
             try:
@@ -679,8 +852,29 @@ async def process_agent_response(
                 logger.error(f"Publish error traceback: {traceback.format_exc()}")
 
         return agent_message
+    except asyncio.CancelledError:
+        logger.info(f"Agent response cancelled for conversation: {conversation_uid}")
+        if speech_pipeline:
+            speech_pipeline.cancel()
+        if pubsub_client:
+            try:
+                await pubsub_client.publish(
+                    f"conversation:{conversation_uid}:messages",
+                    json.dumps(
+                        {
+                            "type": "agent_response_cancelled",
+                            "conversation_uid": conversation_uid,
+                        }
+                    ),
+                    buffer=False,
+                )
+            except Exception as e:
+                logger.warning(f"Failed to publish cancelled response: {str(e)}")
+        raise
     except Exception as e:
         logger.error(f"Error processing agent response: {str(e)}")
+        if speech_pipeline:
+            speech_pipeline.cancel()
         raise
 
 
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+import functools
 import logging
 import os
 import uuid
@@ -27,9 +28,20 @@ from ..services.global_conversation_service import (
     update_global_message_rating,
 )
 from ..services.agent_service import get_agent, get_all_agents
-from ..services.llm_service import get_llm_config, generate_text
-from ..services.tts_service import generate_voice
-from promptBuilderModule.prompt_builder import PromptBuilder
+from ..services.llm_service import (
+    get_llm_config,
+    generate_text_stream,
+    get_generation_stats,
+    llm_scheduler,
+    LLMQueueFullError,
+    PRIORITY_VOICE,
+)
+from ..services.tts_service import generate_voice, SpeechPipeline, TTS_PIPELINE
+from promptBuilderModule.prompt_builder import (
+    PromptBuilder,
+    DEFAULT_NUM_CTX,
+    prompt_budgets,
+)
 from ..database import db, pubsub_client
 from ..services.rag_service import augment_conversation_context
 
@@ -69,18 +81,16 @@ def build_global_prompt(
     agent_config: Dict[str, Any],
     tts_instructions: Optional[str] = None,
     rag_context: Optional[str] = None,
+    num_ctx: int = DEFAULT_NUM_CTX,
 ) -> str:
     """Build a prompt for the global conversation with very clear instructions."""
     # Serialize agent_config using json_util
     agent_config_bson = json_util.dumps(agent_config)
     agent_config_json = json.loads(agent_config_bson)
 
-    # Limit to recent messages to prevent context overload
-    recent_messages = (
-        conversation_messages[-8:]
-        if len(conversation_messages) > 8
-        else conversation_messages
-    )
+    # The query is quoted in the instructions too, so it is cut to its share first
+    budgets = prompt_budgets(num_ctx)
+    user_message = PromptBuilder.fit_to_budget(user_message, budgets["query"])
 
     # The final system prompt will combine several sections
     system_prompt_parts = []
@@ -106,7 +116,7 @@ The current message is specifically directed to YOU."""
     if rag_context:
         system_prompt_parts.append(
             f"""## SEARCH RESULTS
-{rag_context}"""
+{PromptBuilder.fit_to_budget(rag_context, budgets["rag"])}"""
         )
 
     # 4. Add explicit instructions for the current query
@@ -137,15 +147,68 @@ Your response should be informative but concise, factually accurate, and in your
     # Combine all parts with proper spacing
     personality = "\n\n".join(system_prompt_parts)
 
-    # Build the prompt with minimal conversation history to keep focus on the current question
+    # Build the prompt with as much recent history as fits its token budget
     return PromptBuilder.create_prompt(
         personality_prompt=personality,
-        messages=(
-            recent_messages[-4:] if len(recent_messages) > 4 else recent_messages
-        ),  # Use even fewer messages
+        messages=conversation_messages,
         current_message=user_message,
         tts_instructions=None,  # Already included in the personality prompt
         rag_context=None,  # Already included in the personality prompt
+        num_ctx=num_ctx,
+    )
+
+
+async def publish_global_response_delta(message_uid: str, agent_uid: str, delta: str):
+    """Publish a chunk of a streamed agent response to the global conversation."""
+    if not pubsub_client:
+        return
+
+    try:
+        await pubsub_client.publish(
+            "global_conversation:messages",
+            json.dumps(
+                {
+                    "type": "agent_response_delta",
+                    "message_uid": message_uid,
+                    "agent_uid": agent_uid,
+                    "delta": delta,
+                    "conversation_uid": "global",
+                }
+            ),
+            buffer=False,
+        )
+    except Exception as e:
+        logger.warning(f"Failed to publish global agent response delta: {str(e)}")
+
+
+async def publish_global_audio_segment(
+    message_uid: str,
+    agent_uid: str,
+    index: int,
+    path: str,
+    duration: float,
+    text: str,
+):
+    """Publish a voiced sentence of an agent response to the global conversation."""
+    if not pubsub_client:
+        return
+
+    await pubsub_client.publish(
+        "global_conversation:messages",
+        json.dumps(
+            {
+                "type": "agent_audio_segment",
+                "message_uid": message_uid,
+                "agent_uid": agent_uid,
+                "segment": index,
+                "text": text,
+                "audio_duration": duration,
+                "audio_url": f"/mirai/api/tts/stream/{message_uid}/segment/{index}?conversation_uid=global",
+                "stream_url": f"/mirai/api/tts/stream/{message_uid}?conversation_uid=global",
+                "conversation_uid": "global",
+            }
+        ),
+        buffer=False,
     )
 
 
@@ -191,10 +254,6 @@ async def send_global_message(
             else current_user.user_uid
         )
 
-        user_message = await add_message_to_global_conversation(
-            content=message_data.content, message_type=MessageType.USER
-        )
-
         agent_uid = message_data.agent_uid
 
         if not agent_uid:
@@ -220,6 +279,27 @@ async def send_global_message(
                         )
                         break
 
+        if agent_uid:
+            # Reject the message straight away if the agent's model queue is full
+            agent = await get_agent(agent_uid)
+            llm_config = (
+                await get_llm_config(agent["llm_config_uid"]) if agent else None
+            )
+            if llm_config:
+                try:
+                    llm_scheduler.check_capacity(llm_config["model"])
+                except LLMQueueFullError as e:
+                    logger.warning(f"Rejecting global message: {str(e)}")
+                    raise HTTPException(
+                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                        detail=str(e),
+                        headers={"Retry-After": "5"},
+                    )
+
+        user_message = await add_message_to_global_conversation(
+            content=message_data.content, message_type=MessageType.USER
+        )
+
         if not agent_uid:
             logger.info(
                 "No agent specified or detected in message, not generating a response"
@@ -243,6 +323,8 @@ async def send_global_message(
             f"User message sent and agent response processing started for global conversation"
         )
         return user_message
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error sending global message: {str(e)}")
         raise HTTPException(
@@ -262,6 +344,7 @@ async def process_agent_global_response(
     user_message: str, agent_uid: str, start_time: float = None
 ):
     """Process an agent response to a user message in the global conversation."""
+    speech_pipeline = None
     try:
         # Get the agent configuration
         agent_config = await get_agent(agent_uid)
@@ -317,6 +400,9 @@ async def process_agent_global_response(
             agent_config,
             tts_instructions,
             rag_context,
+            (llm_config_json.get("additional_params") or {}).get(
+                "num_ctx", DEFAULT_NUM_CTX
+            ),
         )
 
         message_uid = str(uuid.uuid4())
@@ -335,8 +421,27 @@ async def process_agent_global_response(
         except Exception as e:
             logger.error(f"Failed to save global conversation prompt to file: {str(e)}")
 
-        # Generate response from LLM
-        response_text = await generate_text(
+        # Voice the response sentence by sentence while it streams in
+        custom_voice_path = agent_config.get("custom_voice_path")
+        if custom_voice_path:
+            logger.info(f"Agent has custom voice path: {custom_voice_path}")
+
+        if TTS_PIPELINE:
+            speech_pipeline = SpeechPipeline(
+                voice_speaker=agent_config["voice_speaker"],
+                message_uid=message_uid,
+                conversation_uid="global",
+                custom_voice_path=custom_voice_path,
+                on_segment=functools.partial(
+                    publish_global_audio_segment, message_uid, agent_uid
+                ),
+            )
+            speech_pipeline.start()
+
+        # Stream the response from the LLM, publishing each chunk as it arrives
+        response_chunks = []
+        generation_result = {}
+        async for chunk in generate_text_stream(
             model=llm_config_json["model"],
             prompt=prompt,
             temperature=llm_config_json.get("temperature", 0.7),
@@ -347,21 +452,36 @@ async def process_agent_global_response(
             presence_penalty=llm_config_json.get("presence_penalty", 0.0),
             frequency_penalty=llm_config_json.get("frequency_penalty", 0.0),
             stop=llm_config_json.get("stop_sequences", []),
-        )
+            final=generation_result,
+            priority=PRIORITY_VOICE,
+            **(llm_config_json.get("additional_params") or {}),
+        ):
+            response_chunks.append(chunk)
+            await publish_global_response_delta(message_uid, agent_uid, chunk)
+            if speech_pipeline:
+                speech_pipeline.feed(chunk)
+
+        response_text = "".join(response_chunks)
         logger.info(f"Generated response from {agent_name} for global conversation")
 
-        custom_voice_path = agent_config.get("custom_voice_path")
-        if custom_voice_path:
-            logger.info(f"Agent has custom voice path: {custom_voice_path}")
-
-        # Generate voice for the response
-        voice_path, audio_duration = await generate_voice(
-            text=response_text,
-            voice_speaker=agent_config["voice_speaker"],
-            message_uid=message_uid,
-            conversation_uid="global",
-            custom_voice_path=custom_voice_path,
-        )
+        # Generate voice for the response. The reply is stored without voice
+        # when synthesis fails, since its text has already been streamed
+        voice_path, audio_duration = None, 0.0
+        try:
+            if speech_pipeline:
+                voice_path, audio_duration = await speech_pipeline.finish()
+            else:
+                voice_path, audio_duration = await generate_voice(
+                    text=response_text,
+                    voice_speaker=agent_config["voice_speaker"],
+                    message_uid=message_uid,
+                    conversation_uid="global",
+                    custom_voice_path=custom_voice_path,
+                )
+        except Exception as e:
+            logger.error(
+                f"Storing reply {message_uid} without voice, synthesis failed: {str(e)}"
+            )
         logger.info(f"Generated voice at path: {voice_path}")
 
         response_time = None
@@ -392,6 +512,8 @@ async def process_agent_global_response(
         # Generate a stream URL for the audio
         audio_stream_url = (
             f"/mirai/api/tts/stream/{message_uid}?conversation_uid=global"
+            if voice_path
+            else None
         )
 
         # Add response time and audio duration as metadata
@@ -408,6 +530,11 @@ async def process_agent_global_response(
             metadata["query_type"] = rag_result["query_type"]
             metadata["search_results_count"] = len(rag_result["search_results"])
 
+        # Token counts and timings reported by Ollama for this generation
+        llm_stats = get_generation_stats(generation_result)
+        if llm_stats:
+            metadata["llm_stats"] = llm_stats
+
         # Add prompt path to metadata
         if prompt_path:
             metadata["prompt_path"] = prompt_path
@@ -483,6 +610,8 @@ async def process_agent_global_response(
         logger.error(
             f"Error processing agent response for global conversation: {str(e)}"
         )
+        if speech_pipeline:
+            speech_pipeline.cancel()
         import traceback
 
         logger.error(traceback.format_exc())
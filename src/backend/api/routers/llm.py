@@ -1,5 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+import json
 import logging
+import time
 from typing import List, Dict, Any
 
 from ..models import (
@@ -7,6 +10,7 @@ from ..models import (
     LlmConfigUpdate,
     LlmConfigResponse,
     LlmModelListResponse,
+    LlmBatchGenerateRequest,
     StatusResponse,
 )
 from ..security import get_current_user
@@ -17,8 +21,15 @@ from ..services.llm_service import (
     update_llm_config,
     archive_llm_config,
     list_ollama_models,
-    pull_ollama_model,
     delete_ollama_model,
+    get_ollama_client,
+    residency_manager,
+    model_catalogue,
+    model_pull_manager,
+    llm_scheduler,
+    generation_cache,
+    generation_coalescer,
+    batch_generate,
 )
 
 logger = logging.getLogger(__name__)
@@ -139,14 +150,63 @@ async def archive_config(
         )
 
 
+# --- Generation Endpoints ---
+
+
+@router.post("/batch_generate")
+async def batch_generate_responses(
+    request: LlmBatchGenerateRequest, current_user: dict = Depends(get_current_user)
+):
+    """
+    Generate responses to many prompts with an LLM configuration.
+
+    Results are streamed back as NDJSON in the order they complete, one line
+    per prompt with its index, latency and token stats, followed by a summary line.
+    """
+    config = await get_llm_config(request.config_uid)
+    if not config:
+        logger.warning(f"LLM config not found: {request.config_uid}")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="LLM configuration not found"
+        )
+
+    logger.info(
+        f"Starting batch generation of {len(request.prompts)} prompts "
+        f"with LLM config {request.config_uid}"
+    )
+
+    async def stream_results():
+        start_time = time.time()
+        errors = 0
+        async for result in batch_generate(
+            request.prompts, config, concurrency=request.concurrency
+        ):
+            if result["status"] == "error":
+                errors += 1
+            yield json.dumps(result) + "\n"
+
+        yield json.dumps(
+            {
+                "status": "done",
+                "count": len(request.prompts),
+                "errors": errors,
+                "total_time": time.time() - start_time,
+            }
+        ) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
 # --- Ollama Endpoints ---
 
 
 @router.get("/ollama/list", response_model=LlmModelListResponse)
-async def list_models(current_user: dict = Depends(get_current_user)):
-    """List available models from Ollama."""
+async def list_models(
+    refresh: bool = False, current_user: dict = Depends(get_current_user)
+):
+    """List available models from Ollama, served from cache unless refresh is set."""
     try:
-        models = await list_ollama_models()
+        models = await list_ollama_models(refresh=refresh)
         return {"models": models}
     except Exception as e:
         logger.error(f"Error listing Ollama models: {str(e)}")
@@ -156,22 +216,104 @@ async def list_models(current_user: dict = Depends(get_current_user)):
         )
 
 
-@router.post("/ollama/pull", response_model=StatusResponse)
+@router.get("/ollama/stats")
+async def get_ollama_stats(current_user: dict = Depends(get_current_user)):
+    """Get connection pool, request and model catalogue counters for Ollama."""
+    return {
+        **get_ollama_client().get_stats(),
+        "catalogue": model_catalogue.get_stats(),
+    }
+
+
+@router.get("/scheduler/stats")
+async def get_scheduler_stats(current_user: dict = Depends(get_current_user)):
+    """Get queue depth, concurrency and rejection counters for LLM requests."""
+    return llm_scheduler.get_stats()
+
+
+@router.get("/coalescing/stats")
+async def get_coalescing_stats(current_user: dict = Depends(get_current_user)):
+    """Get how many generate requests shared an in-flight generation."""
+    return generation_coalescer.get_stats()
+
+
+@router.get("/cache/stats")
+async def get_cache_stats(current_user: dict = Depends(get_current_user)):
+    """Get hit and miss counters for the deterministic generation cache."""
+    return generation_cache.get_stats()
+
+
+@router.delete("/cache", response_model=StatusResponse)
+async def clear_cache(current_user: dict = Depends(get_current_user)):
+    """Remove all cached generations."""
+    generation_cache.clear()
+    return {"status": "success", "message": "Generation cache cleared"}
+
+
+@router.get("/ollama/resident")
+async def list_resident_models(current_user: dict = Depends(get_current_user)):
+    """List the models Ollama currently has loaded, most recently used first."""
+    try:
+        await residency_manager.refresh()
+    except Exception as e:
+        logger.warning(f"Could not refresh resident models from Ollama: {str(e)}")
+
+    return {
+        "models": residency_manager.get_resident_models(),
+        "keep_alive": residency_manager.keep_alive,
+        "memory_budget": residency_manager.memory_budget,
+    }
+
+
+@router.post("/ollama/pull", status_code=status.HTTP_202_ACCEPTED)
 async def pull_model(model_name: str, current_user: dict = Depends(get_current_user)):
-    """Pull a model from Ollama."""
+    """Start a background pull job for a model, progress is published over websocket."""
+    job = model_pull_manager.start(model_name)
+    logger.info(f"Model pull started: {model_name} (job {job['job_id']})")
+    return job
+
+
+@router.get("/ollama/pulls")
+async def list_model_pulls(current_user: dict = Depends(get_current_user)):
+    """List model pull jobs, newest first."""
+    return model_pull_manager.list_jobs()
+
+
+@router.get("/ollama/pulls/{job_id}")
+async def get_model_pull(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Get the status and progress of a model pull job."""
+    job = model_pull_manager.get_job(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Pull job not found"
+        )
+    return job
+
+
+@router.post("/ollama/pulls/{job_id}/cancel")
+async def cancel_model_pull(
+    job_id: str, current_user: dict = Depends(get_current_user)
+):
+    """Stop a running model pull. Downloaded layers are kept for resuming."""
     try:
-        result = await pull_ollama_model(model_name)
-        logger.info(f"Model pulled: {model_name}")
-        return result
+        return model_pull_manager.cancel(job_id)
     except ValueError as e:
-        logger.error(f"Error pulling Ollama model: {str(e)}")
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
-    except Exception as e:
-        logger.error(f"Error pulling Ollama model: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+
+@router.post("/ollama/pulls/{job_id}/resume")
+async def resume_model_pull(
+    job_id: str, current_user: dict = Depends(get_current_user)
+):
+    """Resume a cancelled or failed model pull."""
+    if not model_pull_manager.get_job(job_id):
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to pull model: {str(e)}",
+            status_code=status.HTTP_404_NOT_FOUND, detail="Pull job not found"
         )
+    try:
+        return model_pull_manager.resume(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
 @router.delete("/ollama/delete", response_model=StatusResponse)
@@ -9,6 +9,7 @@ from ..services.statistics_service import (
     get_response_metrics,
     get_llm_performance_stats,
     get_agent_performance_stats,
+    get_generation_timing_stats,
 )
 
 logger = logging.getLogger(__name__)
@@ -82,3 +83,30 @@ async def get_agent_statistics(
         List of dictionaries with agent performance statistics
     """
     return await get_agent_performance_stats(agent_filter)
+
+
+@router.get("/generation")
+async def get_generation_statistics(
+    llm_filter: Optional[str] = Query(None, description="Filter by LLM config UID"),
+    agent_filter: Optional[str] = Query(None, description="Filter by agent UID"),
+    group_by: str = Query(
+        "llm_config_uid", description="Group by llm_config_uid or agent_uid"
+    ),
+) -> List[Dict[str, Any]]:
+    """
+    Get token throughput, prompt evaluation share and model load time statistics.
+
+    Args:
+        llm_filter: Optional filter by LLM config UID
+        agent_filter: Optional filter by agent UID
+        group_by: Field to group the statistics by
+
+    Returns:
+        List of dictionaries with generation timing statistics
+    """
+    try:
+        return await get_generation_timing_stats(
+            llm_filter=llm_filter, agent_filter=agent_filter, group_by=group_by
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
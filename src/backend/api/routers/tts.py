@@ -3,11 +3,12 @@ from fastapi import (
     HTTPException,
     BackgroundTasks,
     Depends,
+    Header,
     Query,
     File,
     UploadFile,
 )
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 import os
 import time
 import uuid
@@ -19,8 +20,28 @@ os.environ["TORCH_LOAD_WEIGHTS_ONLY"] = "0"
 
 from .. import models
 from ..security import get_current_user, DEV_MODE
-from ttsModule.ttsModule import generate_speech, tts
-from ..services.tts_service import generate_voice, get_available_voices, get_voice_path
+from ttsModule.ttsModule import (
+    speaker_latent_cache,
+    get_model_status,
+    start_background_load,
+)
+from ..services.tts_service import (
+    generate_voice,
+    get_available_voices,
+    get_voice_path,
+    get_voice_segment_path,
+    synthesis_executor,
+    batching_engine,
+    audio_cache,
+    audio_encoder,
+    voice_path_index,
+    repair_voice_paths,
+    choose_audio_format,
+    get_encoded_variant,
+    get_active_pipeline,
+    AUDIO_FORMATS,
+    TTSQueueFullError,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -33,13 +54,28 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 
 def check_tts_model_loaded():
-    """Check if the TTS model is loaded."""
-    from ttsModule.ttsModule import tts
+    """Check if the TTS model is loaded, reporting whether it is still loading."""
+    status = get_model_status()
+
+    if status["status"] == "ready":
+        return
+    if status["status"] == "not_loaded":
+        start_background_load()
+        status = get_model_status()
 
-    if tts is None:
-        error_msg = "TTS Service Unavailable: Model failed to load. Check server logs for details."
-        logger.error("API request failed: TTS model not loaded")
-        raise HTTPException(status_code=503, detail=error_msg)
+    if status["status"] == "loading":
+        logger.info("API request rejected: TTS model still loading")
+        raise HTTPException(
+            status_code=503,
+            detail="TTS Service Unavailable: Model is still loading. Try again shortly.",
+            headers={"Retry-After": "10"},
+        )
+
+    error_msg = (
+        "TTS Service Unavailable: Model failed to load. Check server logs for details."
+    )
+    logger.error(f"API request failed: TTS model not loaded ({status['error']})")
+    raise HTTPException(status_code=503, detail=error_msg)
 
 
 # --- Router Definition ---
@@ -91,6 +127,9 @@ async def generate_tts(tts_request: models.TTSRequest, user=Depends(get_current_
         return models.TTSResponse(
             message="Speech generation started in background", file_path=output_path
         )
+    except TTSQueueFullError as e:
+        logger.warning(f"Rejected speech generation: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to generate speech: {e}")
         raise HTTPException(
@@ -160,10 +199,32 @@ async def list_voices(user=Depends(get_current_user)):
 async def stream_tts(
     message_uid: str,
     conversation_uid: Optional[str] = None,
+    format: Optional[str] = Query(
+        None, description="Serve this format if ready instead of using Accept"
+    ),
+    accept: Optional[str] = Header(None),
     user=Depends(get_current_user) if not DEV_MODE else None,
 ):
-    """Stream a generated voice line as audio content."""
+    """
+    Stream a voice line, compressed if the client accepts it.
+
+    While the line is still being synthesized, its audio is streamed as a
+    chunked WAV that grows sentence by sentence.
+    """
     try:
+        pipeline = get_active_pipeline(message_uid)
+        if pipeline is not None:
+            return StreamingResponse(
+                pipeline.stream(),
+                media_type="audio/wav",
+                headers={
+                    "Content-Disposition": f"inline; filename=message_{message_uid}.wav",
+                    "Cache-Control": "no-cache",
+                    "X-Message-UID": message_uid,
+                    "X-Audio-In-Progress": "true",
+                },
+            )
+
         # Get the voice file path
         voice_path = await get_voice_path(message_uid, conversation_uid)
 
@@ -188,14 +249,29 @@ async def stream_tts(
                 status_code=404, detail=f"Voice file not found at path: {abs_path}"
             )
 
+        # Serve a compressed variant if one is ready; encode missing ones for next time
+        variants = {
+            fmt: get_encoded_variant(abs_path, fmt) for fmt in audio_encoder.formats
+        }
+        if not all(variants.values()):
+            audio_encoder.schedule(abs_path)
+        available = ["wav"] + [fmt for fmt, path in variants.items() if path]
+
+        if format in available:
+            fmt = format
+        else:
+            fmt = choose_audio_format(accept, available)
+        file_path = variants.get(fmt) or abs_path
+
         # Return the file with headers for streaming audio
         return FileResponse(
-            abs_path,
-            media_type="audio/wav",
+            file_path,
+            media_type=AUDIO_FORMATS[fmt]["media_type"],
             headers={
-                "Content-Disposition": f"inline; filename=message_{message_uid}.wav",
+                "Content-Disposition": f"inline; filename=message_{message_uid}.{fmt}",
                 "Accept-Ranges": "bytes",
                 "Cache-Control": "no-cache",
+                "Vary": "Accept",
                 "X-Message-UID": message_uid,
             },
         )
@@ -206,3 +282,70 @@ async def stream_tts(
         raise HTTPException(
             status_code=500, detail=f"Failed to stream voice file: {str(e)}"
         )
+
+
+@router.get("/stream/{message_uid}/segment/{segment}")
+async def stream_tts_segment(
+    message_uid: str,
+    segment: int,
+    conversation_uid: Optional[str] = None,
+    user=Depends(get_current_user) if not DEV_MODE else None,
+):
+    """Stream one sentence of a voice line that is still being generated."""
+    segment_path = get_voice_segment_path(message_uid, segment, conversation_uid)
+    if not segment_path:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Voice segment {segment} for message {message_uid} not found",
+        )
+
+    return FileResponse(
+        segment_path,
+        media_type="audio/wav",
+        headers={
+            "Content-Disposition": f"inline; filename=message_{message_uid}_part{segment}.wav",
+            "X-Message-UID": message_uid,
+        },
+    )
+
+
+@router.get("/queue")
+async def get_tts_queue_stats(user=Depends(get_current_user)):
+    """Get queue depth, timing and batching statistics for speech synthesis."""
+    return {**synthesis_executor.get_stats(), "batching": batching_engine.get_stats()}
+
+
+@router.get("/latents/stats")
+async def get_speaker_latent_stats(user=Depends(get_current_user)):
+    """Get hit statistics for the speaker conditioning latent cache."""
+    return speaker_latent_cache.get_stats()
+
+
+@router.get("/cache/stats")
+async def get_audio_cache_stats(user=Depends(get_current_user)):
+    """Get size and hit statistics for the synthesized audio cache."""
+    return audio_cache.get_stats()
+
+
+@router.get("/encoding/stats")
+async def get_audio_encoding_stats(user=Depends(get_current_user)):
+    """Get statistics for background encoding of compressed voice variants."""
+    return audio_encoder.get_stats()
+
+
+@router.get("/index/stats")
+async def get_voice_index_stats(user=Depends(get_current_user)):
+    """Get lookup statistics for the message voice file index."""
+    return voice_path_index.get_stats()
+
+
+@router.post("/index/repair")
+async def repair_voice_index(user=Depends(get_current_user)):
+    """Scan the conversation directories and record the voice files found."""
+    try:
+        return await repair_voice_paths()
+    except Exception as e:
+        logger.error(f"Failed to repair voice index: {e}")
+        raise HTTPException(
+            status_code=500, detail=f"Failed to repair voice index: {str(e)}"
+        )
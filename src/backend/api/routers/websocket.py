@@ -5,6 +5,8 @@ import asyncio
 from typing import Dict, Set, Any, List, Optional
 from ..security import get_current_user, DEV_MODE
 from ..database import pubsub_client
+from ..services.conversation_service import turn_registry
+from ..services.llm_service import MODEL_PULL_CHANNEL
 
 logger = logging.getLogger(__name__)
 
@@ -155,6 +157,30 @@ async def conversation_websocket_endpoint(websocket: WebSocket, conversation_id:
                     pubsub_client.unsubscribe(channel, handle_message)
                     del conversation_connections[conversation_id]
                     logger.info(f"Removed empty conversation channel: {channel}")
+
+                    # Nobody is left to hear the reply being generated
+                    turn_registry.cancel(conversation_id, "last subscriber left")
     except Exception as e:
         logger.error(f"Error in conversation WebSocket endpoint: {str(e)}")
         raise
+
+
+@router.websocket("/ollama/pulls")
+async def model_pull_websocket_endpoint(websocket: WebSocket):
+    """WebSocket endpoint for model pull progress."""
+    await websocket.accept()
+    logger.info("WebSocket connection accepted for /ws/ollama/pulls")
+
+    async def handle_message(msg: str):
+        await websocket.send_text(msg)
+
+    pubsub_client.subscribe(MODEL_PULL_CHANNEL, handle_message)
+
+    try:
+        while True:
+            # Just keep the connection alive
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        logger.info("WebSocket disconnected from /ws/ollama/pulls")
+    finally:
+        pubsub_client.unsubscribe(MODEL_PULL_CHANNEL, handle_message)
@@ -1,14 +1,17 @@
 import uuid
 import logging
 import os
+import hashlib
+import asyncio
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 
 from api.database import get_database
 from api.services.agent_service import get_agent
-from api.services.llm_service import get_llm_config, generate_text
+from api.services.llm_service import get_llm_config, generate_text, PRIORITY_BATCH
 from api.services.tts_service import generate_speech
 from api.models import MessageType, MessageRating
+from promptBuilderModule.prompt_builder import PromptBuilder, DEFAULT_NUM_CTX
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +28,28 @@ os.makedirs(CONVERSATION_DIR, exist_ok=True)
 # Voiceline storage paths
 VOICELINE_DIR = os.path.join("ttsModule", "voicelines", "messages")
 
+# Reuse of the context Ollama has already evaluated for a conversation
+LLM_CONTEXT_REUSE = os.environ.get("LLM_CONTEXT_REUSE", "true").lower() == "true"
+# Tokens kept free in the context window for the next query and the response
+LLM_CONTEXT_RESERVE_TOKENS = 512
+
+# Number of most recent messages loaded to build a prompt from
+CONVERSATION_HISTORY_LIMIT = int(os.environ.get("CONVERSATION_HISTORY_LIMIT", "40"))
+
+# Rolling conversation summaries: how many new turns (a user message and its
+# response) trigger an update, and the model used. Messages the prompt history
+# still fits are left out of the summary. Without a summary model the
+# conversation's own model is used.
+CONVERSATION_SUMMARY_INTERVAL = int(
+    os.environ.get("CONVERSATION_SUMMARY_INTERVAL", "3")
+)
+CONVERSATION_SUMMARY_MODEL = os.environ.get("CONVERSATION_SUMMARY_MODEL", "")
+CONVERSATION_SUMMARY_MAX_TOKENS = 256
+
+# Conversations with a summary update running, and the tasks running them
+_summaries_in_progress = set()
+_summary_tasks = set()
+
 
 async def create_conversation(
     user_uid: str, title: str = None, agent_uid: str = None
@@ -291,6 +316,23 @@ async def get_conversation_messages(conversation_uid: str) -> List[Dict[str, Any
     return messages
 
 
+async def get_recent_messages(
+    conversation_uid: str, limit: int = CONVERSATION_HISTORY_LIMIT
+) -> List[Dict[str, Any]]:
+    """Get the most recent messages in a conversation, oldest first."""
+    db = get_database()
+    cursor = (
+        db[MESSAGE_COLLECTION]
+        .find({"conversation_uid": conversation_uid})
+        .sort("created_at", -1)
+        .limit(limit)
+    )
+
+    messages = await cursor.to_list(length=limit)
+    messages.reverse()
+    return messages
+
+
 async def add_message(
     conversation_uid: str,
     content: str,
@@ -354,3 +396,256 @@ async def add_message(
         f"Added {message_type} message {message_uid} to conversation {conversation_uid}"
     )
     return message_data
+
+
+def llm_context_fingerprint(model: str, *prompt_parts: Optional[str]) -> str:
+    """Fingerprint the model and prompt parts a stored LLM context was built from."""
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for part in prompt_parts:
+        digest.update(b"\0")
+        digest.update((part or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_reusable_llm_context(
+    conversation: Dict[str, Any], fingerprint: str, num_ctx: int = DEFAULT_NUM_CTX
+) -> Optional[List[int]]:
+    """
+    Get the stored Ollama context for a conversation if the next turn can continue it.
+
+    The context is only reused when it was built from the same model and agent
+    prompt, covers every message except the new user message, and leaves room
+    in the context window for another turn.
+    """
+    if not LLM_CONTEXT_REUSE:
+        return None
+
+    llm_context = conversation.get("llm_context")
+    if not llm_context or not llm_context.get("context"):
+        return None
+
+    conversation_uid = conversation.get("conversation_uid")
+
+    if llm_context.get("fingerprint") != fingerprint:
+        logger.info(
+            f"Agent or model changed, rebuilding context for {conversation_uid}"
+        )
+        return None
+
+    if llm_context.get("message_count") != conversation.get("message_count", 0) - 1:
+        logger.info(f"Stored context is out of sync for {conversation_uid}")
+        return None
+
+    context = llm_context["context"]
+    if len(context) + LLM_CONTEXT_RESERVE_TOKENS > num_ctx:
+        logger.info(f"Stored context is full for {conversation_uid}, rebuilding")
+        return None
+
+    return context
+
+
+async def save_llm_context(
+    conversation_uid: str, context: List[int], fingerprint: str, message_count: int
+):
+    """Store the Ollama context for a conversation so the next turn can continue it."""
+    db = get_database()
+
+    await db[CONVERSATION_COLLECTION].update_one(
+        {"conversation_uid": conversation_uid},
+        {
+            "$set": {
+                "llm_context": {
+                    "context": context,
+                    "fingerprint": fingerprint,
+                    "message_count": message_count,
+                    "updated_at": datetime.utcnow(),
+                }
+            }
+        },
+    )
+    logger.info(
+        f"Saved LLM context of {len(context)} tokens for conversation {conversation_uid}"
+    )
+
+
+def get_conversation_summary(conversation: Dict[str, Any]) -> Optional[str]:
+    """Get the rolling summary of a conversation's older messages, if there is one."""
+    summary = conversation.get("summary")
+    if not summary:
+        return None
+    return summary.get("text") or None
+
+
+def get_unsummarized_messages(
+    conversation: Dict[str, Any], messages: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Drop the messages the conversation summary already covers.
+
+    messages are the most recent messages of the conversation, oldest first.
+    """
+    summarized = (conversation.get("summary") or {}).get("message_count", 0)
+    first_index = conversation.get("message_count", 0) - len(messages)
+    return messages[max(0, summarized - first_index) :]
+
+
+def summary_update_due(conversation: Dict[str, Any], history_length: int) -> bool:
+    """
+    Check if enough turns have passed since the summary was last updated.
+
+    history_length is the number of recent messages the prompt history fits,
+    which are left out of the summary.
+    """
+    summarized = (conversation.get("summary") or {}).get("message_count", 0)
+    summarizable = conversation.get("message_count", 0) - history_length
+    return summarizable - summarized >= CONVERSATION_SUMMARY_INTERVAL * 2
+
+
+def build_summary_prompt(
+    previous_summary: Optional[str], messages: List[Dict[str, Any]]
+) -> str:
+    """Build the prompt that folds new messages into a conversation summary."""
+    lines = []
+    for message in messages:
+        role = "User" if message["message_type"] == MessageType.USER else "Assistant"
+        lines.append(f"{role}: {message['content']}")
+
+    prompt = (
+        "You maintain a running summary of a conversation between a user and an "
+        "assistant. Update the summary with the new messages below. Keep names, "
+        "facts, preferences, decisions and open questions. Write at most 150 "
+        "words of plain prose and reply with the summary only.\n\n"
+    )
+    if previous_summary:
+        prompt += f"CURRENT SUMMARY:\n{previous_summary}\n\n"
+    prompt += "NEW MESSAGES:\n" + "\n".join(lines) + "\n\nUPDATED SUMMARY:"
+    return prompt
+
+
+async def update_conversation_summary(conversation_uid: str, model: str) -> bool:
+    """
+    Fold the messages added since the last update into the conversation summary.
+
+    Only messages older than the ones the prompt history fits in its token
+    budget are summarized. Returns whether the summary was updated.
+    """
+    if conversation_uid in _summaries_in_progress:
+        return False
+
+    _summaries_in_progress.add(conversation_uid)
+    try:
+        conversation = await get_conversation(conversation_uid)
+        if not conversation:
+            return False
+
+        history = PromptBuilder.select_history(
+            await get_recent_messages(conversation_uid)
+        )
+        if not summary_update_due(conversation, len(history)):
+            return False
+
+        summary = conversation.get("summary") or {}
+        summarized = summary.get("message_count", 0)
+        summarizable = conversation.get("message_count", 0) - len(history)
+
+        db = get_database()
+        cursor = (
+            db[MESSAGE_COLLECTION]
+            .find({"conversation_uid": conversation_uid})
+            .sort("created_at", 1)
+            .skip(summarized)
+            .limit(summarizable - summarized)
+        )
+        new_messages = await cursor.to_list(length=summarizable - summarized)
+        if not new_messages:
+            return False
+
+        text = await generate_text(
+            model=CONVERSATION_SUMMARY_MODEL or model,
+            prompt=build_summary_prompt(summary.get("text"), new_messages),
+            temperature=0.2,
+            max_tokens=CONVERSATION_SUMMARY_MAX_TOKENS,
+            priority=PRIORITY_BATCH,
+        )
+
+        await db[CONVERSATION_COLLECTION].update_one(
+            {"conversation_uid": conversation_uid},
+            {
+                "$set": {
+                    "summary": {
+                        "text": text.strip(),
+                        "message_count": summarized + len(new_messages),
+                        "updated_at": datetime.utcnow(),
+                    }
+                }
+            },
+        )
+        logger.info(
+            f"Updated summary of conversation {conversation_uid} with "
+            f"{len(new_messages)} messages"
+        )
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to update summary of {conversation_uid}: {str(e)}")
+        return False
+    finally:
+        _summaries_in_progress.discard(conversation_uid)
+
+
+def schedule_summary_update(conversation_uid: str, model: str):
+    """Update the conversation summary in the background if it is due."""
+    task = asyncio.create_task(update_conversation_summary(conversation_uid, model))
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+
+class TurnRegistry:
+    """
+    Keeps track of the agent turn being generated for each conversation.
+
+    A turn runs as its own task so it can be cancelled when a newer message
+    supersedes it or nobody is listening any more. Cancelling the task aborts
+    the in-flight Ollama request and any voice generation that has not started.
+    """
+
+    def __init__(self):
+        self._turns: Dict[str, asyncio.Task] = {}
+        self.stats = {"started": 0, "cancelled": 0}
+
+    def is_active(self, conversation_uid: str) -> bool:
+        task = self._turns.get(conversation_uid)
+        return task is not None and not task.done()
+
+    def cancel(self, conversation_uid: str, reason: str) -> bool:
+        """Cancel the turn in flight for a conversation, if there is one."""
+        task = self._turns.get(conversation_uid)
+        if task is None or task.done():
+            return False
+
+        logger.info(f"Cancelling turn for conversation {conversation_uid}: {reason}")
+        task.cancel()
+        self.stats["cancelled"] += 1
+        return True
+
+    async def run(self, conversation_uid: str, turn, *args, **kwargs):
+        """Run a turn for a conversation, superseding the one in flight."""
+        self.cancel(conversation_uid, "superseded by a newer message")
+
+        task = asyncio.create_task(turn(*args, **kwargs))
+        self._turns[conversation_uid] = task
+        self.stats["started"] += 1
+
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                # The caller itself was cancelled, not just the turn
+                raise
+            logger.info(f"Turn for conversation {conversation_uid} was cancelled")
+            return None
+        finally:
+            if self._turns.get(conversation_uid) is task:
+                del self._turns[conversation_uid]
+
+
+turn_registry = TurnRegistry()
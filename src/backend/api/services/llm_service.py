@@ -1,11 +1,19 @@
 import uuid
 import logging
+import os
+import time
+import asyncio
+import heapq
+import itertools
 import httpx
 import json
-from typing import Dict, Any, List, Optional
+import hashlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple, Set
 from datetime import datetime
 
-from api.database import get_database
+from api.database import get_database, pubsub_client
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +23,470 @@ LLM_CONFIG_COLLECTION = "llm_configurations"
 # Ollama API
 OLLAMA_API_BASE = "http://localhost:11434/api"
 
+# Ollama backends requests are balanced over, as a comma separated list of API
+# base URLs, and how often their health is checked in seconds
+OLLAMA_BACKENDS = [
+    url.strip().rstrip("/")
+    for url in os.environ.get("OLLAMA_BACKENDS", OLLAMA_API_BASE).split(",")
+    if url.strip()
+]
+OLLAMA_HEALTH_CHECK_INTERVAL = float(
+    os.environ.get("OLLAMA_HEALTH_CHECK_INTERVAL", "15")
+)
+
+# Connection pool limits for the shared Ollama client
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", "20"))
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "10")
+)
+OLLAMA_KEEPALIVE_EXPIRY = float(os.environ.get("OLLAMA_KEEPALIVE_EXPIRY", "120"))
+
+# Per-operation timeouts in seconds
+OLLAMA_CONNECT_TIMEOUT = 5.0
+OLLAMA_DEFAULT_TIMEOUT = 30.0
+OLLAMA_TIMEOUTS = {
+    "generate": 90.0,
+    "tags": 10.0,
+    "pull": 600.0,
+    "delete": 30.0,
+    "ps": 10.0,
+    "load": 120.0,
+}
+
+# Model residency: how long Ollama keeps a model loaded after its last use,
+# and the memory budget for loaded models in bytes (0 means no budget)
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_MEMORY_BUDGET_BYTES = int(os.environ.get("OLLAMA_MEMORY_BUDGET_BYTES", "0"))
+
+# How long the Ollama model catalogue is cached in seconds
+OLLAMA_CATALOGUE_TTL = float(os.environ.get("OLLAMA_CATALOGUE_TTL", "60"))
+
+# Request scheduling: concurrent generations per model, waiting requests per
+# model, and how long a request may wait for a slot in seconds
+LLM_MAX_CONCURRENCY_PER_MODEL = int(
+    os.environ.get("LLM_MAX_CONCURRENCY_PER_MODEL", "2")
+)
+LLM_MAX_QUEUE_SIZE = int(os.environ.get("LLM_MAX_QUEUE_SIZE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "120"))
+
+# Share one upstream generation between identical concurrent requests
+LLM_COALESCE_REQUESTS = (
+    os.environ.get("LLM_COALESCE_REQUESTS", "true").lower() == "true"
+)
+
+# Largest number of prompts a batch generation runs at the same time
+LLM_BATCH_MAX_CONCURRENCY = int(os.environ.get("LLM_BATCH_MAX_CONCURRENCY", "4"))
+
+# Cache of deterministic generations: "off", "memory" or "disk" (memory plus
+# an on-disk tier), the number of entries kept (in memory and on disk together)
+# and their TTL in seconds
+LLM_RESPONSE_CACHE = os.environ.get("LLM_RESPONSE_CACHE", "off").lower()
+LLM_RESPONSE_CACHE_SIZE = int(os.environ.get("LLM_RESPONSE_CACHE_SIZE", "512"))
+LLM_RESPONSE_CACHE_TTL = float(os.environ.get("LLM_RESPONSE_CACHE_TTL", "86400"))
+LLM_RESPONSE_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "..",
+    "data",
+    "llm_cache",
+)
+
+# Generation priorities, lower values are served first
+PRIORITY_VOICE = 0
+PRIORITY_CHAT = 1
+PRIORITY_API_MODULE = 2
+PRIORITY_BATCH = 3
+
+
+class OllamaBackend:
+    """State of one Ollama server in the backend pool."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_checked: Optional[float] = None
+        # Models loaded in memory and models available on disk, None until checked
+        self.loaded_models: Set[str] = set()
+        self.available_models: Optional[Set[str]] = None
+
+    def mark_failed(self, error: Exception):
+        """Take the backend out of rotation until its next successful health check."""
+        self.healthy = False
+        self.failures += 1
+        self.last_error = str(error)
+        logger.warning(f"Ollama backend {self.base_url} failed: {error}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_checked": self.last_checked,
+            "loaded_models": sorted(self.loaded_models),
+            "available_models": (
+                sorted(self.available_models)
+                if self.available_models is not None
+                else None
+            ),
+        }
+
+
+class OllamaClient:
+    """
+    Long-lived HTTP client for a pool of Ollama backends.
+
+    Keeps one connection pool for the lifetime of the app so turns reuse
+    keep-alive connections instead of opening a new TCP connection per call.
+    Requests for a model go to the least loaded healthy backend that already
+    has the model loaded, and fail over to the next backend on errors.
+    """
+
+    def __init__(
+        self,
+        backends: Optional[List[str]] = None,
+        max_connections: int = OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections: int = OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = OLLAMA_KEEPALIVE_EXPIRY,
+        timeouts: Optional[Dict[str, Optional[float]]] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.backends = [OllamaBackend(url) for url in (backends or OLLAMA_BACKENDS)]
+        self.timeouts = {**OLLAMA_TIMEOUTS, **(timeouts or {})}
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._client = httpx.AsyncClient(limits=self.limits, transport=transport)
+        self._health_task: Optional[asyncio.Task] = None
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "failovers": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0,
+            "operations": {},
+        }
+
+    def _timeout(self, operation: str) -> httpx.Timeout:
+        """Get the timeout for an operation."""
+        return httpx.Timeout(
+            self.timeouts.get(operation, OLLAMA_DEFAULT_TIMEOUT),
+            connect=OLLAMA_CONNECT_TIMEOUT,
+        )
+
+    def _start(self, operation: str, backend: OllamaBackend):
+        self.stats["requests"] += 1
+        self.stats["operations"][operation] = (
+            self.stats["operations"].get(operation, 0) + 1
+        )
+        self.stats["in_flight"] += 1
+        self.stats["peak_in_flight"] = max(
+            self.stats["peak_in_flight"], self.stats["in_flight"]
+        )
+        backend.requests += 1
+        backend.in_flight += 1
+
+    def _finish(self, backend: OllamaBackend):
+        self.stats["in_flight"] -= 1
+        backend.in_flight -= 1
+
+    def _candidates(self, model: Optional[str] = None) -> List[OllamaBackend]:
+        """
+        Order backends for a request.
+
+        Healthy backends come first. For a model, backends that have it loaded
+        come before backends that only have it on disk, and backends known not
+        to have it come last. Ties go to the backend with fewest requests in flight.
+        """
+        model = _normalize_model_name(model) if model else None
+
+        def rank(backend: OllamaBackend):
+            if model is None:
+                holds = 0
+            elif model in backend.loaded_models:
+                holds = 0
+            elif backend.available_models is None or model in backend.available_models:
+                holds = 1
+            else:
+                holds = 2
+            return (not backend.healthy, holds, backend.in_flight)
+
+        return sorted(self.backends, key=rank)
+
+    @staticmethod
+    def _should_fail_over(response: httpx.Response) -> bool:
+        """Server errors mean the backend is unhealthy, other errors are the caller's."""
+        return response.status_code >= 500
+
+    async def request(
+        self,
+        operation: str,
+        method: str,
+        path: str,
+        model: Optional[str] = None,
+        **kwargs,
+    ) -> httpx.Response:
+        """Send a request to the best backend, failing over to the others on errors."""
+        last_error: Optional[Exception] = None
+
+        for attempt, backend in enumerate(self._candidates(model)):
+            if attempt:
+                self.stats["failovers"] += 1
+
+            self._start(operation, backend)
+            try:
+                response = await self._client.request(
+                    method,
+                    f"{backend.base_url}{path}",
+                    timeout=self._timeout(operation),
+                    **kwargs,
+                )
+            except httpx.TransportError as e:
+                self.stats["errors"] += 1
+                backend.mark_failed(e)
+                last_error = e
+                continue
+            finally:
+                self._finish(backend)
+
+            if self._should_fail_over(response):
+                self.stats["errors"] += 1
+                backend.mark_failed(
+                    httpx.HTTPStatusError(
+                        f"Server error {response.status_code}",
+                        request=response.request,
+                        response=response,
+                    )
+                )
+                last_error = response
+                continue
+
+            if model and response.is_success:
+                backend.loaded_models.add(_normalize_model_name(model))
+            return response
+
+        if isinstance(last_error, httpx.Response):
+            # Every backend answered with a server error, let the caller see it
+            return last_error
+        raise last_error or httpx.ConnectError("No Ollama backends configured")
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        operation: str,
+        method: str,
+        path: str,
+        model: Optional[str] = None,
+        backend: Optional[OllamaBackend] = None,
+        **kwargs,
+    ):
+        """
+        Open a streaming request to the best backend, or to the given backend.
+
+        Fails over to the next backend if the request cannot be started. Once
+        the response has started streaming it stays on that backend.
+        """
+        last_error: Optional[Exception] = None
+        candidates = [backend] if backend is not None else self._candidates(model)
+
+        for attempt, backend in enumerate(candidates):
+            if attempt:
+                self.stats["failovers"] += 1
+
+            self._start(operation, backend)
+            try:
+                request = self._client.build_request(
+                    method,
+                    f"{backend.base_url}{path}",
+                    timeout=self._timeout(operation),
+                    **kwargs,
+                )
+                try:
+                    response = await self._client.send(request, stream=True)
+                except httpx.TransportError as e:
+                    self.stats["errors"] += 1
+                    backend.mark_failed(e)
+                    last_error = e
+                    continue
+
+                try:
+                    if self._should_fail_over(response):
+                        await response.aread()
+                        self.stats["errors"] += 1
+                        last_error = httpx.HTTPStatusError(
+                            f"Server error {response.status_code}",
+                            request=request,
+                            response=response,
+                        )
+                        backend.mark_failed(last_error)
+                        continue
+
+                    if model and response.is_success:
+                        backend.loaded_models.add(_normalize_model_name(model))
+
+                    try:
+                        yield response
+                    except httpx.HTTPError:
+                        self.stats["errors"] += 1
+                        raise
+                    return
+                finally:
+                    await response.aclose()
+            finally:
+                self._finish(backend)
+
+        raise last_error or httpx.ConnectError("No Ollama backends configured")
+
+    async def broadcast(
+        self, operation: str, method: str, path: str, **kwargs
+    ) -> List[Tuple[OllamaBackend, httpx.Response]]:
+        """Send a request to every healthy backend, skipping those that fail."""
+        backends = [b for b in self.backends if b.healthy] or self.backends
+
+        async def send(backend: OllamaBackend):
+            self._start(operation, backend)
+            try:
+                return await self._client.request(
+                    method,
+                    f"{backend.base_url}{path}",
+                    timeout=self._timeout(operation),
+                    **kwargs,
+                )
+            except httpx.TransportError as e:
+                self.stats["errors"] += 1
+                backend.mark_failed(e)
+                return e
+            finally:
+                self._finish(backend)
+
+        results = await asyncio.gather(*(send(b) for b in backends))
+        responses = [
+            (backend, result)
+            for backend, result in zip(backends, results)
+            if isinstance(result, httpx.Response)
+        ]
+        if not responses:
+            raise results[0]
+        return responses
+
+    async def check_health(self):
+        """Check every backend and refresh which models it has loaded and available."""
+
+        async def check(backend: OllamaBackend):
+            try:
+                ps = await self._client.get(
+                    f"{backend.base_url}/ps", timeout=self._timeout("ps")
+                )
+                ps.raise_for_status()
+                tags = await self._client.get(
+                    f"{backend.base_url}/tags", timeout=self._timeout("tags")
+                )
+                tags.raise_for_status()
+            except httpx.HTTPError as e:
+                backend.mark_failed(e)
+                return
+            finally:
+                backend.last_checked = time.time()
+
+            if not backend.healthy:
+                logger.info(f"Ollama backend {backend.base_url} is healthy again")
+            backend.healthy = True
+            backend.last_error = None
+            backend.loaded_models = {
+                _normalize_model_name(m["name"]) for m in ps.json().get("models", [])
+            }
+            backend.available_models = {
+                _normalize_model_name(m["name"]) for m in tags.json().get("models", [])
+            }
+
+        await asyncio.gather(*(check(b) for b in self.backends))
+
+    async def _health_loop(self, interval: float):
+        while True:
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"Ollama health check failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start_health_checks(self, interval: float = OLLAMA_HEALTH_CHECK_INTERVAL):
+        """Check backend health periodically in the background."""
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop(interval))
+
+    def _pool_connections(self) -> Optional[List[Any]]:
+        """Best-effort access to the underlying connection pool."""
+        transport = getattr(self._client, "_transport", None)
+        pool = getattr(transport, "_pool", None)
+        return getattr(pool, "connections", None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get usage counters for the client, its connection pool and backends."""
+        stats = {
+            **self.stats,
+            "operations": dict(self.stats["operations"]),
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "open_connections": None,
+            "idle_connections": None,
+            "backends": [backend.to_dict() for backend in self.backends],
+        }
+
+        connections = self._pool_connections()
+        if connections is not None:
+            stats["open_connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for conn in connections if conn.is_idle())
+
+        return stats
+
+    async def aclose(self):
+        """Stop health checks and close the client and its connection pool."""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        await self._client.aclose()
+
+
+# App-scoped Ollama client, created on startup and closed on shutdown
+ollama_client: Optional[OllamaClient] = None
+
+
+async def init_ollama_client():
+    """Create the shared Ollama client and start checking backend health."""
+    global ollama_client
+    if ollama_client is None:
+        ollama_client = OllamaClient()
+        logger.info(
+            f"Created Ollama client for {', '.join(OLLAMA_BACKENDS)} "
+            f"(max_connections={OLLAMA_MAX_CONNECTIONS})"
+        )
+    ollama_client.start_health_checks()
+
+
+async def close_ollama_client():
+    """Close the shared Ollama client."""
+    global ollama_client
+    if ollama_client is not None:
+        await ollama_client.aclose()
+        ollama_client = None
+        logger.info("Ollama client closed")
+
+
+def get_ollama_client() -> OllamaClient:
+    """Return the shared Ollama client, creating it if the app has not."""
+    global ollama_client
+    if ollama_client is None:
+        logger.info("Ollama client not initialised on startup, creating it now")
+        ollama_client = OllamaClient()
+    return ollama_client
+
 
 async def create_llm_config(
     name: str,
@@ -125,45 +597,86 @@ async def archive_llm_config(config_uid: str) -> bool:
     return True
 
 
-# Ollama API functions
+class ModelCatalogue:
+    """
+    TTL cache of the models available on the Ollama backends.
 
+    Concurrent refreshes share one request to Ollama. Pulling or deleting a
+    model invalidates the cache.
+    """
 
-async def list_ollama_models() -> List[Dict[str, Any]]:
-    """List available models from Ollama."""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{OLLAMA_API_BASE}/tags")
+    def __init__(self, ttl: float = OLLAMA_CATALOGUE_TTL):
+        self.ttl = ttl
+        self._models: Optional[List[Dict[str, Any]]] = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self.stats = {"hits": 0, "refreshes": 0, "invalidations": 0}
+
+    def invalidate(self):
+        self._models = None
+        self.stats["invalidations"] += 1
+
+    async def get(self, refresh: bool = False) -> List[Dict[str, Any]]:
+        """Get the catalogue, fetching it from Ollama if it is missing or stale."""
+        if not refresh and self._models is not None and time.time() < self._expires_at:
+            self.stats["hits"] += 1
+            return self._models
+
+        async with self._lock:
+            # Another request may have refreshed it while this one waited
+            if (
+                not refresh
+                and self._models is not None
+                and time.time() < self._expires_at
+            ):
+                self.stats["hits"] += 1
+                return self._models
+
+            models = await self._fetch()
+            self._models = models
+            self._expires_at = time.time() + self.ttl
+            self.stats["refreshes"] += 1
+            return models
+
+    @staticmethod
+    async def _fetch() -> List[Dict[str, Any]]:
+        models: Dict[str, Dict[str, Any]] = {}
+        for _, response in await get_ollama_client().broadcast("tags", "GET", "/tags"):
             response.raise_for_status()
-            data = response.json()
-            return data.get("models", [])
-    except httpx.HTTPError as e:
-        logger.error(f"Error fetching models from Ollama: {e}")
-        raise
+            for model in response.json().get("models", []):
+                models.setdefault(
+                    model["name"],
+                    {
+                        "name": model["name"],
+                        "size": model.get("size", 0),
+                        "digest": model.get("digest"),
+                        "modified_at": model.get("modified_at", ""),
+                        "details": model.get("details") or {},
+                    },
+                )
+        return list(models.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "ttl": self.ttl,
+            "cached": self._models is not None and time.time() < self._expires_at,
+        }
+
+
+model_catalogue = ModelCatalogue()
+
+
+# Ollama API functions
 
 
-async def pull_ollama_model(model_name: str) -> Dict[str, Any]:
-    """Pull a model from Ollama."""
+async def list_ollama_models(refresh: bool = False) -> List[Dict[str, Any]]:
+    """List available models across all Ollama backends, from cache if fresh."""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{OLLAMA_API_BASE}/pull", json={"name": model_name}
-            )
-            response.raise_for_status()
-            return {
-                "status": "success",
-                "message": f"Model {model_name} pulled successfully",
-            }
+        return await model_catalogue.get(refresh)
     except httpx.HTTPError as e:
-        logger.error(f"Error pulling model {model_name} from Ollama: {e}")
-        error_msg = f"Failed to pull model: {str(e)}"
-        if e.response and e.response.text:
-            try:
-                error_data = json.loads(e.response.text)
-                if "error" in error_data:
-                    error_msg = error_data["error"]
-            except:
-                pass
-        raise ValueError(error_msg)
+        logger.error(f"Error fetching models from Ollama: {e}")
+        raise
 
 
 async def delete_ollama_model(model_name: str) -> Dict[str, Any]:
@@ -172,26 +685,939 @@ async def delete_ollama_model(model_name: str) -> Dict[str, Any]:
         data = json.dumps({"model": model_name})
         headers = {"Content-Type": "application/json"}
 
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                "DELETE", f"{OLLAMA_API_BASE}/delete", content=data, headers=headers
-            )
+        responses = await get_ollama_client().broadcast(
+            "delete", "DELETE", "/delete", content=data, headers=headers
+        )
+        # Backends that never had the model answer 404, only fail if none had it
+        found = [r for _, r in responses if r.status_code != 404] or [responses[0][1]]
+        for response in found:
             response.raise_for_status()
-            return {
-                "status": "success",
-                "message": f"Model {model_name} deleted successfully",
-            }
+        model_catalogue.invalidate()
+        return {
+            "status": "success",
+            "message": f"Model {model_name} deleted successfully",
+        }
     except httpx.HTTPError as e:
         logger.error(f"Error deleting model {model_name} from Ollama: {e}")
-        error_msg = f"Failed to delete model: {str(e)}"
-        if e.response and e.response.text:
+        raise ValueError(_extract_ollama_error(e, f"Failed to delete model: {str(e)}"))
+
+
+# Channel model pull progress is published on
+MODEL_PULL_CHANNEL = "ollama:pulls"
+# Finished pull jobs are forgotten after this many seconds, and beyond this
+# many finished jobs the oldest are forgotten first
+MODEL_PULL_JOB_TTL = float(os.environ.get("MODEL_PULL_JOB_TTL", "3600"))
+MODEL_PULL_MAX_FINISHED_JOBS = int(os.environ.get("MODEL_PULL_MAX_FINISHED_JOBS", "50"))
+
+
+class ModelPullManager:
+    """
+    Runs model pulls as background jobs.
+
+    Each job streams Ollama's NDJSON progress and publishes it on the model
+    pull channel. Cancelling a job stops the download. Ollama keeps the
+    layers it has downloaded, so resuming a job continues where it stopped.
+    Finished jobs are kept for a while so their outcome can be looked up.
+    """
+
+    ACTIVE_STATUSES = ("queued", "running", "cancelling")
+
+    def __init__(
+        self,
+        job_ttl: float = MODEL_PULL_JOB_TTL,
+        max_finished_jobs: int = MODEL_PULL_MAX_FINISHED_JOBS,
+    ):
+        self.job_ttl = job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # job id -> monotonic time its last task finished, oldest first
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+
+    def _prune(self):
+        """Forget finished jobs that are too old or too many."""
+        expired_before = time.monotonic() - self.job_ttl
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if (
+                finished_at >= expired_before
+                and len(self._finished) <= self.max_finished_jobs
+            ):
+                break
+            del self._finished[job_id]
+            self.jobs.pop(job_id, None)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self._prune()
+        return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """List pull jobs, newest first."""
+        self._prune()
+        return sorted(self.jobs.values(), key=lambda j: j["created_at"], reverse=True)
+
+    def start(self, model_name: str) -> Dict[str, Any]:
+        """Start pulling a model, or return the job already pulling it."""
+        self._prune()
+        for job in self.jobs.values():
+            if job["model"] == model_name and job["status"] in self.ACTIVE_STATUSES:
+                return job
+
+        now = datetime.utcnow().isoformat()
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "model": model_name,
+            "status": "queued",
+            "progress": None,
+            "completed": 0,
+            "total": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.jobs[job["job_id"]] = job
+        self._launch(job)
+        return job
+
+    def resume(self, job_id: str) -> Dict[str, Any]:
+        """Restart a cancelled or failed pull."""
+        job = self.get_job(job_id)
+        if not job:
+            raise ValueError(f"Pull job {job_id} not found")
+        if job["status"] in self.ACTIVE_STATUSES:
+            return job
+        if job["status"] == "completed":
+            raise ValueError(f"Pull job {job_id} has already completed")
+
+        job.update({"status": "queued", "error": None})
+        self._finished.pop(job_id, None)
+        self._launch(job)
+        return job
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        """
+        Stop a running pull. It can be resumed later.
+
+        The job is "cancelling" until its task has stopped, then "cancelled".
+        """
+        job = self.get_job(job_id)
+        if not job:
+            raise ValueError(f"Pull job {job_id} not found")
+
+        task = self._tasks.get(job_id)
+        if task and not task.done():
+            job["status"] = "cancelling"
+            task.cancel()
+        return job
+
+    def _launch(self, job: Dict[str, Any]):
+        job_id = job["job_id"]
+        task = asyncio.create_task(self._run(job))
+        self._tasks[job_id] = task
+
+        def forget(done: asyncio.Task):
+            # A resumed job may already have a newer task registered
+            if self._tasks.get(job_id) is done:
+                del self._tasks[job_id]
+                # A task cancelled before it started never ran its handler
+                if job["status"] in self.ACTIVE_STATUSES:
+                    job["status"] = "cancelled"
+                self._finished[job_id] = time.monotonic()
+
+        task.add_done_callback(forget)
+
+    async def _publish(self, job: Dict[str, Any], final: bool = False):
+        job["updated_at"] = datetime.utcnow().isoformat()
+        try:
+            await pubsub_client.publish(
+                MODEL_PULL_CHANNEL,
+                json.dumps({"type": "model_pull_progress", "job": job}),
+                buffer=final,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to publish model pull progress: {str(e)}")
+
+    async def _pull_from(self, client: OllamaClient, backend, job: Dict[str, Any]):
+        last_percent = None
+
+        async with client.stream(
+            "pull",
+            "POST",
+            "/pull",
+            backend=backend,
+            json={"name": job["model"], "stream": True},
+        ) as response:
+            if response.is_error:
+                await response.aread()
+            response.raise_for_status()
+
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+
+                data = json.loads(line)
+                if "error" in data:
+                    raise ValueError(data["error"])
+
+                job["progress"] = data.get("status")
+                job["total"] = data.get("total", job["total"])
+                job["completed"] = data.get("completed", job["completed"])
+
+                # Publish status changes and whole percent steps, not every chunk
+                percent = (
+                    int(job["completed"] * 100 / job["total"]) if job["total"] else None
+                )
+                if data.get("completed") is None or percent != last_percent:
+                    last_percent = percent
+                    await self._publish(job)
+
+    async def _run(self, job: Dict[str, Any]):
+        job["status"] = "running"
+        await self._publish(job)
+
+        try:
+            client = get_ollama_client()
+            # Pull onto every backend so requests for the model can go to any of them
+            backends = [b for b in client.backends if b.healthy] or client.backends
+            for backend in backends:
+                await self._pull_from(client, backend, job)
+
+            job["status"] = "completed"
+            model_catalogue.invalidate()
+            logger.info(f"Pulled model {job['model']}")
+        except asyncio.CancelledError:
+            job["status"] = "cancelled"
+            logger.info(f"Cancelled pull of model {job['model']}")
+            await self._publish(job, final=True)
+            raise
+        except httpx.HTTPError as e:
+            job["status"] = "failed"
+            job["error"] = _extract_ollama_error(e, f"Failed to pull model: {str(e)}")
+            logger.error(f"Error pulling model {job['model']} from Ollama: {e}")
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            logger.error(f"Error pulling model {job['model']} from Ollama: {e}")
+
+        await self._publish(job, final=True)
+
+
+model_pull_manager = ModelPullManager()
+
+
+def _normalize_model_name(model: str) -> str:
+    """Normalize a model name the way Ollama reports it (default tag is latest)."""
+    return model if ":" in model else f"{model}:latest"
+
+
+class ModelResidencyManager:
+    """
+    Keeps track of which models Ollama has loaded.
+
+    Models are loaded with an explicit keep_alive. When a memory budget is set,
+    the least recently used models are unloaded before a model that does not
+    fit is loaded.
+    """
+
+    def __init__(
+        self,
+        keep_alive: str = OLLAMA_KEEP_ALIVE,
+        memory_budget: int = OLLAMA_MEMORY_BUDGET_BYTES,
+    ):
+        self.keep_alive = keep_alive
+        self.memory_budget = memory_budget
+        # Resident models in least to most recently used order
+        self.resident: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    def _used_memory(self) -> int:
+        return sum(info["size"] for info in self.resident.values())
+
+    async def refresh(self):
+        """Sync the resident models with what the Ollama backends report as loaded."""
+        loaded = {}
+        for backend, response in await get_ollama_client().broadcast(
+            "ps", "GET", "/ps"
+        ):
+            response.raise_for_status()
+            models = response.json().get("models", [])
+            backend.loaded_models = {_normalize_model_name(m["name"]) for m in models}
+            for m in models:
+                loaded.setdefault(_normalize_model_name(m["name"]), m)
+
+        async with self._lock:
+            for name in list(self.resident):
+                if name not in loaded:
+                    del self.resident[name]
+
+            for name, info in loaded.items():
+                if name in self.resident:
+                    self.resident[name]["size"] = info.get("size", 0)
+                    self.resident[name]["expires_at"] = info.get("expires_at")
+                else:
+                    # Models loaded outside of this process count as least recent
+                    self.resident[name] = {
+                        "size": info.get("size", 0),
+                        "last_used": None,
+                        "expires_at": info.get("expires_at"),
+                    }
+                    self.resident.move_to_end(name, last=False)
+
+    async def _model_size(self, model: str) -> int:
+        """Estimate the memory a model needs from its size in the catalogue."""
+        try:
+            for info in await list_ollama_models():
+                if _normalize_model_name(info["name"]) == model:
+                    return info.get("size", 0)
+        except Exception as e:
+            logger.warning(f"Could not look up size of model {model}: {e}")
+        return 0
+
+    async def _unload(self, model: str):
+        client = get_ollama_client()
+        for backend, response in await client.broadcast(
+            "load", "POST", "/generate", json={"model": model, "keep_alive": 0}
+        ):
+            response.raise_for_status()
+            backend.loaded_models.discard(model)
+
+    async def ensure_resident(self, model: str):
+        """Mark a model as used, evicting least recently used models if it would not fit."""
+        model = _normalize_model_name(model)
+
+        # Fetch the catalogue outside the lock so a slow backend does not hold
+        # up callers whose models are already resident
+        size = 0
+        if self.memory_budget > 0 and model not in self.resident:
+            size = await self._model_size(model)
+
+        async with self._lock:
+            if model in self.resident:
+                self.resident[model]["last_used"] = time.time()
+                self.resident.move_to_end(model)
+                return
+
+            while (
+                self.memory_budget > 0
+                and self.resident
+                and self._used_memory() + size > self.memory_budget
+            ):
+                evicted, _ = self.resident.popitem(last=False)
+                logger.info(f"Unloading least recently used model: {evicted}")
+                try:
+                    await self._unload(evicted)
+                except httpx.HTTPError as e:
+                    logger.warning(f"Failed to unload model {evicted}: {e}")
+
+            self.resident[model] = {
+                "size": size,
+                "last_used": time.time(),
+                "expires_at": None,
+            }
+
+    async def preload(self, model: str):
+        """Load a model into memory without generating anything."""
+        await self.ensure_resident(model)
+        response = await get_ollama_client().request(
+            "load",
+            "POST",
+            "/generate",
+            model=model,
+            json={"model": model, "keep_alive": self.keep_alive},
+        )
+        response.raise_for_status()
+        logger.info(f"Preloaded model: {model}")
+
+    def get_resident_models(self) -> List[Dict[str, Any]]:
+        """List resident models, most recently used first."""
+        return [
+            {"name": name, **info} for name, info in reversed(self.resident.items())
+        ]
+
+
+residency_manager = ModelResidencyManager()
+
+
+async def warm_up_models():
+    """Preload the models used by active agents so their first turn is not a cold load."""
+    from api.services.agent_service import get_all_agents
+
+    try:
+        agents = await get_all_agents()
+    except Exception as e:
+        logger.warning(f"Could not load agents for model warm-up: {e}")
+        return
+
+    models = []
+    for agent in agents:
+        if agent.get("is_archived"):
+            continue
+        config = await get_llm_config(agent.get("llm_config_uid"))
+        if config and not config.get("is_archived") and config["model"] not in models:
+            models.append(config["model"])
+
+    for model in models:
+        try:
+            await residency_manager.preload(model)
+        except Exception as e:
+            logger.warning(f"Failed to preload model {model}: {e}")
+
+    logger.info(f"Model warm-up finished for {len(models)} models")
+
+
+class LLMQueueFullError(Exception):
+    """Raised when a model's generation queue has no room for another request."""
+
+
+class LLMQueueTimeoutError(Exception):
+    """Raised when a request waited too long for a generation slot."""
+
+
+class LLMScheduler:
+    """
+    Limits concurrent generations per model.
+
+    Requests beyond the concurrency limit wait in a bounded per-model priority
+    queue. Requests that find the queue full are rejected straight away.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY_PER_MODEL,
+        max_queue_size: int = LLM_MAX_QUEUE_SIZE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self._active: Dict[str, int] = {}
+        self._waiting: Dict[str, List[Tuple[int, int, asyncio.Future]]] = {}
+        self._sequence = itertools.count()
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "peak_queue_depth": 0,
+            "total_wait_time": 0.0,
+        }
+
+    def queue_depth(self, model: Optional[str] = None) -> int:
+        """Number of requests waiting for a slot, for one model or all models."""
+        if model is not None:
+            return len(self._waiting.get(_normalize_model_name(model), []))
+        return sum(len(waiting) for waiting in self._waiting.values())
+
+    def check_capacity(self, model: str):
+        """Raise LLMQueueFullError if a new request for the model would be rejected."""
+        model = _normalize_model_name(model)
+        if (
+            self._active.get(model, 0) >= self.max_concurrency
+            and self.queue_depth(model) >= self.max_queue_size
+        ):
+            self.stats["rejected"] += 1
+            raise LLMQueueFullError(f"Generation queue for model {model} is full")
+
+    async def acquire(self, model: str, priority: int = PRIORITY_CHAT):
+        """Wait for a generation slot for the model."""
+        model = _normalize_model_name(model)
+        self.stats["submitted"] += 1
+
+        waiting = self._waiting.setdefault(model, [])
+        if self._active.get(model, 0) < self.max_concurrency and not waiting:
+            self._active[model] = self._active.get(model, 0) + 1
+            return
+
+        if len(waiting) >= self.max_queue_size:
+            self.stats["rejected"] += 1
+            raise LLMQueueFullError(f"Generation queue for model {model} is full")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future)
+        heapq.heappush(waiting, entry)
+        self.stats["peak_queue_depth"] = max(
+            self.stats["peak_queue_depth"], self.queue_depth()
+        )
+
+        start_time = time.time()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the request gave up
+                self.release(model)
+            elif entry in waiting:
+                waiting.remove(entry)
+                heapq.heapify(waiting)
+
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["timed_out"] += 1
+                raise LLMQueueTimeoutError(
+                    f"Timed out waiting for a generation slot for model {model}"
+                )
+            raise
+        finally:
+            self.stats["total_wait_time"] += time.time() - start_time
+
+    def release(self, model: str):
+        """Release a slot, handing it to the highest priority waiting request."""
+        model = _normalize_model_name(model)
+        waiting = self._waiting.get(model, [])
+
+        while waiting:
+            _, _, future = heapq.heappop(waiting)
+            if not future.done():
+                # The slot passes directly to the waiter, the active count stays
+                future.set_result(True)
+                return
+
+        self._active[model] = max(self._active.get(model, 0) - 1, 0)
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int = PRIORITY_CHAT):
+        """Hold a generation slot for the model for the duration of the block."""
+        await self.acquire(model, priority)
+        try:
+            yield
+        finally:
+            self.stats["completed"] += 1
+            self.release(model)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and throughput counters."""
+        return {
+            **self.stats,
+            "max_concurrency": self.max_concurrency,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": self.queue_depth(),
+            "models": {
+                model: {
+                    "active": self._active.get(model, 0),
+                    "queued": len(self._waiting.get(model, [])),
+                }
+                for model in set(self._active) | set(self._waiting)
+            },
+        }
+
+
+llm_scheduler = LLMScheduler()
+
+
+class GenerationCache:
+    """
+    Content-addressed cache of deterministic generations.
+
+    Entries are keyed on the model, the full options dict and a hash of the
+    prompt (and context), and evicted by LRU and TTL. With a cache directory
+    set, entries are also written to disk and survive restarts. The files
+    count towards max_entries like entries in memory; they are indexed on
+    startup and only read back when requested.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = LLM_RESPONSE_CACHE in ("memory", "disk"),
+        max_entries: int = LLM_RESPONSE_CACHE_SIZE,
+        ttl: float = LLM_RESPONSE_CACHE_TTL,
+        cache_dir: Optional[str] = (
+            LLM_RESPONSE_CACHE_DIR if LLM_RESPONSE_CACHE == "disk" else None
+        ),
+    ):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        # Entries that are only on disk so far are indexed with None
+        self._entries: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0}
+
+        if self.enabled and self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_index()
+
+    def _load_index(self):
+        """Index the cache files left by earlier runs, pruning expired ones."""
+        now = time.time()
+        files = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".json"):
+                continue
+            key = filename[: -len(".json")]
+            try:
+                modified = os.path.getmtime(self._disk_path(key))
+            except OSError:
+                continue
+            if now - modified > self.ttl:
+                self._remove_file(key)
+            else:
+                files.append((modified, key))
+
+        for _, key in sorted(files):
+            self._entries[key] = None
+        self._evict()
+        logger.info(f"Indexed {len(self._entries)} cached generations on disk")
+
+    @staticmethod
+    def is_deterministic(params: Dict[str, Any]) -> bool:
+        """Whether a request always produces the same output."""
+        options = params.get("options", {})
+        return options.get("temperature") == 0 or options.get("seed") is not None
+
+    @staticmethod
+    def make_key(params: Dict[str, Any]) -> str:
+        """Build the cache key for a generate request."""
+        prompt_hash = hashlib.sha256(params["prompt"].encode("utf-8")).hexdigest()
+        key_data = {
+            "model": _normalize_model_name(params["model"]),
+            "options": params.get("options", {}),
+            "prompt": prompt_hash,
+            "context": params.get("context"),
+        }
+        return hashlib.sha256(
+            json.dumps(key_data, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def lookup_key(self, params: Dict[str, Any]) -> Optional[str]:
+        """Get the cache key for a request, or None if it should bypass the cache."""
+        if not self.enabled:
+            return None
+        if not self.is_deterministic(params):
+            self.stats["bypassed"] += 1
+            return None
+        return self.make_key(params)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached response, or None if there is no fresh entry."""
+        entry = self._entries.get(key)
+        from_disk = False
+
+        if entry is None and key in self._entries:
+            try:
+                with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                from_disk = True
+            except Exception as e:
+                logger.warning(f"Failed to read cached generation {key}: {e}")
+
+        if entry is None or time.time() - entry["created_at"] > self.ttl:
+            if key in self._entries:
+                self._remove(key)
+            self.stats["misses"] += 1
+            return None
+
+        if from_disk:
+            self.stats["disk_hits"] += 1
+            self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry["data"]
+
+    def set(self, key: str, data: Dict[str, Any]):
+        """Store a response."""
+        entry = {"created_at": time.time(), "data": data}
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._evict()
+
+        if self.cache_dir:
             try:
-                error_data = json.loads(e.response.text)
-                if "error" in error_data:
-                    error_msg = error_data["error"]
-            except:
-                pass
-        raise ValueError(error_msg)
+                with open(self._disk_path(key), "w", encoding="utf-8") as f:
+                    json.dump(entry, f)
+            except Exception as e:
+                logger.warning(f"Failed to write cached generation {key}: {e}")
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            if self.cache_dir:
+                self._remove_file(evicted)
+
+    def _remove_file(self, key: str):
+        try:
+            os.remove(self._disk_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        if self.cache_dir:
+            self._remove_file(key)
+
+    def clear(self):
+        """Remove all cached responses."""
+        for key in list(self._entries):
+            self._remove(key)
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith(".json"):
+                    self._remove_file(filename[: -len(".json")])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit and miss counters."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "disk": self.cache_dir is not None,
+            "entries": len(self._entries),
+            "loaded_entries": sum(1 for e in self._entries.values() if e is not None),
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+        }
+
+
+generation_cache = GenerationCache()
+
+
+class SharedGeneration:
+    """
+    One upstream generation that any number of requests can follow.
+
+    Chunks are kept as they arrive so requests that join late replay the
+    chunks they missed before following the live stream.
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.final: Dict[str, Any] = {}
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def append(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(
+        self,
+        final: Optional[Dict[str, Any]] = None,
+        error: Optional[BaseException] = None,
+    ):
+        if self.done:
+            return
+        self.final = final or {}
+        self.error = error
+        self.done = True
+        self._notify()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Yield every chunk of the generation, raising its error if it failed."""
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class GenerationCoalescer:
+    """
+    Single-flight coalescing of identical in-flight generate requests.
+
+    Requests with the same model, options, prompt and context share one
+    upstream generation. The generation runs in its own task so it survives
+    any single request going away, and is cancelled when every request
+    following it has gone.
+    """
+
+    def __init__(self, enabled: bool = LLM_COALESCE_REQUESTS):
+        self.enabled = enabled
+        self._in_flight: Dict[str, SharedGeneration] = {}
+        self.stats = {"generations": 0, "coalesced": 0, "cancelled": 0}
+
+    async def _run(self, key: Optional[str], shared: SharedGeneration, start):
+        try:
+            await start(shared)
+            shared.finish(shared.final)
+        except asyncio.CancelledError:
+            shared.finish(error=ValueError("Generation was cancelled"))
+            raise
+        except Exception as e:
+            shared.finish(error=e)
+        finally:
+            if key is not None and self._in_flight.get(key) is shared:
+                del self._in_flight[key]
+
+    async def generate(
+        self,
+        params: Dict[str, Any],
+        start,
+        final: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Follow the upstream generation for a request, starting it if needed.
+
+        start is called with the SharedGeneration to fill when no identical
+        request is in flight.
+        """
+        key = GenerationCache.make_key(params) if self.enabled else None
+        shared = self._in_flight.get(key) if key is not None else None
+
+        if shared is None:
+            shared = SharedGeneration()
+            if key is not None:
+                self._in_flight[key] = shared
+            shared.task = asyncio.create_task(self._run(key, shared, start))
+            self.stats["generations"] += 1
+        else:
+            logger.info(f"Joining in-flight generation for model {params['model']}")
+            self.stats["coalesced"] += 1
+
+        shared.subscribers += 1
+        try:
+            async for chunk in shared.follow():
+                yield chunk
+            _store_final_response(shared.final, final)
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.done:
+                # Nobody is waiting for this generation any more
+                self.stats["cancelled"] += 1
+                shared.task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "in_flight": len(self._in_flight),
+        }
+
+
+generation_coalescer = GenerationCoalescer()
+
+
+async def _prepare_model(model: str):
+    """Record use of a model before generating with it."""
+    try:
+        await residency_manager.ensure_resident(model)
+    except Exception as e:
+        logger.warning(f"Model residency check failed for {model}: {e}")
+
+
+def _build_generate_params(
+    model: str,
+    prompt: str,
+    stream: bool,
+    temperature: float,
+    top_p: float,
+    top_k: int,
+    repeat_penalty: float,
+    max_tokens: int,
+    presence_penalty: float,
+    frequency_penalty: float,
+    stop: List[str],
+    extra_options: Dict[str, Any],
+    context: Optional[List[int]] = None,
+) -> Dict[str, Any]:
+    """Build the request body for Ollama's /generate endpoint."""
+    params = {
+        "model": model,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": residency_manager.keep_alive,
+        "options": {
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "repeat_penalty": repeat_penalty,
+            "num_predict": max_tokens,
+            "presence_penalty": presence_penalty,
+            "frequency_penalty": frequency_penalty,
+            "stop": stop,
+        },
+    }
+
+    # Add any additional parameters
+    for key, value in extra_options.items():
+        if key not in params["options"]:
+            params["options"][key] = value
+
+    # Continue from a previously evaluated context so Ollama only has to
+    # evaluate the new prompt tokens
+    if context:
+        params["context"] = context
+
+    return params
+
+
+def _store_final_response(data: Dict[str, Any], final: Optional[Dict[str, Any]]):
+    """Copy the fields of Ollama's final response (context, counters) into final."""
+    if final is not None:
+        final.update({k: v for k, v in data.items() if k != "response"})
+
+
+# Token counters Ollama reports in its final response
+OLLAMA_COUNT_FIELDS = ("prompt_eval_count", "eval_count")
+# Timings Ollama reports in its final response, in nanoseconds
+OLLAMA_DURATION_FIELDS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_duration",
+    "eval_duration",
+)
+
+
+def get_generation_stats(final: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get token counts and timings from a final Ollama response.
+
+    Durations are converted to seconds. Adds decode and prompt evaluation
+    speed in tokens per second and the share of model time spent on prompt
+    evaluation. Responses served from the cache only report that they were cached.
+    """
+    if final.get("cached"):
+        return {"cached": True}
+
+    stats: Dict[str, Any] = {}
+    for field in OLLAMA_COUNT_FIELDS:
+        if final.get(field) is not None:
+            stats[field] = int(final[field])
+    for field in OLLAMA_DURATION_FIELDS:
+        if final.get(field) is not None:
+            stats[field] = final[field] / 1e9
+
+    eval_duration = stats.get("eval_duration")
+    if eval_duration and "eval_count" in stats:
+        stats["tokens_per_second"] = stats["eval_count"] / eval_duration
+
+    prompt_eval_duration = stats.get("prompt_eval_duration")
+    if prompt_eval_duration and "prompt_eval_count" in stats:
+        stats["prompt_tokens_per_second"] = (
+            stats["prompt_eval_count"] / prompt_eval_duration
+        )
+
+    if prompt_eval_duration is not None and eval_duration is not None:
+        model_time = prompt_eval_duration + eval_duration
+        if model_time > 0:
+            stats["prompt_eval_share"] = prompt_eval_duration / model_time
+
+    return stats
+
+
+def _extract_ollama_error(e: httpx.HTTPError, default_msg: str) -> str:
+    """Pull the error message out of an Ollama error response if there is one."""
+    error_msg = default_msg
+    response = getattr(e, "response", None)
+    if response is not None:
+        try:
+            error_data = json.loads(response.text)
+            if "error" in error_data:
+                error_msg = error_data["error"]
+        except Exception:
+            pass
+    return error_msg
 
 
 async def generate_text(
@@ -205,46 +1631,223 @@ async def generate_text(
     presence_penalty: float = 0.0,
     frequency_penalty: float = 0.0,
     stop: List[str] = [],
+    context: Optional[List[int]] = None,
+    final: Optional[Dict[str, Any]] = None,
+    priority: int = PRIORITY_CHAT,
     **kwargs,
 ) -> str:
-    """Generate text using Ollama."""
+    """
+    Generate text using Ollama.
+
+    If context is given, the prompt is evaluated as a continuation of that
+    context. If final is given, it is filled with the fields of Ollama's
+    final response, including the new context. The request waits for a slot
+    in the scheduler according to its priority.
+    """
     try:
-        params = {
-            "model": model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": temperature,
-                "top_p": top_p,
-                "top_k": top_k,
-                "repeat_penalty": repeat_penalty,
-                "num_predict": max_tokens,
-                "presence_penalty": presence_penalty,
-                "frequency_penalty": frequency_penalty,
-                "stop": stop,
-            },
-        }
+        params = _build_generate_params(
+            model,
+            prompt,
+            False,
+            temperature,
+            top_p,
+            top_k,
+            repeat_penalty,
+            max_tokens,
+            presence_penalty,
+            frequency_penalty,
+            stop,
+            kwargs,
+            context,
+        )
+
+        cache_key = generation_cache.lookup_key(params)
+        if cache_key:
+            cached = generation_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Using cached generation for model {model}")
+                _store_final_response({**cached, "cached": True}, final)
+                return cached.get("response", "")
+
+        async def request_generation(shared: SharedGeneration):
+            async with llm_scheduler.slot(model, priority):
+                await _prepare_model(model)
+                response = await get_ollama_client().request(
+                    "generate", "POST", "/generate", model=model, json=params
+                )
+                response.raise_for_status()
+                data = response.json()
 
-        # Add any additional parameters
-        for key, value in kwargs.items():
-            if key not in params["options"]:
-                params["options"][key] = value
+            if cache_key:
+                generation_cache.set(cache_key, data)
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{OLLAMA_API_BASE}/generate", json=params, timeout=90.0
+            if data.get("response"):
+                shared.append(data["response"])
+            shared.final = {k: v for k, v in data.items() if k != "response"}
+
+        chunks = [
+            chunk
+            async for chunk in generation_coalescer.generate(
+                params, request_generation, final
             )
-            response.raise_for_status()
-            data = response.json()
-            return data.get("response", "")
+        ]
+        return "".join(chunks)
     except httpx.HTTPError as e:
         logger.error(f"Error generating text with model {model}: {e}")
-        error_msg = f"Failed to generate text: {str(e)}"
-        if e.response and e.response.text:
+        raise ValueError(_extract_ollama_error(e, f"Failed to generate text: {str(e)}"))
+
+
+async def generate_text_stream(
+    model: str,
+    prompt: str,
+    temperature: float = 0.7,
+    top_p: float = 0.9,
+    top_k: int = 40,
+    repeat_penalty: float = 1.1,
+    max_tokens: int = 2048,
+    presence_penalty: float = 0.0,
+    frequency_penalty: float = 0.0,
+    stop: List[str] = [],
+    context: Optional[List[int]] = None,
+    final: Optional[Dict[str, Any]] = None,
+    priority: int = PRIORITY_CHAT,
+    **kwargs,
+) -> AsyncIterator[str]:
+    """
+    Generate text using Ollama, yielding token chunks as they are produced.
+
+    Takes the same arguments as generate_text. Joining all yielded chunks gives
+    the same text generate_text would have returned, and final is filled once
+    the stream is done.
+    """
+    params = _build_generate_params(
+        model,
+        prompt,
+        True,
+        temperature,
+        top_p,
+        top_k,
+        repeat_penalty,
+        max_tokens,
+        presence_penalty,
+        frequency_penalty,
+        stop,
+        kwargs,
+        context,
+    )
+
+    cache_key = generation_cache.lookup_key(params)
+    if cache_key:
+        cached = generation_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Using cached generation for model {model}")
+            if cached.get("response"):
+                yield cached["response"]
+            _store_final_response({**cached, "cached": True}, final)
+            return
+
+    async def stream_generation(shared: SharedGeneration):
+        try:
+            async with llm_scheduler.slot(model, priority):
+                await _prepare_model(model)
+
+                async with get_ollama_client().stream(
+                    "generate", "POST", "/generate", model=model, json=params
+                ) as response:
+                    if response.is_error:
+                        await response.aread()
+                    response.raise_for_status()
+
+                    async for line in response.aiter_lines():
+                        if not line.strip():
+                            continue
+
+                        data = json.loads(line)
+                        if "error" in data:
+                            raise ValueError(data["error"])
+
+                        chunk = data.get("response", "")
+                        if chunk:
+                            shared.append(chunk)
+
+                        if data.get("done"):
+                            if cache_key:
+                                generation_cache.set(
+                                    cache_key,
+                                    {**data, "response": "".join(shared.chunks)},
+                                )
+                            shared.final = {
+                                k: v for k, v in data.items() if k != "response"
+                            }
+                            break
+        except httpx.HTTPError as e:
+            logger.error(f"Error streaming text with model {model}: {e}")
+            raise ValueError(
+                _extract_ollama_error(e, f"Failed to generate text: {str(e)}")
+            )
+
+    async for chunk in generation_coalescer.generate(params, stream_generation, final):
+        yield chunk
+
+
+async def batch_generate(
+    prompts: List[str],
+    llm_config: Dict[str, Any],
+    concurrency: int = LLM_BATCH_MAX_CONCURRENCY,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Generate a response for each prompt with an LLM configuration.
+
+    At most concurrency prompts run at the same time, at batch priority so
+    conversations are served first. Results are yielded as they complete with
+    the index of their prompt, the latency in seconds and Ollama's token stats.
+    A failed prompt yields its error instead of stopping the batch.
+    """
+    concurrency = max(1, min(concurrency, LLM_BATCH_MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, prompt: str) -> Dict[str, Any]:
+        async with semaphore:
+            final: Dict[str, Any] = {}
+            start_time = time.time()
             try:
-                error_data = json.loads(e.response.text)
-                if "error" in error_data:
-                    error_msg = error_data["error"]
-            except:
-                pass
-        raise ValueError(error_msg)
+                response = await generate_text(
+                    model=llm_config["model"],
+                    prompt=prompt,
+                    temperature=llm_config.get("temperature", 0.7),
+                    top_p=llm_config.get("top_p", 0.9),
+                    top_k=llm_config.get("top_k", 40),
+                    repeat_penalty=llm_config.get("repeat_penalty", 1.1),
+                    max_tokens=llm_config.get("max_tokens", 2048),
+                    presence_penalty=llm_config.get("presence_penalty", 0.0),
+                    frequency_penalty=llm_config.get("frequency_penalty", 0.0),
+                    stop=llm_config.get("stop_sequences", []),
+                    final=final,
+                    priority=PRIORITY_BATCH,
+                    **(llm_config.get("additional_params") or {}),
+                )
+            except Exception as e:
+                logger.warning(f"Batch prompt {index} failed: {e}")
+                return {
+                    "index": index,
+                    "status": "error",
+                    "error": str(e),
+                    "latency": time.time() - start_time,
+                }
+
+            return {
+                "index": index,
+                "status": "success",
+                "response": response,
+                "latency": time.time() - start_time,
+                "llm_stats": get_generation_stats(final),
+            }
+
+    tasks = [asyncio.create_task(run(i, prompt)) for i, prompt in enumerate(prompts)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # Stop the remaining prompts if the caller goes away
+        for task in tasks:
+            task.cancel()
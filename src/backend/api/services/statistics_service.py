@@ -227,3 +227,103 @@ async def get_agent_performance_stats(
     results = await db.messages.aggregate(pipeline).to_list(length=None)
 
     return results
+
+
+async def get_generation_timing_stats(
+    llm_filter: Optional[str] = None,
+    agent_filter: Optional[str] = None,
+    group_by: str = "llm_config_uid",
+) -> List[Dict[str, Any]]:
+    """
+    Get token throughput and timing statistics from Ollama's generation stats.
+
+    Separates slow prompt evaluation from slow decoding and cold model loads.
+    Includes agent messages from both private and global conversations.
+
+    Args:
+        llm_filter: Optional filter by LLM config UID
+        agent_filter: Optional filter by agent UID
+        group_by: Field to group by, either llm_config_uid or agent_uid
+
+    Returns:
+        List of dictionaries with token and timing statistics per group
+    """
+    if group_by not in ("llm_config_uid", "agent_uid"):
+        raise ValueError(f"Cannot group generation stats by {group_by}")
+
+    db = get_database()
+
+    match_stage = {
+        "message_type": MessageType.AGENT,
+        "metadata.llm_stats.eval_duration": {"$exists": True},
+    }
+
+    if llm_filter:
+        match_stage["llm_config_uid"] = llm_filter
+    if agent_filter:
+        match_stage["agent_uid"] = agent_filter
+
+    # Cold loads take seconds, a loaded model reports a few milliseconds
+    cold_load_threshold = 1.0
+
+    # Filter each collection before the union so the match can use its indexes
+    pipeline = [
+        {"$match": match_stage},
+        {
+            "$unionWith": {
+                "coll": "global_messages",
+                "pipeline": [{"$match": match_stage}],
+            }
+        },
+        {
+            "$group": {
+                "_id": f"${group_by}",
+                "avg_tokens_per_second": {
+                    "$avg": "$metadata.llm_stats.tokens_per_second"
+                },
+                "min_tokens_per_second": {
+                    "$min": "$metadata.llm_stats.tokens_per_second"
+                },
+                "avg_prompt_tokens_per_second": {
+                    "$avg": "$metadata.llm_stats.prompt_tokens_per_second"
+                },
+                "avg_prompt_eval_share": {
+                    "$avg": "$metadata.llm_stats.prompt_eval_share"
+                },
+                "avg_prompt_eval_count": {
+                    "$avg": "$metadata.llm_stats.prompt_eval_count"
+                },
+                "avg_eval_count": {"$avg": "$metadata.llm_stats.eval_count"},
+                "avg_prompt_eval_duration": {
+                    "$avg": "$metadata.llm_stats.prompt_eval_duration"
+                },
+                "avg_eval_duration": {"$avg": "$metadata.llm_stats.eval_duration"},
+                "avg_load_duration": {"$avg": "$metadata.llm_stats.load_duration"},
+                "max_load_duration": {"$max": "$metadata.llm_stats.load_duration"},
+                "cold_load_count": {
+                    "$sum": {
+                        "$cond": [
+                            {
+                                "$gte": [
+                                    {
+                                        "$ifNull": [
+                                            "$metadata.llm_stats.load_duration",
+                                            0,
+                                        ]
+                                    },
+                                    cold_load_threshold,
+                                ]
+                            },
+                            1,
+                            0,
+                        ]
+                    }
+                },
+                "message_count": {"$sum": 1},
+            }
+        },
+    ]
+
+    results = await db.messages.aggregate(pipeline).to_list(length=None)
+
+    return results
@@ -1,16 +1,41 @@
+import asyncio
+import hashlib
 import logging
 import os
 import re
 import time
-import torch
 import uuid
 import shutil
-from typing import Any, Dict, List, Optional, Tuple
+import struct
+import unicodedata
+import wave
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 from pathlib import Path
 from pydub import AudioSegment
 
+from ..database import get_database
 from ..models import Voice
-from ttsModule.ttsModule import generate_speech as tts_generate_speech, tts
+from ttsModule.ttsModule import (
+    generate_speech as tts_generate_speech,
+    generate_speech_batch as tts_generate_speech_batch,
+    load_model as tts_load_model,
+    speaker_latent_cache,
+    supports_cached_latents,
+    get_model_version,
+    get_model_status,
+    TTS_LANGUAGE,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -31,12 +56,750 @@ DEFAULT_VOICE_DIR = os.path.join(
     "cleaned",
 )
 
+# Synthesis executor: worker threads running XTTS (one model instance is not
+# safe to share between threads) and how many jobs may wait for a worker
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", "1"))
+TTS_MAX_QUEUE_SIZE = int(os.environ.get("TTS_MAX_QUEUE_SIZE", "16"))
+
+# Micro-batching: requests arriving within the window are grouped by speaker
+# and similar text length (longest at most LENGTH_RATIO times the shortest)
+# and run on a worker as one job. Off by default: XTTS has no batched decoding,
+# so only enable it where ttsModule/benchmark.py shows a gain
+TTS_BATCHING = os.environ.get("TTS_BATCHING", "false").lower() == "true"
+TTS_BATCH_WINDOW_MS = float(os.environ.get("TTS_BATCH_WINDOW_MS", "15"))
+TTS_BATCH_MAX_SIZE = int(os.environ.get("TTS_BATCH_MAX_SIZE", "4"))
+TTS_BATCH_LENGTH_RATIO = float(os.environ.get("TTS_BATCH_LENGTH_RATIO", "2.0"))
+
+# Voice file lookup: message uid -> path, resolved through the voiceline_path
+# stored on messages and kept in an LRU of this many entries
+TTS_VOICE_INDEX_SIZE = int(os.environ.get("TTS_VOICE_INDEX_SIZE", "4096"))
+# Seconds a message without a voice file is remembered, so repeated requests
+# for it do not query the database each time
+TTS_VOICE_INDEX_MISS_TTL = float(os.environ.get("TTS_VOICE_INDEX_MISS_TTL", "30"))
+MESSAGE_COLLECTION = "messages"
+GLOBAL_MESSAGE_COLLECTION = "global_messages"
+
+# Voice files of whole messages (not their _partN segments)
+VOICE_FILE_PATTERN = re.compile(r"^message_(.+?)\.wav$")
+
+# Synthesized audio cache: repeated lines are linked from here instead of
+# being synthesized again; least recently used entries are evicted past the size limit
+TTS_AUDIO_CACHE = os.environ.get("TTS_AUDIO_CACHE", "true").lower() == "true"
+TTS_AUDIO_CACHE_DIR = os.environ.get(
+    "TTS_AUDIO_CACHE_DIR", os.path.join(DATA_DIR, "tts_cache")
+)
+TTS_AUDIO_CACHE_MAX_BYTES = int(
+    os.environ.get("TTS_AUDIO_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+)
+
+# Compressed variants encoded in the background after a voice line is
+# finished and stored next to its WAV; wav is always available
+TTS_ENCODED_FORMATS = [
+    fmt.strip()
+    for fmt in os.environ.get("TTS_ENCODED_FORMATS", "ogg").split(",")
+    if fmt.strip()
+]
+TTS_OPUS_BITRATE = os.environ.get("TTS_OPUS_BITRATE", "32k")
+TTS_MP3_BITRATE = os.environ.get("TTS_MP3_BITRATE", "64k")
+
+AUDIO_FORMATS = {
+    "wav": {"media_type": "audio/wav"},
+    "ogg": {
+        "media_type": "audio/ogg",
+        "export": {"format": "ogg", "codec": "libopus", "bitrate": TTS_OPUS_BITRATE},
+    },
+    "mp3": {
+        "media_type": "audio/mpeg",
+        "export": {"format": "mp3", "bitrate": TTS_MP3_BITRATE},
+    },
+}
+
+# Pipelined synthesis: voice replies sentence by sentence as the LLM streams.
+# Segments shorter than the minimum are merged with the next sentence, longer
+# than the maximum (XTTS handles about 250 characters) are split at a comma or space
+TTS_PIPELINE = os.environ.get("TTS_PIPELINE", "true").lower() == "true"
+TTS_MIN_SEGMENT_CHARS = int(os.environ.get("TTS_MIN_SEGMENT_CHARS", "20"))
+TTS_MAX_SEGMENT_CHARS = int(os.environ.get("TTS_MAX_SEGMENT_CHARS", "250"))
+
+# A failed sentence is retried this many times before the reply's voice fails;
+# sentence segment files are removed this many seconds after they are joined,
+# leaving clients time to finish playing them
+TTS_SEGMENT_RETRIES = int(os.environ.get("TTS_SEGMENT_RETRIES", "2"))
+TTS_SEGMENT_RETRY_DELAY = float(os.environ.get("TTS_SEGMENT_RETRY_DELAY", "0.5"))
+TTS_SEGMENT_RETENTION = float(os.environ.get("TTS_SEGMENT_RETENTION", "300"))
+
+# How long synthesis waits for the model while it is loading in the background
+# after startup, and how often its status is checked meanwhile
+TTS_MODEL_WAIT_TIMEOUT = float(os.environ.get("TTS_MODEL_WAIT_TIMEOUT", "600"))
+TTS_MODEL_WAIT_INTERVAL = 0.5
+
+# Sentence ends followed by whitespace, or line breaks
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n+")
+
+# Words whose trailing period does not end a sentence (single letters, as in
+# initials, are handled separately)
+ABBREVIATIONS = {
+    "mr",
+    "mrs",
+    "ms",
+    "dr",
+    "prof",
+    "sr",
+    "jr",
+    "st",
+    "vs",
+    "etc",
+    "e.g",
+    "i.e",
+    "a.m",
+    "p.m",
+    "no",
+    "approx",
+}
+ABBREVIATION_END = re.compile(r"([\w.]+)\.[\"')\]]*$")
+
 # Ensure directories exist
 os.makedirs(CONVERSATION_DIR, exist_ok=True)
 os.makedirs(AGENT_DIR, exist_ok=True)
 os.makedirs(DEFAULT_VOICE_DIR, exist_ok=True)
 
 
+class TTSQueueFullError(Exception):
+    """Raised when too many synthesis jobs are already waiting."""
+
+
+class TTSModelNotReadyError(Exception):
+    """Raised when the TTS model failed to load or is not loaded in time."""
+
+
+async def wait_for_tts_model(timeout: float = TTS_MODEL_WAIT_TIMEOUT):
+    """Wait until the TTS model is ready if it is still loading."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        status = get_model_status()
+        if status["status"] == "ready":
+            return
+        if status["status"] != "loading":
+            raise TTSModelNotReadyError(
+                f"TTS model is not available ({status['status']}: {status['error']})"
+            )
+        if loop.time() >= deadline:
+            raise TTSModelNotReadyError(
+                f"TTS model did not finish loading within {timeout:.0f}s"
+            )
+        await asyncio.sleep(TTS_MODEL_WAIT_INTERVAL)
+
+
+class SynthesisExecutor:
+    """
+    Runs blocking XTTS synthesis on dedicated worker threads.
+
+    Keeps the event loop free while speech is generated. Jobs wait in a
+    bounded queue for a worker, and the queue wait and synthesis time of
+    recent jobs are kept for monitoring. A caller that stops waiting does
+    not stop a job that has already started.
+    """
+
+    def __init__(
+        self,
+        workers: int = TTS_WORKERS,
+        max_queue_size: int = TTS_MAX_QUEUE_SIZE,
+        history: int = 100,
+    ):
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="tts-synthesis"
+        )
+        self._jobs: List[Dict[str, Any]] = []
+        self._shut_down = False
+        self.recent_jobs: deque = deque(maxlen=history)
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "abandoned": 0,
+            "total_wait_time": 0.0,
+            "total_synthesis_time": 0.0,
+        }
+
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker."""
+        return sum(
+            1 for job in self._jobs if "started_at" not in job and not job["abandoned"]
+        )
+
+    def running(self) -> int:
+        return sum(
+            1 for job in self._jobs if "started_at" in job and "finished_at" not in job
+        )
+
+    def _job_done(self, job: Dict[str, Any], future: asyncio.Future):
+        self._jobs.remove(job)
+
+        if "finished_at" not in job:
+            # Abandoned before a worker picked it up
+            self.stats["abandoned"] += 1
+            return
+
+        if future.cancelled() or future.exception() is not None:
+            self.stats["failed"] += 1
+        else:
+            self.stats["completed"] += 1
+
+        wait_time = job["started_at"] - job["submitted_at"]
+        synthesis_time = job["finished_at"] - job["started_at"]
+        self.stats["total_wait_time"] += wait_time
+        self.stats["total_synthesis_time"] += synthesis_time
+        self.recent_jobs.append(
+            {
+                "label": job["label"],
+                "wait_time": wait_time,
+                "synthesis_time": synthesis_time,
+                "finished_at": job["finished_at"],
+            }
+        )
+
+    async def run(self, func: Callable, *args, label: str = "") -> Any:
+        """Run a blocking synthesis function on a worker and wait for its result."""
+        if self._shut_down:
+            raise RuntimeError("Speech synthesis executor is shut down")
+        if self.queue_depth() >= self.max_queue_size:
+            self.stats["rejected"] += 1
+            raise TTSQueueFullError("Speech synthesis queue is full")
+
+        job = {"label": label, "submitted_at": time.time(), "abandoned": False}
+
+        def work():
+            if job["abandoned"]:
+                return None
+            job["started_at"] = time.time()
+            try:
+                return func(*args)
+            finally:
+                job["finished_at"] = time.time()
+
+        self.stats["submitted"] += 1
+        self._jobs.append(job)
+        future = asyncio.get_running_loop().run_in_executor(self._executor, work)
+        future.add_done_callback(lambda f: self._job_done(job, f))
+
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future.cancelled() and self._shut_down:
+                # Dropped from the queue by shutdown rather than by our caller
+                raise RuntimeError("Speech synthesis executor is shut down") from None
+            # Skip the job if no worker has picked it up yet
+            job["abandoned"] = True
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        finished = self.stats["completed"] + self.stats["failed"]
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": self.queue_depth(),
+            "running": self.running(),
+            "avg_wait_time": (
+                self.stats["total_wait_time"] / finished if finished else 0.0
+            ),
+            "avg_synthesis_time": (
+                self.stats["total_synthesis_time"] / finished if finished else 0.0
+            ),
+            "recent_jobs": list(self.recent_jobs),
+        }
+
+    def shutdown(self):
+        """Stop accepting jobs and drop the ones still waiting for a worker."""
+        self._shut_down = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+synthesis_executor = SynthesisExecutor()
+
+
+class BatchingSynthesisEngine:
+    """
+    Groups concurrent synthesis requests into batches for the executor.
+
+    Requests are collected for a few milliseconds, grouped by speaker and
+    similar text length, and each group is run on a worker as one job. Every
+    caller gets its own result back as soon as its item is done, not when
+    the whole batch is. A caller that gives up before its batch starts is
+    left out of it.
+    """
+
+    def __init__(
+        self,
+        executor: SynthesisExecutor = synthesis_executor,
+        window_ms: float = TTS_BATCH_WINDOW_MS,
+        max_batch_size: int = TTS_BATCH_MAX_SIZE,
+        length_ratio: float = TTS_BATCH_LENGTH_RATIO,
+    ):
+        self.executor = executor
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.length_ratio = length_ratio
+        self._pending: List[Dict[str, Any]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        self.stats = {"requests": 0, "batches": 0, "largest_batch": 0}
+
+    async def synthesize(
+        self, speaker_wav_path: str, text: str, output_path: str, label: str = ""
+    ):
+        """Queue one request for the next batch and wait for its SpeechResult."""
+        loop = asyncio.get_running_loop()
+        request = {
+            "speaker_wav_path": speaker_wav_path,
+            "text": text,
+            "output_path": output_path,
+            "label": label,
+            "future": loop.create_future(),
+        }
+        self._pending.append(request)
+        self.stats["requests"] += 1
+
+        if len(self._pending) >= self.max_batch_size * self.executor.workers:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+
+        return await request["future"]
+
+    def group_requests(
+        self, requests: List[Dict[str, Any]]
+    ) -> List[List[Dict[str, Any]]]:
+        """Split requests into batches of one speaker and similar text length."""
+        batches: List[List[Dict[str, Any]]] = []
+        ordered = sorted(
+            requests, key=lambda r: (r["speaker_wav_path"], len(r["text"]))
+        )
+        for request in ordered:
+            batch = batches[-1] if batches else None
+            if (
+                batch
+                and len(batch) < self.max_batch_size
+                and batch[0]["speaker_wav_path"] == request["speaker_wav_path"]
+                and len(request["text"])
+                <= max(len(batch[0]["text"]), 1) * self.length_ratio
+            ):
+                batch.append(request)
+            else:
+                batches.append([request])
+        return batches
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        requests, self._pending = self._pending, []
+        for batch in self.group_requests(requests):
+            task = asyncio.create_task(self._run_batch(batch))
+            # Keep a reference so the task is not garbage collected mid-run
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Any):
+        if future.done():
+            return
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+    async def _run_batch(self, batch: List[Dict[str, Any]]):
+        batch = [request for request in batch if not request["future"].done()]
+        if not batch:
+            return
+
+        self.stats["batches"] += 1
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+        loop = asyncio.get_running_loop()
+
+        def deliver(index: int, result: Any):
+            # Called on the worker thread as each item finishes
+            loop.call_soon_threadsafe(self._resolve, batch[index]["future"], result)
+
+        try:
+            await self.executor.run(
+                tts_generate_speech_batch,
+                [(r["speaker_wav_path"], r["text"], r["output_path"]) for r in batch],
+                deliver,
+                label=",".join(r["label"] for r in batch),
+            )
+        except Exception as e:
+            for request in batch:
+                self._resolve(request["future"], e)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "window_ms": self.window * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            "pending": len(self._pending),
+            "avg_batch_size": (
+                self.stats["requests"] / self.stats["batches"]
+                if self.stats["batches"]
+                else 0.0
+            ),
+        }
+
+
+batching_engine = BatchingSynthesisEngine()
+
+
+class AudioCache:
+    """
+    Content-addressed cache of synthesized WAV files.
+
+    Entries are keyed on the normalized text, a hash of the speaker sample,
+    the language and the model version. A hit is hard-linked to the
+    requested output path (copied where linking is not possible), so
+    repeated lines cost no synthesis and no extra disk space.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = TTS_AUDIO_CACHE_DIR,
+        max_bytes: int = TTS_AUDIO_CACHE_MAX_BYTES,
+        enabled: bool = TTS_AUDIO_CACHE,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        # Recency lives here only: touching a cache file would also change the
+        # mtime of the voice files linked to it and make their variants stale
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        # (path, mtime) -> content hash of a speaker sample
+        self._speaker_hashes: Dict[Tuple[str, float], str] = {}
+        self._model_version: Optional[str] = None
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if enabled:
+            self._load_index()
+
+    def _load_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".wav"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            files.append((stat.st_mtime, name[: -len(".wav")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.total_bytes += size
+        self._evict()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        return clean_text(unicodedata.normalize("NFKC", text))
+
+    def speaker_hash(self, speaker_wav_path: str) -> str:
+        file_key = (speaker_wav_path, os.path.getmtime(speaker_wav_path))
+        digest = self._speaker_hashes.get(file_key)
+        if digest is None:
+            digest = speaker_latent_cache.file_hash(speaker_wav_path)
+            self._speaker_hashes[file_key] = digest
+        return digest
+
+    def model_version(self) -> str:
+        if self._model_version is None:
+            self._model_version = get_model_version()
+        return self._model_version
+
+    def make_key(
+        self,
+        text: str,
+        speaker_wav_path: str,
+        language: str = TTS_LANGUAGE,
+        model_version: Optional[str] = None,
+    ) -> str:
+        parts = [
+            self.normalize_text(text),
+            self.speaker_hash(speaker_wav_path),
+            language,
+            model_version or self.model_version(),
+        ]
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    @staticmethod
+    def _link(source: str, dest: str):
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(source, dest)
+        except OSError:
+            shutil.copyfile(source, dest)
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        """Place the cached audio for key at output_path, if there is any."""
+        if not self.enabled:
+            return False
+
+        path = self._path(key)
+        if key not in self._entries or not os.path.exists(path):
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)
+            self.stats["misses"] += 1
+            return False
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        self._link(path, output_path)
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return True
+
+    def store(self, key: str, source_path: str):
+        """Add a freshly synthesized file to the cache."""
+        if not self.enabled or key in self._entries:
+            return
+
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._link(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to cache synthesized audio: {e}")
+            return
+
+        size = os.path.getsize(path)
+        self._entries[key] = size
+        self.total_bytes += size
+        self.stats["stores"] += 1
+        self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.stats["evictions"] += 1
+            try:
+                # Linked voice files keep their own reference to the audio
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+        }
+
+
+audio_cache = AudioCache()
+
+
+async def synthesize(
+    speaker_wav_path: str, text: str, output_path: str, label: str = ""
+) -> float:
+    """
+    Synthesize text to output_path, serving repeated lines from the audio cache.
+
+    Returns the duration of the audio in seconds.
+    """
+    key = audio_cache.make_key(text, speaker_wav_path)
+    if audio_cache.fetch(key, output_path):
+        logger.info(f"Served voice for {label or output_path} from audio cache")
+        return get_wav_duration(output_path)
+
+    # Cache hits do not need the model, synthesis waits for it to finish loading
+    await wait_for_tts_model()
+
+    # Never write through a link into a cached file
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    if TTS_BATCHING:
+        result = await batching_engine.synthesize(
+            speaker_wav_path, text, output_path, label=label
+        )
+    else:
+        result = await synthesis_executor.run(
+            tts_generate_speech, speaker_wav_path, text, output_path, label=label
+        )
+    if os.path.exists(output_path):
+        audio_cache.store(key, output_path)
+    return result.duration
+
+
+def get_variant_path(wav_path: str, fmt: str) -> str:
+    """Get the path of an encoded variant stored next to a WAV file."""
+    return f"{os.path.splitext(wav_path)[0]}.{fmt}"
+
+
+def get_encoded_variant(wav_path: str, fmt: str) -> Optional[str]:
+    """Get an encoded variant of a WAV file if one is ready and up to date."""
+    if fmt == "wav":
+        return wav_path
+    path = get_variant_path(wav_path, fmt)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(wav_path):
+            return path
+    except OSError:
+        pass
+    return None
+
+
+def encode_variant(wav_path: str, fmt: str) -> str:
+    """Encode a WAV file into one of AUDIO_FORMATS (requires ffmpeg)."""
+    output_path = get_variant_path(wav_path, fmt)
+    tmp_path = f"{output_path}.tmp"
+    AudioSegment.from_wav(wav_path).export(tmp_path, **AUDIO_FORMATS[fmt]["export"])
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+# ffmpeg output meaning a format cannot be encoded at all on this machine
+ENCODER_MISSING_MESSAGES = (
+    "unknown encoder",
+    "encoder not found",
+    "unsupported codec",
+    "codec not currently supported",
+    "could not find codec",
+)
+
+
+def is_encoder_missing(error: Exception) -> bool:
+    """Whether an encoding error means ffmpeg or the format's codec is unavailable."""
+    if isinstance(error, FileNotFoundError):
+        missing = error.filename if error.filename is not None else str(error)
+        return os.path.basename(str(missing)) in ("ffmpeg", "avconv")
+    # pydub includes the ffmpeg command line, which names the codec, before
+    # the ffmpeg output
+    output = str(error).lower().split("output from ffmpeg/avlib:")[-1]
+    return any(message in output for message in ENCODER_MISSING_MESSAGES)
+
+
+def choose_audio_format(accept: Optional[str], available: List[str]) -> str:
+    """
+    Pick the format to serve from an Accept header.
+
+    Only formats the client names explicitly are considered, so clients that
+    send just */* keep getting WAV. Ties go to the smaller format.
+    """
+    preference = ["ogg", "mp3", "wav"]
+    qualities: Dict[str, float] = {}
+
+    for part in (accept or "").split(","):
+        media_range, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        for fmt in available:
+            if AUDIO_FORMATS[fmt]["media_type"] == media_range:
+                qualities[fmt] = max(qualities.get(fmt, 0.0), quality)
+
+    accepted = [fmt for fmt, quality in qualities.items() if quality > 0]
+    if not accepted:
+        return "wav"
+    return max(accepted, key=lambda fmt: (qualities[fmt], -preference.index(fmt)))
+
+
+class AudioEncoder:
+    """
+    Encodes finished voice lines into compressed variants in the background.
+
+    Encoding runs on its own worker thread so it never delays synthesis or
+    a response; until a variant is ready the WAV is served instead. A file
+    that failed to encode is not retried until it changes, and a format is
+    dropped once an error shows that ffmpeg or its codec is missing.
+    """
+
+    def __init__(self, formats: List[str] = TTS_ENCODED_FORMATS):
+        self.formats = [fmt for fmt in formats if fmt in AUDIO_FORMATS and fmt != "wav"]
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="tts-encoder"
+        )
+        self._pending: set = set()
+        self._tasks: set = set()
+        # (wav_path, fmt) -> mtime of the WAV file that failed to encode
+        self._failed: Dict[Tuple[str, str], float] = {}
+        self.disabled_formats: List[str] = []
+        self.stats = {"encoded": 0, "failed": 0, "wav_bytes": 0, "encoded_bytes": 0}
+
+    def schedule(self, wav_path: str):
+        """Queue encoding of a WAV file into every configured format."""
+        for fmt in self.formats:
+            if (wav_path, fmt) in self._pending:
+                continue
+            failed_mtime = self._failed.get((wav_path, fmt))
+            if failed_mtime is not None:
+                try:
+                    if os.path.getmtime(wav_path) == failed_mtime:
+                        continue
+                except OSError:
+                    continue
+                del self._failed[(wav_path, fmt)]
+            self._pending.add((wav_path, fmt))
+            task = asyncio.create_task(self._encode(wav_path, fmt))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _encode(self, wav_path: str, fmt: str):
+        try:
+            loop = asyncio.get_running_loop()
+            path = await loop.run_in_executor(
+                self._executor, encode_variant, wav_path, fmt
+            )
+            self.stats["encoded"] += 1
+            self.stats["wav_bytes"] += os.path.getsize(wav_path)
+            self.stats["encoded_bytes"] += os.path.getsize(path)
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning(f"Failed to encode {wav_path} as {fmt}: {str(e)}")
+            try:
+                self._failed[(wav_path, fmt)] = os.path.getmtime(wav_path)
+            except OSError:
+                pass
+            if is_encoder_missing(e) and fmt in self.formats:
+                self.formats.remove(fmt)
+                self.disabled_formats.append(fmt)
+                logger.warning(f"Disabled {fmt} encoding, its encoder is unavailable")
+        finally:
+            self._pending.discard((wav_path, fmt))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "formats": self.formats,
+            "disabled_formats": self.disabled_formats,
+            "pending": len(self._pending),
+            "compression_ratio": (
+                self.stats["encoded_bytes"] / self.stats["wav_bytes"]
+                if self.stats["wav_bytes"]
+                else 0.0
+            ),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+audio_encoder = AudioEncoder()
+
+
 def clean_text(text: str) -> str:
     """Clean text for TTS processing."""
     text = re.sub(r"\n+", " ", text)
@@ -44,12 +807,115 @@ def clean_text(text: str) -> str:
     return text.strip()
 
 
+def is_abbreviation(text: str) -> bool:
+    """Whether text ends with an abbreviation or initial rather than a sentence."""
+    match = ABBREVIATION_END.search(text[-12:])
+    if not match:
+        return False
+    word = match.group(1).lower()
+    return word in ABBREVIATIONS or (len(word) == 1 and word.isalpha())
+
+
+def remove_files(paths: List[str]):
+    """Delete files, ignoring ones that are already gone."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove {path}: {str(e)}")
+
+
+def pop_sentences(
+    buffer: str,
+    final: bool = False,
+    min_chars: int = TTS_MIN_SEGMENT_CHARS,
+    max_chars: int = TTS_MAX_SEGMENT_CHARS,
+) -> Tuple[List[str], str]:
+    """
+    Take the complete sentences off the front of a text buffer.
+
+    Returns the sentences ready for synthesis and the rest of the buffer.
+    With final set the whole buffer is returned as sentences.
+    """
+    segments = []
+    current = ""
+    position = 0
+
+    for match in SENTENCE_BOUNDARY.finditer(buffer):
+        if "\n" not in match.group() and is_abbreviation(buffer[: match.start()]):
+            continue
+        current += buffer[position : match.end()]
+        position = match.end()
+        if len(current.strip()) >= min_chars:
+            segments.append(current)
+            current = ""
+
+    rest = current + buffer[position:]
+
+    # Cut overlong text without a sentence end at the last comma or space
+    while len(rest) > max_chars:
+        cut = max(rest.rfind(", ", 0, max_chars), rest.rfind(" ", 0, max_chars))
+        cut = cut + 1 if cut > 0 else max_chars
+        segments.append(rest[:cut])
+        rest = rest[cut:]
+
+    if final and rest.strip():
+        segments.append(rest)
+        rest = ""
+
+    sentences = [clean_text(segment) for segment in segments]
+    return [sentence for sentence in sentences if re.search(r"\w", sentence)], rest
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a text into sentence segments for synthesis."""
+    sentences, _ = pop_sentences(text, final=True)
+    return sentences
+
+
+def get_wav_duration(file_path: str) -> float:
+    """Get the duration of a WAV file in seconds from its header."""
+    with wave.open(file_path, "rb") as wav:
+        return wav.getnframes() / float(wav.getframerate())
+
+
+def concatenate_wavs(paths: List[str], output_path: str) -> float:
+    """Join WAV files with the same format into one file, returning its duration."""
+    frames = 0
+    framerate = 1
+    audio_format = None
+
+    # Write to a new file so a hard-linked cache entry at output_path is untouched
+    tmp_path = f"{output_path}.tmp"
+    try:
+        with wave.open(tmp_path, "wb") as output:
+            for path in paths:
+                with wave.open(path, "rb") as wav:
+                    # (nchannels, sampwidth, framerate)
+                    if audio_format is None:
+                        audio_format = wav.getparams()[:3]
+                        output.setparams(wav.getparams())
+                        framerate = wav.getframerate()
+                    elif wav.getparams()[:3] != audio_format:
+                        raise ValueError(
+                            f"{path} does not match the format of {paths[0]}"
+                        )
+                    frames += wav.getnframes()
+                    output.writeframes(wav.readframes(wav.getnframes()))
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+
+    return frames / float(framerate)
+
+
 def get_audio_duration(file_path: str) -> float:
-    """Get the duration of an audio file in seconds using pydub."""
+    """Get the duration of an existing WAV file in seconds, or 0.0 if unreadable."""
     try:
-        audio = AudioSegment.from_wav(file_path)
-        duration = len(audio) / 1000.0  # Convert milliseconds to seconds
-        return duration
+        return get_wav_duration(file_path)
     except Exception as e:
         logger.error(f"Error getting audio duration: {str(e)}")
         return 0.0
@@ -94,10 +960,11 @@ async def generate_speech(
             speaker_wav_path = custom_voice_path
             logger.info(f"Using custom voice: {custom_voice_path}")
 
-        tts_generate_speech(speaker_wav_path, cleaned_text, output_path)
+        await synthesize(speaker_wav_path, cleaned_text, output_path, label=message_uid)
 
         if os.path.exists(output_path):
             logger.info(f"Generated voice file: {output_path}")
+            voice_path_index.put(message_uid, output_path)
             return output_path
         else:
             logger.error(f"Failed to generate voice file: {output_path}")
@@ -109,13 +976,177 @@ async def generate_speech(
 
 
 async def load_tts_model():
-    """Check if the TTS model is loaded."""
+    """Load the TTS model without blocking the event loop, raising if it fails."""
+    tts = await asyncio.get_running_loop().run_in_executor(None, tts_load_model)
     if tts is None:
         logger.error("TTS model is not loaded")
         raise RuntimeError("TTS model is not loaded")
     return tts
 
 
+class VoicePathIndex:
+    """
+    Resolves message uids to their voice files without scanning directories.
+
+    Recently used paths are kept in an LRU. Misses check the path the file
+    would have been written to, then the voiceline_path stored on the
+    message, so a lookup costs a few stats and at most two queries on the
+    message_uid indexes created at startup. Messages without a voice file
+    are remembered for miss_ttl seconds, or until their file is put.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = TTS_VOICE_INDEX_SIZE,
+        miss_ttl: float = TTS_VOICE_INDEX_MISS_TTL,
+    ):
+        self.max_entries = max_entries
+        self.miss_ttl = miss_ttl
+        self._paths: "OrderedDict[str, str]" = OrderedDict()
+        # message uid -> time until which it is known to have no voice file
+        self._misses: "OrderedDict[str, float]" = OrderedDict()
+        self.stats = {
+            "hits": 0,
+            "path_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "cached_misses": 0,
+            "stale": 0,
+        }
+
+    def put(self, message_uid: str, path: str):
+        self._misses.pop(message_uid, None)
+        self._paths[message_uid] = path
+        self._paths.move_to_end(message_uid)
+        while len(self._paths) > self.max_entries:
+            self._paths.popitem(last=False)
+
+    def _remember_miss(self, message_uid: str):
+        self._misses[message_uid] = time.monotonic() + self.miss_ttl
+        self._misses.move_to_end(message_uid)
+        while len(self._misses) > self.max_entries:
+            self._misses.popitem(last=False)
+
+    def discard(self, message_uid: str):
+        self._paths.pop(message_uid, None)
+
+    @staticmethod
+    def _absolute(path: str) -> str:
+        # Stored paths may be relative to the directory containing data/
+        if os.path.isabs(path):
+            return path
+        return os.path.normpath(os.path.join(DATA_DIR, "..", path))
+
+    async def _lookup_stored_path(self, message_uid: str) -> Optional[str]:
+        db = get_database()
+        if db is None:
+            return None
+        for collection in (MESSAGE_COLLECTION, GLOBAL_MESSAGE_COLLECTION):
+            message = await db[collection].find_one(
+                {"message_uid": message_uid}, {"voiceline_path": 1}
+            )
+            if message:
+                return message.get("voiceline_path")
+        return None
+
+    async def resolve(
+        self, message_uid: str, conversation_uid: Optional[str] = None
+    ) -> Optional[str]:
+        path = self._paths.get(message_uid)
+        if path:
+            if os.path.exists(path):
+                self._paths.move_to_end(message_uid)
+                self.stats["hits"] += 1
+                return path
+            self.stats["stale"] += 1
+            self.discard(message_uid)
+
+        missed_until = self._misses.get(message_uid)
+        if missed_until is not None:
+            if time.monotonic() < missed_until:
+                self.stats["cached_misses"] += 1
+                return None
+            del self._misses[message_uid]
+
+        # Where the file is written to, with and without the conversation
+        candidates = [os.path.join(CONVERSATION_DIR, f"message_{message_uid}.wav")]
+        if conversation_uid:
+            candidates.insert(
+                0,
+                os.path.join(
+                    CONVERSATION_DIR, conversation_uid, f"message_{message_uid}.wav"
+                ),
+            )
+        for path in candidates:
+            if os.path.exists(path):
+                self.stats["path_hits"] += 1
+                self.put(message_uid, path)
+                return path
+
+        stored_path = await self._lookup_stored_path(message_uid)
+        if stored_path:
+            path = self._absolute(stored_path)
+            if os.path.exists(path):
+                self.stats["db_hits"] += 1
+                self.put(message_uid, path)
+                return path
+
+        self.stats["misses"] += 1
+        self._remember_miss(message_uid)
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = sum(self.stats.values()) - self.stats["stale"]
+        return {
+            **self.stats,
+            "entries": len(self._paths),
+            "cached_misses_entries": len(self._misses),
+            "max_entries": self.max_entries,
+            "hit_rate": (lookups - self.stats["misses"]) / lookups if lookups else 0.0,
+        }
+
+
+voice_path_index = VoicePathIndex()
+
+
+def get_voice_output_path(
+    message_uid: str, conversation_uid: Optional[str] = None, segment: int = None
+) -> str:
+    """Get the path a message's voice file (or one of its segments) is written to."""
+    if conversation_uid:
+        directory = os.path.join(CONVERSATION_DIR, str(conversation_uid))
+    else:
+        directory = CONVERSATION_DIR
+        logger.warning(f"No conversation_uid provided, using base path: {directory}")
+    os.makedirs(directory, exist_ok=True)
+
+    if segment is None:
+        return os.path.join(directory, f"message_{message_uid}.wav")
+    return os.path.join(directory, f"message_{message_uid}_part{segment}.wav")
+
+
+def resolve_speaker_wav(
+    voice_speaker: str = "morgan", custom_voice_path: Optional[str] = None
+) -> str:
+    """Find the reference voice sample for a speaker or custom voice."""
+    # Check for custom voice path first
+    if custom_voice_path and os.path.exists(custom_voice_path):
+        logger.info(f"Using custom voice path: {custom_voice_path}")
+        return custom_voice_path
+
+    # Find an appropriate voice sample from defaults
+    speaker_wav_path = os.path.join(DEFAULT_VOICE_DIR, f"{voice_speaker}_cleaned.wav")
+
+    if not os.path.exists(speaker_wav_path):
+        speaker_wav_path = os.path.join(DEFAULT_VOICE_DIR, f"{voice_speaker}.wav")
+
+    if not os.path.exists(speaker_wav_path):
+        logger.warning(f"Speaker file not found: {speaker_wav_path}, using default")
+        speaker_wav_path = os.path.join(DEFAULT_VOICE_DIR, "morgan_cleaned.wav")
+
+    return speaker_wav_path
+
+
 async def generate_voice(
     text,
     voice_speaker="morgan",
@@ -144,50 +1175,22 @@ async def generate_voice(
             f"Generating voice for message: {message_uid}, conversation: {conversation_uid}"
         )
 
-        if conversation_uid:
-            conversation_uid = str(conversation_uid)
-            logger.info(f"Using conversation UID: {conversation_uid}")
-
-            convo_dir = os.path.join(CONVERSATION_DIR, conversation_uid)
-            os.makedirs(convo_dir, exist_ok=True)
-            file_path = os.path.join(convo_dir, f"message_{message_uid}.wav")
-            logger.info(f"Voice will be generated to: {file_path}")
-        else:
-            os.makedirs(CONVERSATION_DIR, exist_ok=True)
-            file_path = os.path.join(CONVERSATION_DIR, f"message_{message_uid}.wav")
-            logger.warning(
-                f"No conversation_uid provided, using base path: {file_path}"
-            )
-
-        # Check for custom voice path first
-        if custom_voice_path and os.path.exists(custom_voice_path):
-            logger.info(f"Using custom voice path: {custom_voice_path}")
-            speaker_wav_path = custom_voice_path
-        else:
-            # Find an appropriate voice sample from defaults
-            speaker_wav_path = os.path.join(
-                DEFAULT_VOICE_DIR, f"{voice_speaker}_cleaned.wav"
-            )
+        file_path = get_voice_output_path(message_uid, conversation_uid)
+        logger.info(f"Voice will be generated to: {file_path}")
 
-            if not os.path.exists(speaker_wav_path):
-                speaker_wav_path = os.path.join(
-                    DEFAULT_VOICE_DIR, f"{voice_speaker}.wav"
-                )
-
-            if not os.path.exists(speaker_wav_path):
-                logger.warning(
-                    f"Speaker file not found: {speaker_wav_path}, using default"
-                )
-                speaker_wav_path = os.path.join(DEFAULT_VOICE_DIR, "morgan_cleaned.wav")
+        speaker_wav_path = resolve_speaker_wav(voice_speaker, custom_voice_path)
 
         logger.info(f"Using voice sample: {speaker_wav_path}")
-        tts_generate_speech(speaker_wav_path, text, file_path)
+        audio_duration = await synthesize(
+            speaker_wav_path, text, file_path, label=message_uid
+        )
 
         if not os.path.exists(file_path):
             logger.error(f"Failed to generate voice file at: {file_path}")
             raise RuntimeError(f"Voice file not created at {file_path}")
 
-        audio_duration = get_audio_duration(file_path)
+        voice_path_index.put(message_uid, file_path)
+        audio_encoder.schedule(file_path)
         logger.info(
             f"Generated voice file with duration: {audio_duration:.2f} seconds at path: {file_path}"
         )
@@ -198,6 +1201,245 @@ async def generate_voice(
         raise
 
 
+def streaming_wav_header(channels: int, sample_width: int, framerate: int) -> bytes:
+    """
+    WAV header for audio whose length is not known yet.
+
+    The RIFF and data sizes are set to the maximum, which players treat as
+    "read until the stream ends".
+    """
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        0xFFFFFFFF,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,  # PCM
+        channels,
+        framerate,
+        framerate * channels * sample_width,
+        channels * sample_width,
+        sample_width * 8,
+        b"data",
+        0xFFFFFFFF,
+    )
+
+
+# Pipelines still synthesizing, by message uid, so their audio can be streamed
+active_pipelines: Dict[str, "SpeechPipeline"] = {}
+
+
+def get_active_pipeline(message_uid: str) -> Optional["SpeechPipeline"]:
+    """Get the pipeline still synthesizing a message's voice, if any."""
+    return active_pipelines.get(message_uid)
+
+
+class SpeechPipeline:
+    """
+    Synthesizes a reply sentence by sentence while its text is still arriving.
+
+    Text is fed in as it streams from the LLM. Each complete sentence is
+    synthesized in turn and handed to on_segment as soon as its audio is
+    ready, so playback can start long before the reply is finished. When the
+    text is complete the segments are joined into the message's voice file.
+    """
+
+    def __init__(
+        self,
+        voice_speaker: str = "morgan",
+        message_uid: Optional[str] = None,
+        conversation_uid: Optional[str] = None,
+        custom_voice_path: Optional[str] = None,
+        on_segment: Optional[Callable[[int, str, float, str], Awaitable[None]]] = None,
+    ):
+        self.message_uid = message_uid or str(uuid.uuid4())
+        self.conversation_uid = conversation_uid
+        self.speaker_wav_path = resolve_speaker_wav(voice_speaker, custom_voice_path)
+        self.on_segment = on_segment
+        self.segments: List[Tuple[str, float]] = []
+        self.time_to_first_audio: Optional[float] = None
+        self._buffer = ""
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = time.time()
+        self._changed = asyncio.Condition()
+        self._synthesis_done = False
+        self.error: Optional[Exception] = None
+
+    def start(self):
+        self._started_at = time.time()
+        self._task = asyncio.create_task(self._run())
+        active_pipelines[self.message_uid] = self
+
+    def _unregister(self):
+        if active_pipelines.get(self.message_uid) is self:
+            del active_pipelines[self.message_uid]
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def feed(self, delta: str):
+        """Add streamed text, queueing every sentence it completes."""
+        self._buffer += delta
+        sentences, self._buffer = pop_sentences(self._buffer)
+        for sentence in sentences:
+            self._queue.put_nowait(sentence)
+
+    async def _run(self):
+        try:
+            await self._synthesize_queued()
+        finally:
+            self._synthesis_done = True
+            await asyncio.shield(self._notify())
+
+    async def _synthesize_segment(self, sentence: str, path: str, index: int) -> float:
+        """Synthesize one sentence, retrying after transient failures."""
+        for attempt in range(TTS_SEGMENT_RETRIES + 1):
+            try:
+                return await synthesize(
+                    self.speaker_wav_path,
+                    sentence,
+                    path,
+                    label=f"{self.message_uid}:{index}",
+                )
+            except Exception as e:
+                # Waiting for the model is already done inside synthesize
+                if attempt == TTS_SEGMENT_RETRIES or isinstance(
+                    e, TTSModelNotReadyError
+                ):
+                    raise
+                logger.warning(
+                    f"Retrying voice segment {index} of message {self.message_uid}: {str(e)}"
+                )
+                # A full queue needs time to drain
+                await asyncio.sleep(TTS_SEGMENT_RETRY_DELAY * (attempt + 1))
+
+    async def _synthesize_queued(self):
+        while True:
+            sentence = await self._queue.get()
+            if sentence is None:
+                return
+
+            index = len(self.segments)
+            path = get_voice_output_path(
+                self.message_uid, self.conversation_uid, segment=index
+            )
+            try:
+                duration = await self._synthesize_segment(sentence, path, index)
+            except Exception as e:
+                # A gap would leave the voice file missing text, so fail the reply
+                logger.error(
+                    f"Dropping voice for message {self.message_uid} at segment {index} "
+                    f"({sentence!r}) after {TTS_SEGMENT_RETRIES + 1} attempts: {str(e)}"
+                )
+                self.error = RuntimeError(
+                    f"Voice segment {index} of message {self.message_uid} failed: {str(e)}"
+                )
+                return
+
+            self.segments.append((path, duration))
+            await self._notify()
+            if self.time_to_first_audio is None:
+                self.time_to_first_audio = time.time() - self._started_at
+                logger.info(
+                    f"First audio segment for message {self.message_uid} ready "
+                    f"after {self.time_to_first_audio:.2f} seconds"
+                )
+
+            if self.on_segment:
+                try:
+                    await self.on_segment(index, path, duration, sentence)
+                except Exception as e:
+                    logger.warning(f"Failed to publish voice segment: {str(e)}")
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """
+        Yield the voice line as WAV bytes while it is being synthesized.
+
+        A streaming header is sent with the first segment, followed by the
+        PCM frames of each segment as soon as it is ready.
+        """
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: index < len(self.segments) or self._synthesis_done
+                )
+            if index >= len(self.segments):
+                return
+
+            for path, _ in self.segments[index:]:
+                with wave.open(path, "rb") as wav:
+                    if index == 0:
+                        yield streaming_wav_header(
+                            wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+                        )
+                    yield wav.readframes(wav.getnframes())
+                index += 1
+
+    async def finish(self) -> Tuple[str, float]:
+        """Synthesize the remaining text and join the segments into one file."""
+        if self._task is None:
+            self.start()
+
+        try:
+            sentences, self._buffer = pop_sentences(self._buffer, final=True)
+            for sentence in sentences:
+                self._queue.put_nowait(sentence)
+            self._queue.put_nowait(None)
+            await self._task
+
+            segment_paths = [path for path, _ in self.segments]
+            if self.error:
+                remove_files(segment_paths)
+                raise self.error
+            if not self.segments:
+                raise RuntimeError(f"No voice generated for message {self.message_uid}")
+
+            file_path = get_voice_output_path(self.message_uid, self.conversation_uid)
+            audio_duration = concatenate_wavs(segment_paths, file_path)
+        finally:
+            # Requests from now on are served the complete file
+            self._unregister()
+
+        # The segments are only needed by clients still playing them
+        asyncio.get_running_loop().call_later(
+            TTS_SEGMENT_RETENTION, remove_files, segment_paths
+        )
+        logger.info(
+            f"Generated voice file from {len(self.segments)} segments with duration: "
+            f"{audio_duration:.2f} seconds at path: {file_path}"
+        )
+        voice_path_index.put(self.message_uid, file_path)
+        audio_encoder.schedule(file_path)
+        return file_path, audio_duration
+
+    def cancel(self):
+        """Stop synthesizing, e.g. when the turn has been abandoned."""
+        self._unregister()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        # A stream response may still be reading the segments
+        asyncio.get_running_loop().call_later(
+            TTS_SEGMENT_RETENTION, remove_files, [path for path, _ in self.segments]
+        )
+
+
+def get_voice_segment_path(
+    message_uid: str, segment: int, conversation_uid: Optional[str] = None
+) -> Optional[str]:
+    """Get the path to one sentence segment of a message's voice, if it exists."""
+    directory = (
+        os.path.join(CONVERSATION_DIR, conversation_uid)
+        if conversation_uid
+        else CONVERSATION_DIR
+    )
+    path = os.path.join(directory, f"message_{message_uid}_part{segment}.wav")
+    return path if os.path.exists(path) else None
+
+
 async def use_custom_voice(agent_uid, file_path=None):
     """Store a custom voice file for an agent"""
     try:
@@ -245,6 +1487,15 @@ async def use_custom_voice(agent_uid, file_path=None):
             logger.error(f"Failed to copy file to {dest_path}")
             return None
 
+        # Compute the speaker latents now so the first reply does not pay for it
+        if supports_cached_latents():
+            try:
+                await synthesis_executor.run(
+                    speaker_latent_cache.get, dest_path, label="speaker_latents"
+                )
+            except Exception as e:
+                logger.warning(f"Failed to precompute speaker latents: {e}")
+
         return dest_path
     except Exception as e:
         logger.error(f"Error processing custom voice: {str(e)}")
@@ -278,39 +1529,53 @@ async def get_voice_path(
 ) -> Optional[str]:
     """Get the path to a voice file."""
     try:
-        logger.info(
-            f"Looking for voice file for message: {message_uid} in conversation: {conversation_uid}"
-        )
-
-        if conversation_uid:
-            path = os.path.join(
-                CONVERSATION_DIR, conversation_uid, f"message_{message_uid}.wav"
-            )
-            if os.path.exists(path):
-                logger.info(f"Found voice file at path: {path}")
-                return path
-            else:
-                logger.warning(f"Voice file not found at expected path: {path}")
-
-        base_path = os.path.join(CONVERSATION_DIR, f"message_{message_uid}.wav")
-        if os.path.exists(base_path):
-            logger.info(f"Found voice file in base conversation directory: {base_path}")
-            return base_path
-
-        # Search all conversation directories as a fallback
-        for dir_name in os.listdir(CONVERSATION_DIR):
-            if os.path.isdir(os.path.join(CONVERSATION_DIR, dir_name)):
-                potential_path = os.path.join(
-                    CONVERSATION_DIR, dir_name, f"message_{message_uid}.wav"
-                )
-                if os.path.exists(potential_path):
-                    logger.info(
-                        f"Found voice file in conversation directory {dir_name}: {potential_path}"
-                    )
-                    return potential_path
-
-        logger.warning(f"Voice file not found for message: {message_uid}")
-        return None
+        path = await voice_path_index.resolve(message_uid, conversation_uid)
+        if not path:
+            logger.warning(f"Voice file not found for message: {message_uid}")
+        return path
     except Exception as e:
         logger.error(f"Failed to get voice path: {e}")
         return None
+
+
+def scan_voice_files() -> Dict[str, str]:
+    """Find every message voice file by walking the conversation directories."""
+    found = {}
+    directories = [CONVERSATION_DIR] + [
+        entry.path for entry in os.scandir(CONVERSATION_DIR) if entry.is_dir()
+    ]
+    for directory in directories:
+        for entry in os.scandir(directory):
+            match = VOICE_FILE_PATTERN.match(entry.name)
+            if match and entry.is_file() and "_part" not in match.group(1):
+                found[match.group(1)] = entry.path
+    return found
+
+
+async def repair_voice_paths() -> Dict[str, int]:
+    """
+    Rebuild voice file locations from disk.
+
+    Walks every conversation directory, which get_voice_path no longer
+    does, and records each file found in the index and as the
+    voiceline_path of its message.
+    """
+    found = await asyncio.get_running_loop().run_in_executor(None, scan_voice_files)
+
+    updated = 0
+    db = get_database()
+    for message_uid, path in found.items():
+        voice_path_index.put(message_uid, path)
+        if db is None:
+            continue
+        for collection in (MESSAGE_COLLECTION, GLOBAL_MESSAGE_COLLECTION):
+            result = await db[collection].update_one(
+                {"message_uid": message_uid, "voiceline_path": {"$ne": path}},
+                {"$set": {"voiceline_path": path}},
+            )
+            updated += result.modified_count
+
+    logger.info(
+        f"Voice path repair found {len(found)} files, updated {updated} messages"
+    )
+    return {"files_found": len(found), "messages_updated": updated}
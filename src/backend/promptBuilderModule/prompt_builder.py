@@ -1,10 +1,71 @@
 import logging
+import os
 from typing import List, Dict, Any, Optional
 
 from api.models import MessageType
 
 logger = logging.getLogger(__name__)
 
+# Ollama's context window when an agent does not set num_ctx
+DEFAULT_NUM_CTX = 2048
+# Tokens of the context window kept free for the response (num_predict)
+PROMPT_RESPONSE_RESERVE_TOKENS = int(
+    os.environ.get("PROMPT_RESPONSE_RESERVE_TOKENS", "512")
+)
+# Tokens taken by the prompt's own headings ("CONVERSATION HISTORY:" etc.)
+PROMPT_OVERHEAD_TOKENS = 32
+
+# Shares of what is left of the context window for the parts of a prompt. The
+# history gets whatever the other parts leave. A system prompt over its share
+# loses its generic instruction sections, and anything still over is taken
+# from the history.
+PROMPT_SYSTEM_SHARE = float(os.environ.get("PROMPT_SYSTEM_SHARE", "0.25"))
+PROMPT_RAG_SHARE = float(os.environ.get("PROMPT_RAG_SHARE", "0.25"))
+PROMPT_SUMMARY_SHARE = float(os.environ.get("PROMPT_SUMMARY_SHARE", "0.1"))
+PROMPT_QUERY_SHARE = float(os.environ.get("PROMPT_QUERY_SHARE", "0.15"))
+
+# Rough number of characters per token for English text with Llama-style tokenizers
+CHARS_PER_TOKEN = 4
+# Tokens taken by the "[n] Role: " prefix and spacing around each history message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text without running a tokenizer."""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def prompt_budgets(num_ctx: int = DEFAULT_NUM_CTX) -> Dict[str, int]:
+    """
+    Token budgets for the parts of a prompt in a context window of num_ctx tokens.
+
+    "available" is what the whole prompt may use once the response reserve
+    (at most half the window) and the headings are taken off.
+    """
+    reserve = min(PROMPT_RESPONSE_RESERVE_TOKENS, num_ctx // 2)
+    available = max(0, num_ctx - reserve - PROMPT_OVERHEAD_TOKENS)
+    return {
+        "available": available,
+        "system": int(available * PROMPT_SYSTEM_SHARE),
+        "rag": int(available * PROMPT_RAG_SHARE),
+        "summary": int(available * PROMPT_SUMMARY_SHARE),
+        "query": int(available * PROMPT_QUERY_SHARE),
+    }
+
+
+def default_history_budget() -> int:
+    """History budget in the default context window when every other part fills its share."""
+    budgets = prompt_budgets()
+    return (
+        budgets["available"]
+        - budgets["system"]
+        - budgets["rag"]
+        - budgets["summary"]
+        - budgets["query"]
+    )
+
 
 class PromptBuilder:
     """
@@ -17,6 +78,7 @@ class PromptBuilder:
         personality_prompt: str,
         tts_instructions: Optional[str] = None,
         rag_context: Optional[str] = None,
+        include_guidelines: bool = True,
     ) -> str:
         """
         Build the system prompt using the agent's personality, TTS instructions, and RAG context.
@@ -25,11 +87,15 @@ class PromptBuilder:
             personality_prompt: The personality prompt for the agent
             tts_instructions: Optional TTS-friendly instructions
             rag_context: Optional RAG context with search results or API module results
+            include_guidelines: Whether to include the generic conversation and response guidelines
 
         Returns:
             The formatted system prompt
         """
-        system_prompt = """You are an AI assistant.
+        system_prompt = "You are an AI assistant."
+
+        if include_guidelines:
+            system_prompt += """
 
 ## CONVERSATION CONTEXT INSTRUCTIONS
 1. If the user's query appears to lack specific context (e.g., "What do you think?", "How about that?"), assume it refers to the most recent conversation points in the history.
@@ -54,7 +120,10 @@ class PromptBuilder:
         system_prompt += f"""
 
 ## AGENT IDENTITY
-{personality_prompt}
+{personality_prompt}"""
+
+        if include_guidelines:
+            system_prompt += """
 
 ## RESPONSE GUIDELINES
 1. Maintain your character voice while following the conversation context instructions
@@ -71,6 +140,47 @@ class PromptBuilder:
 
         return system_prompt
 
+    @staticmethod
+    def select_history(
+        messages: List[Dict[str, Any]], budget: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Select the most recent messages that fit in a token budget.
+
+        Messages are added newest first until the next one does not fit, and
+        returned in chronological order. The budget defaults to what a prompt
+        in the default context window leaves for its history at the least.
+        """
+        if budget is None:
+            budget = default_history_budget()
+        selected = []
+        used = 0
+
+        for message in reversed(messages):
+            tokens = estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if used + tokens > budget:
+                break
+            selected.append(message)
+            used += tokens
+
+        if len(selected) < len(messages):
+            logger.debug(
+                f"Kept {len(selected)} of {len(messages)} history messages "
+                f"(~{used} of {budget} tokens)"
+            )
+
+        selected.reverse()
+        return selected
+
+    @staticmethod
+    def fit_to_budget(text: Optional[str], budget: int) -> Optional[str]:
+        """Cut a text down to roughly a token budget, keeping its beginning."""
+        if not text or estimate_tokens(text) <= budget:
+            return text
+
+        logger.debug(f"Truncating text of ~{estimate_tokens(text)} tokens to {budget}")
+        return text[: budget * CHARS_PER_TOKEN].rstrip() + "..."
+
     @staticmethod
     def format_message_history(messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
         """Format conversation messages for LLM context."""
@@ -97,11 +207,17 @@ class PromptBuilder:
 
     @staticmethod
     def build_prompt(
-        system_prompt: str, message_history: List[Dict[str, str]], current_message: str
+        system_prompt: str,
+        message_history: List[Dict[str, str]],
+        current_message: str,
+        summary: Optional[str] = None,
     ) -> str:
         """Construct the complete prompt with system instructions, conversation history, and current query."""
         prompt = f"{system_prompt}\n\n"
 
+        if summary:
+            prompt += f"SUMMARY OF EARLIER CONVERSATION:\n{summary}\n\n"
+
         if message_history:
             prompt += "CONVERSATION HISTORY:\n"
             for i, message in enumerate(message_history):
@@ -123,6 +239,34 @@ class PromptBuilder:
 
         return prompt
 
+    @classmethod
+    def build_turn_prompt(
+        cls,
+        current_message: str,
+        rag_context: Optional[str] = None,
+        num_ctx: int = DEFAULT_NUM_CTX,
+    ) -> str:
+        """
+        Build the prompt for a turn that continues an already evaluated context.
+
+        The system prompt and history are already part of the context, so only
+        per-turn information (RAG or API module results) and the query are
+        sent, each fitted to its share of the context window.
+        """
+        budgets = prompt_budgets(num_ctx)
+        rag_context = cls.fit_to_budget(rag_context, budgets["rag"])
+        current_message = cls.fit_to_budget(current_message, budgets["query"])
+        prompt = ""
+
+        if rag_context and "API MODULE RESULT:" in rag_context:
+            prompt += f"## API MODULE INFORMATION\n{rag_context}\n\n"
+        elif rag_context:
+            prompt += f"## FACTUAL INFORMATION\n{rag_context}\n\n"
+
+        prompt += f"CURRENT QUERY: {current_message}\n\nAssistant:"
+
+        return prompt
+
     @classmethod
     def create_prompt(
         cls,
@@ -131,14 +275,55 @@ class PromptBuilder:
         current_message: str,
         tts_instructions: Optional[str] = None,
         rag_context: Optional[str] = None,
+        summary: Optional[str] = None,
+        num_ctx: int = DEFAULT_NUM_CTX,
     ) -> str:
-        """Create a complete prompt combining personality, conversation history, and current query."""
+        """
+        Create a complete prompt combining personality, conversation history, and current query.
+
+        The prompt is fitted to the model's context window (num_ctx) with room
+        left for the response. The query, RAG context and summary are cut
+        down to their shares of it. A system prompt over its share leaves out
+        the generic guidelines, so the agent's identity and TTS instructions
+        are never cut. The history gets the rest, keeping as many of the most
+        recent messages as fit. A summary of older messages is placed before
+        the history.
+        """
+        budgets = prompt_budgets(num_ctx)
+        current_message = cls.fit_to_budget(current_message, budgets["query"])
+        summary = cls.fit_to_budget(summary, budgets["summary"])
+        rag_context = cls.fit_to_budget(rag_context, budgets["rag"])
+        rag_tokens = estimate_tokens(rag_context)
         system_prompt = cls.build_system_prompt(
             personality_prompt, tts_instructions, rag_context
         )
 
+        if estimate_tokens(system_prompt) - rag_tokens > budgets["system"]:
+            system_prompt = cls.build_system_prompt(
+                personality_prompt,
+                tts_instructions,
+                rag_context,
+                include_guidelines=False,
+            )
+
+        history_budget = (
+            budgets["available"]
+            - estimate_tokens(system_prompt)
+            - estimate_tokens(summary)
+            - estimate_tokens(current_message)
+        )
+        if history_budget < 0:
+            logger.warning(
+                f"Prompt is ~{-history_budget} tokens over the {num_ctx} token "
+                f"context window before any history"
+            )
+
         # Format the message history
-        message_history = cls.format_message_history(messages)
+        message_history = cls.format_message_history(
+            cls.select_history(messages, max(0, history_budget))
+        )
 
         # Build the complete prompt
-        return cls.build_prompt(system_prompt, message_history, current_message)
+        return cls.build_prompt(
+            system_prompt, message_history, current_message, summary
+        )
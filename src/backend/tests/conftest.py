@@ -32,6 +32,16 @@ class MockCursor:
         self.sort_direction = direction
         return self
 
+    def skip(self, count):
+        """Mock skip method."""
+        self.items = self.items[count:]
+        return self
+
+    def limit(self, count):
+        """Mock limit method."""
+        self.items = self.items[:count]
+        return self
+
 
 @pytest.fixture
 def mock_db():
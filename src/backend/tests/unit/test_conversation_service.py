@@ -1,4 +1,5 @@
 import pytest
+import asyncio
 import uuid
 import sys
 import os
@@ -22,6 +23,13 @@ from api.services.conversation_service import (
     get_conversation_with_messages,
     get_conversation_messages,
     add_message,
+    llm_context_fingerprint,
+    get_reusable_llm_context,
+    save_llm_context,
+    summary_update_due,
+    get_unsummarized_messages,
+    update_conversation_summary,
+    TurnRegistry,
 )
 from api.models import MessageType, MessageRating
 from tests.conftest import MockCursor
@@ -478,3 +486,160 @@ async def test_add_message(mock_makedirs, mock_get_db, mock_db, sample_conversat
         mock_db["messages"].insert_one.assert_called_once()
         mock_db["conversations"].update_one.assert_called_once()
         mock_makedirs.assert_called_once()
+
+
+def test_get_reusable_llm_context(sample_conversation):
+    """Test that a stored context is reused only when it is still valid."""
+    fingerprint = llm_context_fingerprint("llama3", "personality", "tts")
+    sample_conversation["message_count"] = 5
+    sample_conversation["llm_context"] = {
+        "context": [1, 2, 3],
+        "fingerprint": fingerprint,
+        "message_count": 4,
+    }
+
+    assert get_reusable_llm_context(sample_conversation, fingerprint) == [1, 2, 3]
+
+    # Different model or agent prompt
+    other = llm_context_fingerprint("mistral", "personality", "tts")
+    assert get_reusable_llm_context(sample_conversation, other) is None
+
+    # Messages were added without updating the context
+    sample_conversation["message_count"] = 7
+    assert get_reusable_llm_context(sample_conversation, fingerprint) is None
+
+    # Context window is full
+    sample_conversation["message_count"] = 5
+    sample_conversation["llm_context"]["context"] = list(range(1800))
+    assert get_reusable_llm_context(sample_conversation, fingerprint) is None
+    assert get_reusable_llm_context(sample_conversation, fingerprint, 8192) is not None
+
+
+def test_get_reusable_llm_context_missing(sample_conversation):
+    """Test that conversations without a stored context are rebuilt."""
+    fingerprint = llm_context_fingerprint("llama3", "personality", None)
+    assert get_reusable_llm_context(sample_conversation, fingerprint) is None
+
+
+@pytest.mark.asyncio
+@patch("api.services.conversation_service.get_database")
+async def test_save_llm_context(mock_get_db, mock_db, sample_conversation):
+    """Test storing the LLM context on the conversation document."""
+    mock_get_db.return_value = mock_db
+    mock_db["conversations"].update_one = AsyncMock()
+
+    await save_llm_context(sample_conversation["conversation_uid"], [1, 2, 3], "abc", 4)
+
+    args, _ = mock_db["conversations"].update_one.call_args
+    assert args[0] == {"conversation_uid": sample_conversation["conversation_uid"]}
+    stored = args[1]["$set"]["llm_context"]
+    assert stored["context"] == [1, 2, 3]
+    assert stored["fingerprint"] == "abc"
+    assert stored["message_count"] == 4
+
+
+def test_summary_update_due(sample_conversation):
+    """Test summaries are updated every few turns, leaving the history out."""
+    sample_conversation["message_count"] = 10
+    assert not summary_update_due(sample_conversation, 6)
+
+    sample_conversation["message_count"] = 12
+    assert summary_update_due(sample_conversation, 6)
+    assert not summary_update_due(sample_conversation, 8)
+
+    sample_conversation["summary"] = {"text": "Earlier chat", "message_count": 6}
+    assert not summary_update_due(sample_conversation, 6)
+
+
+def test_get_unsummarized_messages(sample_conversation):
+    """Test messages the summary covers are dropped from the history."""
+    messages = [{"content": f"message {i}"} for i in range(10, 20)]
+    sample_conversation["message_count"] = 20
+
+    assert get_unsummarized_messages(sample_conversation, messages) == messages
+
+    sample_conversation["summary"] = {"text": "Earlier chat", "message_count": 14}
+    assert get_unsummarized_messages(sample_conversation, messages) == messages[4:]
+
+    sample_conversation["summary"]["message_count"] = 8
+    assert get_unsummarized_messages(sample_conversation, messages) == messages
+
+
+@pytest.mark.asyncio
+@patch("api.services.conversation_service.get_database")
+@patch("api.services.conversation_service.get_recent_messages")
+@patch("api.services.conversation_service.get_conversation")
+@patch("api.services.conversation_service.generate_text")
+async def test_update_conversation_summary(
+    mock_generate_text,
+    mock_get_conversation,
+    mock_get_recent_messages,
+    mock_get_db,
+    mock_db,
+    sample_conversation,
+):
+    """Test new messages are folded into the stored summary."""
+    sample_conversation["message_count"] = 18
+    sample_conversation["summary"] = {"text": "User is Alex.", "message_count": 6}
+    mock_get_conversation.return_value = sample_conversation
+    mock_get_db.return_value = mock_db
+
+    # About 110 tokens each, so the history budget fits the last three
+    messages = [
+        {"message_type": MessageType.USER, "content": f"message {i} " + "x" * 420}
+        for i in range(18)
+    ]
+    mock_get_recent_messages.return_value = messages
+    mock_db["messages"].find = MagicMock(return_value=MockCursor(messages))
+    mock_db["conversations"].update_one = AsyncMock()
+    mock_generate_text.return_value = " Alex likes hiking. "
+
+    assert await update_conversation_summary(
+        sample_conversation["conversation_uid"], "llama3"
+    )
+
+    # Only the messages after the summary and before the history are summarized
+    prompt = mock_generate_text.call_args.kwargs["prompt"]
+    assert "User is Alex." in prompt
+    assert "message 6 " in prompt and "message 14 " in prompt
+    assert "message 5 " not in prompt and "message 15 " not in prompt
+
+    args, _ = mock_db["conversations"].update_one.call_args
+    assert args[1]["$set"]["summary"]["text"] == "Alex likes hiking."
+    assert args[1]["$set"]["summary"]["message_count"] == 15
+
+
+@pytest.mark.asyncio
+async def test_turn_registry_cancels_superseded_turn():
+    """Test a newer turn cancels the one still running for the conversation."""
+    registry = TurnRegistry()
+    started = asyncio.Event()
+    cancelled = []
+
+    async def slow_turn():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def quick_turn(value):
+        return value
+
+    first = asyncio.create_task(registry.run("conv-1", slow_turn))
+    await started.wait()
+    assert registry.is_active("conv-1")
+
+    assert await registry.run("conv-1", quick_turn, "reply") == "reply"
+    assert await first is None
+    assert cancelled == [True]
+    assert not registry.is_active("conv-1")
+    assert registry.stats == {"started": 2, "cancelled": 1}
+
+
+@pytest.mark.asyncio
+async def test_turn_registry_cancel_without_turn():
+    """Test cancelling a conversation with nothing in flight is a no-op."""
+    registry = TurnRegistry()
+    assert not registry.cancel("conv-1", "last subscriber left")
@@ -0,0 +1,62 @@
+import pytest
+import sys
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Mock the modules that require external dependencies
+sys.modules["spacy"] = MagicMock()
+sys.modules["nltk"] = MagicMock()
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.models import GlobalConversationResponse
+from api.routers import global_conversation
+from api.security import get_current_user
+
+
+@pytest.fixture
+def client():
+    """Test client serving only the global conversation router."""
+    app = FastAPI()
+    app.include_router(global_conversation.router)
+    app.dependency_overrides[get_current_user] = lambda: {"username": "test"}
+    return TestClient(app)
+
+
+def test_get_global_conversation_route(client):
+    """Test that GET /global_conversation returns the conversation with messages."""
+    conversation = {
+        "conversation_uid": "global",
+        "created_at": datetime.utcnow(),
+        "message_count": 1,
+        "messages": [
+            {
+                "message_uid": "msg-1",
+                "conversation_uid": "global",
+                "content": "Hello",
+                "message_type": "user",
+                "created_at": datetime.utcnow(),
+            }
+        ],
+    }
+
+    with patch(
+        "api.routers.global_conversation.get_global_conversation_with_messages",
+        new=AsyncMock(return_value=conversation),
+    ) as get_conversation:
+        response = client.get("/global_conversation", params={"limit": 10})
+
+    assert response.status_code == 200
+    body = GlobalConversationResponse.model_validate(response.json())
+    assert body.conversation_uid == "global"
+    assert body.messages[0].content == "Hello"
+    get_conversation.assert_awaited_once_with(limit=10, skip=0)
+
+
+def test_audio_segment_helper_is_not_a_route():
+    """Test that the audio segment publisher cannot be reached over HTTP."""
+    endpoints = {route.endpoint for route in global_conversation.router.routes}
+
+    assert global_conversation.get_global_conversation in endpoints
+    assert global_conversation.publish_global_audio_segment not in endpoints
@@ -2,6 +2,11 @@ import pytest
 import sys
 from unittest.mock import AsyncMock, MagicMock, patch
 import uuid
+import json
+import asyncio
+import httpx
+import os
+import time
 from datetime import datetime
 
 from api.services.llm_service import (
@@ -10,9 +15,38 @@ from api.services.llm_service import (
     get_all_llm_configs,
     update_llm_config,
     archive_llm_config,
+    generate_text_stream,
+    generate_text,
+    OllamaClient,
+    ModelResidencyManager,
+    LLMScheduler,
+    LLMQueueFullError,
+    LLMQueueTimeoutError,
+    PRIORITY_VOICE,
+    PRIORITY_BATCH,
+    GenerationCache,
+    list_ollama_models,
+    delete_ollama_model,
+    get_generation_stats,
+    batch_generate,
+    GenerationCoalescer,
+    ModelCatalogue,
+    ModelPullManager,
 )
 
 
+def mock_ollama_client(handler):
+    """Return an OllamaClient that routes requests to a mock Ollama handler."""
+    return OllamaClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.fixture(autouse=True)
+def fresh_model_catalogue():
+    """Give every test an empty model catalogue cache."""
+    with patch("api.services.llm_service.model_catalogue", ModelCatalogue()):
+        yield
+
+
 @pytest.mark.asyncio
 @patch("api.services.llm_service.get_database")
 async def test_create_llm_config(mock_get_database):
@@ -176,3 +210,737 @@ async def test_archive_llm_config(mock_get_database):
     assert "$set" in args[1]
     assert "is_archived" in args[1]["$set"]
     assert args[1]["$set"]["is_archived"] is True
+
+
+@pytest.mark.asyncio
+async def test_generate_text_stream_yields_chunks():
+    """Test that streamed generation yields each token chunk from Ollama."""
+    captured = {}
+
+    def handler(request):
+        captured["body"] = json.loads(request.content)
+        lines = [
+            {"response": "Hello", "done": False},
+            {"response": ", ", "done": False},
+            {"response": "world", "done": False},
+            {"response": "", "done": True},
+        ]
+        return httpx.Response(
+            200, content="\n".join(json.dumps(line) for line in lines).encode()
+        )
+
+    with patch("api.services.llm_service.ollama_client", mock_ollama_client(handler)):
+        chunks = [chunk async for chunk in generate_text_stream("llama3", "Hi")]
+
+    assert chunks == ["Hello", ", ", "world"]
+    assert captured["body"]["stream"] is True
+    assert captured["body"]["model"] == "llama3"
+    assert captured["body"]["options"]["num_predict"] == 2048
+
+
+@pytest.mark.asyncio
+async def test_generate_text_stream_raises_ollama_error():
+    """Test that an Ollama error response is surfaced as a ValueError."""
+
+    def handler(request):
+        return httpx.Response(404, json={"error": "model 'missing' not found"})
+
+    with patch("api.services.llm_service.ollama_client", mock_ollama_client(handler)):
+        with pytest.raises(ValueError, match="model 'missing' not found"):
+            async for _ in generate_text_stream("missing", "Hi"):
+                pass
+
+
+@pytest.mark.asyncio
+async def test_ollama_client_reused_across_calls():
+    """Test that generation calls share one client and update its counters."""
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        return httpx.Response(200, json={"response": "Hi there", "done": True})
+
+    client = mock_ollama_client(handler)
+    with patch("api.services.llm_service.ollama_client", client):
+        first = await generate_text("llama3", "Hello")
+        second = await generate_text("llama3", "Hello again")
+
+    assert first == second == "Hi there"
+    assert requests == ["/api/generate", "/api/generate"]
+
+    stats = client.get_stats()
+    assert stats["requests"] == 2
+    assert stats["operations"]["generate"] == 2
+    assert stats["in_flight"] == 0
+    assert stats["errors"] == 0
+    await client.aclose()
+
+
+def test_ollama_client_operation_timeouts():
+    """Test that each operation uses its own configured timeout."""
+    client = OllamaClient(timeouts={"tags": 3.0})
+
+    assert client._timeout("tags").read == 3.0
+    assert client._timeout("generate").read == 90.0
+    assert client._timeout("unknown").read == 30.0
+    assert client._timeout("generate").connect == 5.0
+
+
+@pytest.mark.asyncio
+async def test_generate_text_continues_context():
+    """Test that a stored context is sent and the new context is returned."""
+    captured = {}
+
+    def handler(request):
+        captured["body"] = json.loads(request.content)
+        return httpx.Response(
+            200,
+            json={
+                "response": "Sure.",
+                "done": True,
+                "context": [1, 2, 3, 4, 5],
+                "eval_count": 2,
+            },
+        )
+
+    final = {}
+    with patch("api.services.llm_service.ollama_client", mock_ollama_client(handler)):
+        text = await generate_text("llama3", "Next?", context=[1, 2, 3], final=final)
+
+    assert text == "Sure."
+    assert captured["body"]["context"] == [1, 2, 3]
+    assert final["context"] == [1, 2, 3, 4, 5]
+    assert final["eval_count"] == 2
+    assert "response" not in final
+
+
+@pytest.mark.asyncio
+async def test_residency_manager_evicts_least_recently_used():
+    """Test that the least recently used model is unloaded to stay in budget."""
+    unloaded = []
+
+    def handler(request):
+        if request.url.path == "/api/tags":
+            return httpx.Response(
+                200,
+                json={
+                    "models": [
+                        {"name": "llama3:latest", "size": 500},
+                        {"name": "mistral:latest", "size": 500},
+                        {"name": "phi3:latest", "size": 500},
+                    ]
+                },
+            )
+        body = json.loads(request.content)
+        if body.get("keep_alive") == 0:
+            unloaded.append(body["model"])
+        return httpx.Response(200, json={"done": True})
+
+    manager = ModelResidencyManager(keep_alive="10m", memory_budget=1000)
+    with patch("api.services.llm_service.ollama_client", mock_ollama_client(handler)):
+        await manager.ensure_resident("llama3")
+        await manager.ensure_resident("mistral")
+        # Using llama3 again makes mistral the least recently used model
+        await manager.ensure_resident("llama3")
+        await manager.ensure_resident("phi3")
+
+    assert unloaded == ["mistral:latest"]
+    assert [m["name"] for m in manager.get_resident_models()] == [
+        "phi3:latest",
+        "llama3:latest",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_residency_manager_looks_up_size_outside_lock():
+    """Test that a slow catalogue lookup does not block resident models."""
+    manager = ModelResidencyManager(memory_budget=1000)
+    manager.resident["llama3:latest"] = {
+        "size": 500,
+        "last_used": None,
+        "expires_at": None,
+    }
+    catalogue = asyncio.Event()
+
+    async def slow_model_size(model):
+        await catalogue.wait()
+        return 500
+
+    with patch.object(manager, "_model_size", slow_model_size):
+        loading = asyncio.create_task(manager.ensure_resident("mistral"))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(manager.ensure_resident("llama3"), timeout=1)
+        catalogue.set()
+        await loading
+
+    assert [m["name"] for m in manager.get_resident_models()] == [
+        "mistral:latest",
+        "llama3:latest",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_residency_manager_preload_and_refresh():
+    """Test preloading a model and syncing with the models Ollama has loaded."""
+    requests = []
+
+    def handler(request):
+        if request.url.path == "/api/ps":
+            return httpx.Response(
+                200, json={"models": [{"name": "llama3:latest", "size": 4000}]}
+            )
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json={"done": True})
+
+    manager = ModelResidencyManager(keep_alive="1h")
+    with patch("api.services.llm_service.ollama_client", mock_ollama_client(handler)):
+        await manager.preload("llama3")
+        await manager.preload("mistral")
+        await manager.refresh()
+
+    assert requests == [
+        {"model": "llama3", "keep_alive": "1h"},
+        {"model": "mistral", "keep_alive": "1h"},
+    ]
+    resident = manager.get_resident_models()
+    assert [m["name"] for m in resident] == ["llama3:latest"]
+    assert resident[0]["size"] == 4000
+
+
+@pytest.mark.asyncio
+async def test_scheduler_serves_higher_priority_first():
+    """Test that waiting voice turns are served before batch requests."""
+    scheduler = LLMScheduler(max_concurrency=1, max_queue_size=10)
+    order = []
+
+    async def run(name, priority):
+        async with scheduler.slot("llama3", priority):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    await scheduler.acquire("llama3")
+    tasks = [
+        asyncio.create_task(run("batch", PRIORITY_BATCH)),
+        asyncio.create_task(run("voice", PRIORITY_VOICE)),
+    ]
+    await asyncio.sleep(0)
+    assert scheduler.queue_depth("llama3") == 2
+
+    scheduler.release("llama3")
+    await asyncio.gather(*tasks)
+
+    assert order == ["voice", "batch"]
+    stats = scheduler.get_stats()
+    assert stats["queue_depth"] == 0
+    assert stats["models"]["llama3:latest"]["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_rejects_when_queue_full():
+    """Test that requests are rejected straight away once the queue is full."""
+    scheduler = LLMScheduler(max_concurrency=1, max_queue_size=1)
+
+    await scheduler.acquire("llama3")
+    waiter = asyncio.create_task(scheduler.acquire("llama3"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(LLMQueueFullError):
+        scheduler.check_capacity("llama3")
+    with pytest.raises(LLMQueueFullError):
+        await scheduler.acquire("llama3")
+
+    # Other models are not affected
+    scheduler.check_capacity("mistral")
+
+    scheduler.release("llama3")
+    await waiter
+    scheduler.release("llama3")
+    assert scheduler.get_stats()["rejected"] == 2
+
+
+@pytest.mark.asyncio
+async def test_scheduler_times_out_waiting_requests():
+    """Test that a request gives up after the queue timeout and leaves the queue."""
+    scheduler = LLMScheduler(max_concurrency=1, max_queue_size=5, queue_timeout=0.01)
+
+    await scheduler.acquire("llama3")
+    with pytest.raises(LLMQueueTimeoutError):
+        await scheduler.acquire("llama3")
+
+    assert scheduler.queue_depth("llama3") == 0
+    scheduler.release("llama3")
+    assert scheduler.get_stats()["models"]["llama3:latest"]["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_generation_cache_serves_deterministic_requests():
+    """Test that temperature 0 requests are cached and others bypass the cache."""
+    calls = []
+
+    def handler(request):
+        calls.append(json.loads(request.content))
+        return httpx.Response(200, json={"response": "Hello!", "done": True})
+
+    cache = GenerationCache(enabled=True, max_entries=10, ttl=60)
+    with patch(
+        "api.services.llm_service.ollama_client", mock_ollama_client(handler)
+    ), patch("api.services.llm_service.generation_cache", cache):
+        first = await generate_text("llama3", "Hi", temperature=0)
+        second = await generate_text("llama3", "Hi", temperature=0)
+        streamed = [
+            c async for c in generate_text_stream("llama3", "Hi", temperature=0)
+        ]
+        await generate_text("llama3", "Hi", temperature=0.7)
+        await generate_text("llama3", "Hi", temperature=0.7)
+        await generate_text("llama3", "Hi", temperature=0.7, seed=42)
+        await generate_text("llama3", "Hi", temperature=0.7, seed=42)
+
+    assert first == second == "Hello!"
+    assert streamed == ["Hello!"]
+    # One call for temperature 0, two uncached calls, one call for the seeded request
+    assert len(calls) == 4
+    stats = cache.get_stats()
+    assert stats["hits"] == 3
+    assert stats["bypassed"] == 2
+
+
+def test_generation_cache_key_includes_options():
+    """Test that requests with different options get different keys."""
+    params = {"model": "llama3", "prompt": "Hi", "options": {"temperature": 0}}
+    other = {
+        "model": "llama3",
+        "prompt": "Hi",
+        "options": {"temperature": 0, "top_k": 1},
+    }
+
+    assert GenerationCache.make_key(params) != GenerationCache.make_key(other)
+    assert GenerationCache.make_key(params) == GenerationCache.make_key(
+        {**params, "model": "llama3:latest"}
+    )
+
+
+def test_generation_cache_ttl_lru_and_disk(tmp_path):
+    """Test TTL expiry, LRU eviction and the on-disk tier."""
+    cache = GenerationCache(
+        enabled=True, max_entries=2, ttl=60, cache_dir=str(tmp_path)
+    )
+    cache.set("a", {"response": "A"})
+    cache.set("b", {"response": "B"})
+    assert cache.get("a") == {"response": "A"}
+    cache.set("c", {"response": "C"})
+
+    # b was least recently used and is evicted from memory and disk
+    assert cache.get("b") is None
+    assert not (tmp_path / "b.json").exists()
+
+    # A new cache instance reads entries back from disk
+    restarted = GenerationCache(
+        enabled=True, max_entries=2, ttl=60, cache_dir=str(tmp_path)
+    )
+    assert restarted.get("c") == {"response": "C"}
+    assert restarted.get_stats()["disk_hits"] == 1
+
+    expired = GenerationCache(
+        enabled=True, max_entries=2, ttl=-1, cache_dir=str(tmp_path)
+    )
+    assert expired.get("a") is None
+    assert not (tmp_path / "a.json").exists()
+
+
+def test_generation_cache_prunes_disk_on_startup(tmp_path):
+    """Test files left by earlier runs are indexed, expired and size-limited."""
+    now = time.time()
+    for index, key in enumerate(["old", "a", "b", "c"]):
+        path = tmp_path / f"{key}.json"
+        path.write_text(json.dumps({"created_at": now, "data": {"response": key}}))
+        modified = now - 1000 if key == "old" else now - 30 + index
+        os.utime(path, (modified, modified))
+
+    cache = GenerationCache(
+        enabled=True, max_entries=2, ttl=60, cache_dir=str(tmp_path)
+    )
+
+    # "old" is past its TTL and "a" is the oldest beyond max_entries
+    assert sorted(os.listdir(tmp_path)) == ["b.json", "c.json"]
+    assert cache.get_stats()["entries"] == 2
+    assert cache.get_stats()["loaded_entries"] == 0
+    assert cache.get("b") == {"response": "b"}
+
+    cache.set("d", {"response": "D"})
+    assert sorted(os.listdir(tmp_path)) == ["b.json", "d.json"]
+
+
+def fake_backends(handlers):
+    """Return an OllamaClient whose backends are served by per-host handlers."""
+
+    def handler(request):
+        return handlers[request.url.host](request)
+
+    return OllamaClient(
+        backends=[f"http://{host}:11434/api" for host in handlers],
+        transport=httpx.MockTransport(handler),
+    )
+
+
+@pytest.mark.asyncio
+async def test_ollama_client_routes_to_backend_with_model_loaded():
+    """Test generation goes to the least loaded backend that holds the model."""
+    seen = []
+
+    def make_handler(host, loaded):
+        def handler(request):
+            if request.url.path == "/api/ps":
+                return httpx.Response(200, json={"models": [{"name": loaded}]})
+            if request.url.path == "/api/tags":
+                return httpx.Response(200, json={"models": [{"name": loaded}]})
+            seen.append(host)
+            return httpx.Response(200, json={"response": host, "done": True})
+
+        return handler
+
+    client = fake_backends(
+        {
+            "a": make_handler("a", "mistral:latest"),
+            "b": make_handler("b", "llama3:latest"),
+        }
+    )
+    await client.check_health()
+
+    with patch("api.services.llm_service.ollama_client", client):
+        assert await generate_text(model="llama3", prompt="Hi") == "b"
+        assert await generate_text(model="mistral", prompt="Hi") == "a"
+
+    assert seen == ["b", "a"]
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_ollama_client_fails_over_to_healthy_backend():
+    """Test a backend that cannot be reached is skipped and marked unhealthy."""
+
+    def down(request):
+        raise httpx.ConnectError("Connection refused", request=request)
+
+    def up(request):
+        return httpx.Response(200, json={"response": "ok", "done": True})
+
+    client = fake_backends({"a": down, "b": up})
+
+    with patch("api.services.llm_service.ollama_client", client):
+        assert await generate_text(model="llama3", prompt="Hi") == "ok"
+        chunks = [
+            chunk async for chunk in generate_text_stream(model="llama3", prompt="Hi")
+        ]
+
+    assert chunks == ["ok"]
+    stats = client.get_stats()
+    assert stats["failovers"] == 1
+    assert [b["healthy"] for b in stats["backends"]] == [False, True]
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_list_ollama_models_merges_backends():
+    """Test the model list combines the catalogue of every backend."""
+
+    def make_handler(names):
+        def handler(request):
+            return httpx.Response(
+                200, json={"models": [{"name": name} for name in names]}
+            )
+
+        return handler
+
+    client = fake_backends(
+        {
+            "a": make_handler(["llama3:latest", "mistral:latest"]),
+            "b": make_handler(["llama3:latest", "phi3:latest"]),
+        }
+    )
+
+    with patch("api.services.llm_service.ollama_client", client):
+        models = await list_ollama_models()
+
+    assert [m["name"] for m in models] == [
+        "llama3:latest",
+        "mistral:latest",
+        "phi3:latest",
+    ]
+    await client.aclose()
+
+
+def test_get_generation_stats():
+    """Test token counts and timings are taken from Ollama's final response."""
+    stats = get_generation_stats(
+        {
+            "done": True,
+            "context": [1, 2, 3],
+            "prompt_eval_count": 200,
+            "eval_count": 50,
+            "load_duration": 2_000_000_000,
+            "prompt_eval_duration": 500_000_000,
+            "eval_duration": 2_000_000_000,
+        }
+    )
+
+    assert stats == {
+        "prompt_eval_count": 200,
+        "eval_count": 50,
+        "load_duration": 2.0,
+        "prompt_eval_duration": 0.5,
+        "eval_duration": 2.0,
+        "tokens_per_second": 25.0,
+        "prompt_tokens_per_second": 400.0,
+        "prompt_eval_share": 0.2,
+    }
+    assert get_generation_stats({"eval_count": 5, "cached": True}) == {"cached": True}
+
+
+@pytest.mark.asyncio
+async def test_batch_generate_reports_each_prompt():
+    """Test batch generation yields every prompt's result, including failures."""
+
+    def handler(request):
+        prompt = json.loads(request.content)["prompt"]
+        if prompt == "fail":
+            return httpx.Response(400, json={"error": "bad prompt"})
+        return httpx.Response(
+            200,
+            json={
+                "response": prompt.upper(),
+                "done": True,
+                "eval_count": 10,
+                "eval_duration": 1_000_000_000,
+            },
+        )
+
+    llm_config = {"model": "llama3", "temperature": 0.7}
+
+    with patch("api.services.llm_service.ollama_client", mock_ollama_client(handler)):
+        results = [
+            result
+            async for result in batch_generate(
+                ["a", "fail", "c"], llm_config, concurrency=2
+            )
+        ]
+
+    results.sort(key=lambda r: r["index"])
+    assert [r["status"] for r in results] == ["success", "error", "success"]
+    assert results[0]["response"] == "A"
+    assert results[0]["llm_stats"]["tokens_per_second"] == 10.0
+    assert results[1]["error"] == "bad prompt"
+    assert all(r["latency"] >= 0 for r in results)
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_one_generation():
+    """Test concurrent identical requests are served by one upstream call."""
+    calls = []
+    release = asyncio.Event()
+
+    async def handler(request):
+        calls.append(json.loads(request.content)["prompt"])
+        await release.wait()
+        body = (
+            json.dumps({"response": "Hel", "done": False})
+            + "\n"
+            + json.dumps({"response": "lo", "done": True, "eval_count": 2})
+            + "\n"
+        )
+        return httpx.Response(200, content=body)
+
+    async def collect(prompt, final):
+        return [
+            chunk
+            async for chunk in generate_text_stream(
+                model="llama3", prompt=prompt, final=final
+            )
+        ]
+
+    finals = [{}, {}, {}]
+    with patch(
+        "api.services.llm_service.ollama_client", mock_ollama_client(handler)
+    ), patch(
+        "api.services.llm_service.generation_coalescer", GenerationCoalescer()
+    ) as coalescer:
+        tasks = [
+            asyncio.create_task(collect("Hi", finals[0])),
+            asyncio.create_task(collect("Hi", finals[1])),
+            asyncio.create_task(collect("Bye", finals[2])),
+        ]
+        await asyncio.sleep(0.05)
+        release.set()
+        results = await asyncio.gather(*tasks)
+        assert coalescer.get_stats()["in_flight"] == 0
+
+    assert sorted(calls) == ["Bye", "Hi"]
+    assert results[0] == results[1] == ["Hel", "lo"]
+    assert finals[0]["eval_count"] == finals[1]["eval_count"] == 2
+    assert coalescer.stats["coalesced"] == 1
+
+
+@pytest.mark.asyncio
+async def test_shared_generation_cancelled_when_abandoned():
+    """Test the upstream call is cancelled once no request follows it."""
+    started = asyncio.Event()
+
+    async def handler(request):
+        started.set()
+        await asyncio.sleep(10)
+        return httpx.Response(200, json={"response": "late", "done": True})
+
+    with patch(
+        "api.services.llm_service.ollama_client", mock_ollama_client(handler)
+    ), patch(
+        "api.services.llm_service.generation_coalescer", GenerationCoalescer()
+    ) as coalescer:
+        task = asyncio.create_task(generate_text(model="llama3", prompt="Hi"))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+
+    assert coalescer.stats["cancelled"] == 1
+    assert coalescer.get_stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_model_catalogue_cached_until_change():
+    """Test the model list is cached and refetched after a model is deleted."""
+    tags_requests = []
+
+    def handler(request):
+        if request.url.path == "/api/tags":
+            tags_requests.append(request)
+            return httpx.Response(
+                200,
+                json={
+                    "models": [
+                        {
+                            "name": "llama3:latest",
+                            "size": 4661224676,
+                            "digest": "365c0bd3c000",
+                            "modified_at": "2024-05-01T10:00:00Z",
+                            "details": {"family": "llama"},
+                        }
+                    ]
+                },
+            )
+        return httpx.Response(200, json={"status": "success"})
+
+    with patch("api.services.llm_service.ollama_client", mock_ollama_client(handler)):
+        models = await list_ollama_models()
+        assert await list_ollama_models() == models
+        assert len(tags_requests) == 1
+
+        await delete_ollama_model("mistral")
+        await list_ollama_models()
+        assert len(tags_requests) == 2
+
+        await list_ollama_models(refresh=True)
+        assert len(tags_requests) == 3
+
+    assert models[0]["digest"] == "365c0bd3c000"
+    assert models[0]["size"] == 4661224676
+    assert models[0]["modified_at"] == "2024-05-01T10:00:00Z"
+
+
+@pytest.mark.asyncio
+async def test_model_pull_job_publishes_progress():
+    """Test a pull job streams progress and can be cancelled and resumed."""
+    block = asyncio.Event()
+
+    async def handler(request):
+        if not block.is_set():
+            # The first attempt hangs mid-download until it is cancelled
+            await asyncio.sleep(10)
+        lines = [
+            {"status": "pulling manifest"},
+            {"status": "downloading", "total": 100, "completed": 50},
+            {"status": "downloading", "total": 100, "completed": 100},
+            {"status": "success"},
+        ]
+        return httpx.Response(200, content="\n".join(json.dumps(l) for l in lines))
+
+    published = []
+
+    async def publish(channel, message, buffer=True):
+        published.append(json.loads(message)["job"]["status"])
+
+    manager = ModelPullManager()
+    with patch(
+        "api.services.llm_service.ollama_client", mock_ollama_client(handler)
+    ), patch("api.services.llm_service.pubsub_client.publish", publish):
+        job = manager.start("llama3")
+        assert manager.start("llama3") is job
+        await asyncio.sleep(0.05)
+
+        assert manager.cancel(job["job_id"])["status"] == "cancelling"
+        await asyncio.sleep(0.05)
+        assert job["status"] == "cancelled"
+
+        block.set()
+        manager.resume(job["job_id"])
+        while job["status"] in ModelPullManager.ACTIVE_STATUSES:
+            await asyncio.sleep(0.01)
+
+    assert job["status"] == "completed"
+    assert job["completed"] == job["total"] == 100
+    assert published[-1] == "completed"
+    assert "cancelled" in published
+    assert manager.get_job(job["job_id"]) is job
+
+
+@pytest.mark.asyncio
+async def test_model_pull_resume_keeps_new_task():
+    """Test a cancelled task finishing late does not forget the resumed one."""
+
+    async def handler(request):
+        await asyncio.sleep(10)
+
+    manager = ModelPullManager()
+    with patch(
+        "api.services.llm_service.ollama_client", mock_ollama_client(handler)
+    ), patch("api.services.llm_service.pubsub_client.publish", AsyncMock()):
+        job = manager.start("llama3")
+        await asyncio.sleep(0.01)
+        first = manager._tasks[job["job_id"]]
+
+        manager.cancel(job["job_id"])
+        job["status"] = "cancelled"
+        manager.resume(job["job_id"])
+        second = manager._tasks[job["job_id"]]
+        await asyncio.gather(first, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        assert second is not first
+        assert manager._tasks[job["job_id"]] is second
+
+        manager.cancel(job["job_id"])
+        await asyncio.gather(second, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    assert job["job_id"] not in manager._tasks
+
+
+@pytest.mark.asyncio
+async def test_model_pull_forgets_finished_jobs():
+    """Test finished jobs are dropped once too many have finished."""
+
+    def handler(request):
+        return httpx.Response(200, content=json.dumps({"status": "success"}))
+
+    manager = ModelPullManager(max_finished_jobs=1)
+    with patch(
+        "api.services.llm_service.ollama_client", mock_ollama_client(handler)
+    ), patch("api.services.llm_service.pubsub_client.publish", AsyncMock()):
+        first = manager.start("llama3")
+        await asyncio.gather(*manager._tasks.values())
+        second = manager.start("mistral")
+        await asyncio.gather(*manager._tasks.values())
+        await asyncio.sleep(0)
+
+    assert second["status"] == "completed"
+    assert manager.get_job(first["job_id"]) is None
+    assert manager.list_jobs() == [second]
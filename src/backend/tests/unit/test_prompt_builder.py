@@ -3,7 +3,12 @@ import sys
 from unittest.mock import MagicMock
 
 # Import the module
-from promptBuilderModule.prompt_builder import PromptBuilder
+from promptBuilderModule.prompt_builder import (
+    PROMPT_RESPONSE_RESERVE_TOKENS,
+    PromptBuilder,
+    estimate_tokens,
+    prompt_budgets,
+)
 from api.models import MessageType
 
 
@@ -241,3 +246,149 @@ def test_create_prompt():
     assert "Morgan:" in prompt
     assert "CURRENT QUERY: What can you help me with?" in prompt
     assert prompt.endswith("Assistant:")
+
+
+def test_build_turn_prompt():
+    """Test building the prompt for a turn that continues a stored context."""
+    prompt = PromptBuilder.build_turn_prompt("And tomorrow?")
+
+    assert prompt == "CURRENT QUERY: And tomorrow?\n\nAssistant:"
+    assert "AGENT IDENTITY" not in prompt
+
+    rag_prompt = PromptBuilder.build_turn_prompt(
+        "What is the population of Ireland?",
+        "The population of Ireland is approximately 5 million people.",
+    )
+    assert rag_prompt.startswith("## FACTUAL INFORMATION")
+    assert rag_prompt.endswith(
+        "CURRENT QUERY: What is the population of Ireland?\n\nAssistant:"
+    )
+
+    api_prompt = PromptBuilder.build_turn_prompt(
+        "Weather in Dublin?", "API MODULE RESULT: 15°C and partly cloudy."
+    )
+    assert api_prompt.startswith("## API MODULE INFORMATION")
+
+
+def test_build_turn_prompt_fits_context_window():
+    """Test a continued turn cuts an oversized RAG context and query."""
+    rag_context = "fact " * 1000
+    query = "Tell me more " * 200
+    budgets = prompt_budgets(1024)
+
+    prompt = PromptBuilder.build_turn_prompt(query, rag_context, num_ctx=1024)
+
+    assert rag_context not in prompt and query not in prompt
+    assert estimate_tokens(prompt) < budgets["rag"] + budgets["query"] + 20
+
+
+def test_select_history_fills_budget_newest_first():
+    """Test history keeps the most recent messages that fit in the token budget."""
+    messages = [
+        {"message_type": MessageType.USER, "content": "x" * 400},
+        {"message_type": MessageType.AGENT, "content": "short answer"},
+        {"message_type": MessageType.USER, "content": "short question"},
+    ]
+
+    # The long first message does not fit, the two short ones do
+    selected = PromptBuilder.select_history(messages, budget=50)
+    assert [m["content"] for m in selected] == ["short answer", "short question"]
+
+    # With room for everything all messages are kept in order
+    assert PromptBuilder.select_history(messages, budget=1000) == messages
+    assert PromptBuilder.select_history(messages, budget=0) == []
+
+
+def test_create_prompt_fits_rag_context_to_budget():
+    """Test an oversized RAG context is cut down to its token budget."""
+    rag_context = "fact " * 1000
+
+    prompt = PromptBuilder.create_prompt(
+        personality_prompt="You are Morgan.",
+        messages=[],
+        current_message="Tell me everything",
+        rag_context=rag_context,
+    )
+
+    assert "FACTUAL INFORMATION" in prompt
+    assert rag_context not in prompt
+    assert estimate_tokens(prompt) < estimate_tokens(rag_context)
+
+
+def test_create_prompt_includes_summary():
+    """Test the conversation summary is placed before the history."""
+    prompt = PromptBuilder.create_prompt(
+        personality_prompt="You are Morgan.",
+        messages=[{"message_type": MessageType.USER, "content": "Hi again"}],
+        current_message="Where was I?",
+        summary="The user is planning a trip to Galway.",
+    )
+
+    assert "SUMMARY OF EARLIER CONVERSATION" in prompt
+    assert prompt.index("trip to Galway") < prompt.index("CONVERSATION HISTORY")
+
+
+def test_create_prompt_drops_guidelines_over_system_budget():
+    """Test an oversized system prompt loses the generic guidelines first."""
+    prompt = PromptBuilder.create_prompt(
+        personality_prompt="You are Morgan.",
+        messages=[],
+        current_message="Hello",
+        tts_instructions="Spell out numbers.",
+        num_ctx=512,
+    )
+
+    assert "RESPONSE GUIDELINES" not in prompt
+    assert "CONVERSATION CONTEXT INSTRUCTIONS" not in prompt
+    assert "You are Morgan." in prompt
+    assert "Spell out numbers." in prompt
+
+
+def test_create_prompt_fits_context_window():
+    """Test a long query, RAG context, summary and history fit in num_ctx."""
+    messages = [
+        {"message_type": MessageType.USER, "content": f"message {i} " + "x" * 400}
+        for i in range(40)
+    ]
+
+    def create_prompt(num_ctx):
+        return PromptBuilder.create_prompt(
+            personality_prompt="You are Morgan.",
+            messages=messages,
+            current_message="Please read this. " * 500,
+            rag_context="fact " * 2000,
+            summary="Earlier chat. " * 300,
+            num_ctx=num_ctx,
+        )
+
+    prompt = create_prompt(2048)
+    assert estimate_tokens(prompt) <= 2048 - PROMPT_RESPONSE_RESERVE_TOKENS
+    assert "message 39 " in prompt
+    assert "message 30 " not in prompt
+
+    # A larger context window leaves room for more history
+    assert "message 30 " in create_prompt(8192)
+
+
+def test_create_prompt_takes_system_overflow_from_history():
+    """Test a system prompt over its share shortens the history instead."""
+    messages = [
+        {"message_type": MessageType.USER, "content": f"message {i} " + "x" * 80}
+        for i in range(10)
+    ]
+
+    def create_prompt(personality_prompt):
+        return PromptBuilder.create_prompt(
+            personality_prompt=personality_prompt,
+            messages=messages,
+            current_message="Hello",
+            num_ctx=1024,
+        )
+
+    assert "message 1 " in create_prompt("You are Morgan.")
+
+    personality_prompt = "You are Morgan. " * 80
+    prompt = create_prompt(personality_prompt)
+    assert personality_prompt.strip() in prompt
+    assert "message 9 " in prompt
+    assert "message 4 " not in prompt
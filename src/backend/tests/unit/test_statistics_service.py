@@ -0,0 +1,45 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from api.models import MessageType
+from api.services.statistics_service import get_generation_timing_stats
+
+
+@pytest.mark.asyncio
+@patch("api.services.statistics_service.get_database")
+async def test_generation_timing_stats_filters_before_union(mock_get_database):
+    """Test both collections are filtered before their messages are combined."""
+    results = [{"_id": "test-llm-config", "message_count": 3}]
+    cursor = MagicMock()
+    cursor.to_list = AsyncMock(return_value=results)
+    mock_db = MagicMock()
+    mock_db.messages.aggregate.return_value = cursor
+    mock_get_database.return_value = mock_db
+
+    stats = await get_generation_timing_stats(
+        llm_filter="test-llm-config", group_by="agent_uid"
+    )
+
+    assert stats == results
+    pipeline = mock_db.messages.aggregate.call_args.args[0]
+    match_stage = {
+        "message_type": MessageType.AGENT,
+        "metadata.llm_stats.eval_duration": {"$exists": True},
+        "llm_config_uid": "test-llm-config",
+    }
+    assert pipeline[0] == {"$match": match_stage}
+    assert pipeline[1] == {
+        "$unionWith": {
+            "coll": "global_messages",
+            "pipeline": [{"$match": match_stage}],
+        }
+    }
+    assert pipeline[2]["$group"]["_id"] == "$agent_uid"
+    assert len(pipeline) == 3
+
+
+@pytest.mark.asyncio
+async def test_generation_timing_stats_rejects_unknown_group():
+    """Test grouping by an unsupported field is rejected."""
+    with pytest.raises(ValueError):
+        await get_generation_timing_stats(group_by="user_uid")
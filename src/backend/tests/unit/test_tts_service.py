@@ -0,0 +1,811 @@
+import asyncio
+import os
+import pytest
+import struct
+import sys
+import threading
+import wave
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import ttsModule.ttsModule as tts_module
+from api.services import tts_service
+from api.services.tts_service import (
+    VoicePathIndex,
+    choose_audio_format,
+    pop_sentences,
+    scan_voice_files,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_model_state():
+    """Start every test with the TTS model not loaded."""
+    tts_module.tts = None
+    tts_module.model_state.update(
+        status="not_loaded", error=None, device=None, started_at=None, loaded_at=None
+    )
+    yield
+    tts_module.tts = None
+
+
+def test_model_not_loaded_on_import():
+    """Test that importing the module does not load the model."""
+    assert tts_module.tts is None
+    assert tts_module.get_model_status()["status"] == "not_loaded"
+
+
+def test_load_model_ready():
+    """Test that a successful load reports ready with the device."""
+    tts_api = MagicMock()
+    with patch.dict(sys.modules, {"TTS.api": tts_api}):
+        model = tts_module.load_model()
+
+    status = tts_module.get_model_status()
+    assert model is tts_api.TTS.return_value.to.return_value
+    assert status["status"] == "ready"
+    assert status["device"] is not None
+    assert status["loaded_at"] is not None
+
+
+def test_load_model_failed():
+    """Test that a failing load reports failed with the error."""
+    tts_api = MagicMock()
+    tts_api.TTS.side_effect = RuntimeError("checkpoint missing")
+    with patch.dict(sys.modules, {"TTS.api": tts_api}):
+        model = tts_module.load_model()
+
+    status = tts_module.get_model_status()
+    assert model is None
+    assert status["status"] == "failed"
+    assert "checkpoint missing" in status["error"]
+
+
+def test_start_background_load_only_once():
+    """Test that a load already in progress is not started again."""
+    with patch.object(tts_module.threading, "Thread") as thread:
+        assert tts_module.start_background_load() is True
+        assert tts_module.get_model_status()["status"] == "loading"
+        assert tts_module.start_background_load() is False
+
+    thread.assert_called_once()
+
+
+def test_pop_sentences_merges_short_sentences():
+    """Test that complete sentences are split off and short ones merged."""
+    sentences, rest = pop_sentences("Hi. This is the first full sentence. And then")
+
+    assert sentences == ["Hi. This is the first full sentence."]
+    assert rest == "And then"
+
+
+def test_choose_audio_format():
+    """Test that only explicitly accepted formats replace WAV."""
+    available = ["wav", "ogg", "mp3"]
+
+    assert choose_audio_format(None, available) == "wav"
+    assert choose_audio_format("*/*", available) == "wav"
+    assert choose_audio_format("audio/ogg,audio/wav,*/*;q=0.5", available) == "ogg"
+    assert choose_audio_format("audio/ogg;q=0.5,audio/mpeg", available) == "mp3"
+    assert choose_audio_format("audio/ogg", ["wav"]) == "wav"
+
+
+@pytest.fixture
+def conversation_dir(tmp_path):
+    """Point the TTS service at an empty conversation directory."""
+    with patch.object(tts_service, "CONVERSATION_DIR", str(tmp_path)):
+        yield tmp_path
+
+
+@pytest.mark.asyncio
+@patch("api.services.tts_service.get_database")
+async def test_voice_index_resolves_expected_path(mock_get_database, conversation_dir):
+    """Test that a file at its expected path is found and then served from memory."""
+    voice_file = conversation_dir / "conv-1" / "message_msg-1.wav"
+    voice_file.parent.mkdir()
+    voice_file.write_bytes(b"RIFF")
+    index = VoicePathIndex()
+
+    assert await index.resolve("msg-1", "conv-1") == str(voice_file)
+    assert await index.resolve("msg-1") == str(voice_file)
+
+    assert index.stats["path_hits"] == 1
+    assert index.stats["hits"] == 1
+    mock_get_database.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("api.services.tts_service.get_database")
+async def test_voice_index_uses_stored_voiceline_path(
+    mock_get_database, mock_db, conversation_dir
+):
+    """Test that the voiceline_path stored on the message is used without scanning."""
+    voice_file = conversation_dir / "other" / "message_msg-2.wav"
+    voice_file.parent.mkdir()
+    voice_file.write_bytes(b"RIFF")
+    mock_db["messages"].find_one = AsyncMock(
+        return_value={"voiceline_path": str(voice_file)}
+    )
+    mock_get_database.return_value = mock_db
+    index = VoicePathIndex()
+
+    with patch("os.listdir") as listdir, patch("os.scandir") as scandir:
+        path = await index.resolve("msg-2", "conv-1")
+
+    assert path == str(voice_file)
+    assert index.stats["db_hits"] == 1
+    listdir.assert_not_called()
+    scandir.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("api.services.tts_service.get_database")
+async def test_voice_index_drops_stale_entries(mock_get_database, conversation_dir):
+    """Test that an indexed file that no longer exists is not returned."""
+    mock_get_database.return_value = None
+    index = VoicePathIndex()
+    index.put("msg-3", str(conversation_dir / "message_msg-3.wav"))
+
+    assert await index.resolve("msg-3") is None
+    assert index.stats["stale"] == 1
+    assert index.stats["misses"] == 1
+
+
+@pytest.mark.asyncio
+@patch("api.services.tts_service.get_database")
+async def test_voice_index_remembers_misses(
+    mock_get_database, mock_db, conversation_dir
+):
+    """Test that a message without a voice file is not looked up again until put."""
+    mock_db["messages"].find_one = AsyncMock(return_value=None)
+    mock_db["global_messages"] = AsyncMock()
+    mock_db["global_messages"].find_one.return_value = None
+    mock_get_database.return_value = mock_db
+    index = VoicePathIndex(miss_ttl=60)
+
+    assert await index.resolve("msg-4") is None
+    assert await index.resolve("msg-4") is None
+
+    assert mock_db["messages"].find_one.await_count == 1
+    assert index.stats["cached_misses"] == 1
+
+    voice_file = conversation_dir / "message_msg-4.wav"
+    voice_file.write_bytes(b"RIFF")
+    index.put("msg-4", str(voice_file))
+
+    assert await index.resolve("msg-4") == str(voice_file)
+
+
+def test_scan_voice_files_skips_segments(conversation_dir):
+    """Test that the repair scan finds whole voice files but not segments."""
+    directory = conversation_dir / "conv-1"
+    directory.mkdir()
+    (directory / "message_msg-1.wav").write_bytes(b"RIFF")
+    (directory / "message_msg-1_part0.wav").write_bytes(b"RIFF")
+    (conversation_dir / "message_msg-2.wav").write_bytes(b"RIFF")
+
+    assert scan_voice_files() == {
+        "msg-1": str(directory / "message_msg-1.wav"),
+        "msg-2": str(conversation_dir / "message_msg-2.wav"),
+    }
+
+
+def write_wav(path, frames=100, framerate=1000):
+    """Write a silent mono 16-bit WAV file."""
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(framerate)
+        wav.writeframes(b"\x00\x00" * frames)
+    return str(path)
+
+
+def test_pop_sentences_keeps_abbreviations():
+    """Test that abbreviations and initials do not end a sentence."""
+    sentences, rest = pop_sentences(
+        "I spoke to Mr. Smith about it today. Bring snacks, e.g. fruit or nuts. J. R. R. Tolkien"
+    )
+
+    assert sentences == [
+        "I spoke to Mr. Smith about it today.",
+        "Bring snacks, e.g. fruit or nuts.",
+    ]
+    assert rest == "J. R. R. Tolkien"
+
+
+@pytest.fixture
+def fake_synthesis(conversation_dir):
+    """Replace synthesis with writing a short WAV; sentences containing FAIL raise."""
+    calls = []
+
+    async def synthesize(speaker_wav_path, text, output_path, label=""):
+        calls.append(text)
+        if "FAIL" in text:
+            raise tts_service.TTSQueueFullError("Speech synthesis queue is full")
+        write_wav(output_path)
+        return 0.1
+
+    with patch.object(tts_service, "synthesize", synthesize), patch.object(
+        tts_service.audio_encoder, "schedule"
+    ), patch.object(tts_service, "TTS_SEGMENT_RETRY_DELAY", 0):
+        yield calls
+
+
+@pytest.mark.asyncio
+async def test_speech_pipeline_joins_segments_and_removes_them(
+    fake_synthesis, conversation_dir
+):
+    """Test that segments are joined into one file and deleted after the retention time."""
+    pipeline = tts_service.SpeechPipeline(
+        message_uid="msg-1", conversation_uid="conv-1"
+    )
+    pipeline.start()
+    pipeline.feed("This is the first sentence. ")
+    pipeline.feed("And this is the second one.")
+
+    with patch.object(tts_service, "TTS_SEGMENT_RETENTION", 0):
+        path, duration = await pipeline.finish()
+        await asyncio.sleep(0.01)
+
+    assert duration == pytest.approx(0.2)
+    assert os.path.exists(path)
+    assert not any(os.path.exists(p) for p, _ in pipeline.segments)
+
+
+@pytest.mark.asyncio
+async def test_speech_pipeline_cancel_keeps_segments_for_readers(
+    fake_synthesis, conversation_dir
+):
+    """Test that cancelling leaves segments for the retention time before deleting them."""
+    pipeline = tts_service.SpeechPipeline(
+        message_uid="msg-3", conversation_uid="conv-1"
+    )
+    pipeline.start()
+    pipeline.feed("This is the first sentence. ")
+    while not pipeline.segments:
+        await asyncio.sleep(0.01)
+
+    with patch.object(tts_service, "TTS_SEGMENT_RETENTION", 0.05):
+        pipeline.cancel()
+        assert all(os.path.exists(p) for p, _ in pipeline.segments)
+        await asyncio.sleep(0.1)
+
+    assert not any(os.path.exists(p) for p, _ in pipeline.segments)
+
+
+@pytest.mark.asyncio
+async def test_speech_pipeline_fails_on_dropped_sentence(
+    fake_synthesis, conversation_dir
+):
+    """Test that a sentence failing every retry fails the voice instead of leaving a gap."""
+    pipeline = tts_service.SpeechPipeline(
+        message_uid="msg-2", conversation_uid="conv-1"
+    )
+    pipeline.start()
+    pipeline.feed("This sentence is fine to speak. This one will FAIL to speak. ")
+
+    with pytest.raises(RuntimeError, match="segment 1"):
+        await pipeline.finish()
+
+    assert fake_synthesis.count("This one will FAIL to speak.") == (
+        tts_service.TTS_SEGMENT_RETRIES + 1
+    )
+    assert not os.path.exists(
+        tts_service.get_voice_output_path("msg-2", "conv-1", segment=0)
+    )
+    assert not os.path.exists(tts_service.get_voice_output_path("msg-2", "conv-1"))
+
+
+class ThreadExecutor:
+    """Stand-in for SynthesisExecutor running jobs on a plain thread."""
+
+    workers = 1
+
+    def __init__(self):
+        self.jobs = []
+
+    async def run(self, func, *args, label=""):
+        self.jobs.append(args[0])
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def batch_request(speaker, text):
+    return {"speaker_wav_path": speaker, "text": text}
+
+
+def test_group_requests_by_speaker_length_and_size():
+    """Test that batches hold one speaker, similar lengths and at most max_batch_size."""
+    engine = tts_service.BatchingSynthesisEngine(
+        executor=ThreadExecutor(), max_batch_size=2, length_ratio=2.0
+    )
+    requests = [
+        batch_request("a", "x" * 10),
+        batch_request("b", "x" * 10),
+        batch_request("a", "x" * 15),
+        batch_request("a", "x" * 18),
+        batch_request("a", "x" * 50),
+    ]
+
+    batches = engine.group_requests(requests)
+
+    assert [[(r["speaker_wav_path"], len(r["text"])) for r in b] for b in batches] == [
+        [("a", 10), ("a", 15)],
+        [("a", 18)],
+        [("a", 50)],
+        [("b", 10)],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_batching_engine_flushes_after_window():
+    """Test that a lone request is run once the window has passed."""
+    executor = ThreadExecutor()
+    engine = tts_service.BatchingSynthesisEngine(
+        executor=executor, window_ms=20, max_batch_size=4
+    )
+
+    def fake_batch(requests, on_result):
+        for index, (_, text, _) in enumerate(requests):
+            on_result(index, f"done:{text}")
+
+    with patch.object(tts_service, "tts_generate_speech_batch", fake_batch):
+        task = asyncio.create_task(engine.synthesize("a", "hello", "out.wav"))
+        await asyncio.sleep(0)
+        assert engine.get_stats()["pending"] == 1
+        assert executor.jobs == []
+
+        assert await task == "done:hello"
+
+    assert engine.get_stats()["batches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_batching_engine_flushes_full_batch_immediately():
+    """Test that a full batch runs without waiting for the window."""
+    executor = ThreadExecutor()
+    engine = tts_service.BatchingSynthesisEngine(
+        executor=executor, window_ms=60000, max_batch_size=2
+    )
+
+    def fake_batch(requests, on_result):
+        for index, (_, text, _) in enumerate(requests):
+            on_result(index, RuntimeError(text) if text == "bad" else text)
+
+    with patch.object(tts_service, "tts_generate_speech_batch", fake_batch):
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                engine.synthesize("a", "good", "1.wav"),
+                engine.synthesize("a", "bad", "2.wav"),
+                return_exceptions=True,
+            ),
+            timeout=5,
+        )
+
+    assert results[0] == "good"
+    assert isinstance(results[1], RuntimeError)
+    assert len(executor.jobs) == 1
+
+
+@pytest.mark.asyncio
+async def test_batching_engine_delivers_each_item_when_ready():
+    """Test that a caller gets its result before the rest of its batch finishes."""
+    engine = tts_service.BatchingSynthesisEngine(
+        executor=ThreadExecutor(), window_ms=60000, max_batch_size=2
+    )
+    release = threading.Event()
+
+    def fake_batch(requests, on_result):
+        on_result(0, "first")
+        release.wait(timeout=5)
+        on_result(1, "second")
+
+    with patch.object(tts_service, "tts_generate_speech_batch", fake_batch):
+        first = asyncio.create_task(engine.synthesize("a", "one two", "1.wav"))
+        second = asyncio.create_task(engine.synthesize("a", "three four", "2.wav"))
+
+        assert await asyncio.wait_for(first, timeout=5) == "first"
+        assert not second.done()
+        release.set()
+        assert await asyncio.wait_for(second, timeout=5) == "second"
+
+
+@pytest.mark.asyncio
+async def test_synthesis_executor_rejects_when_queue_full():
+    """Test that jobs beyond the queue limit are rejected while a worker is busy."""
+    executor = tts_service.SynthesisExecutor(workers=1, max_queue_size=1)
+    release = threading.Event()
+    try:
+        running = asyncio.create_task(executor.run(release.wait, 5, label="running"))
+        while executor.running() == 0:
+            await asyncio.sleep(0.001)
+        queued = asyncio.create_task(executor.run(lambda: "queued", label="queued"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(tts_service.TTSQueueFullError):
+            await executor.run(lambda: "rejected")
+
+        release.set()
+        assert await running is True
+        assert await queued == "queued"
+
+        stats = executor.get_stats()
+        assert stats["rejected"] == 1
+        assert stats["completed"] == 2
+        assert stats["queue_depth"] == 0
+        assert [job["label"] for job in stats["recent_jobs"]] == ["running", "queued"]
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_synthesis_executor_shutdown():
+    """Test that shutdown drops waiting jobs and refuses new ones."""
+    executor = tts_service.SynthesisExecutor(workers=1, max_queue_size=4)
+    release = threading.Event()
+
+    running = asyncio.create_task(executor.run(release.wait, 5))
+    while executor.running() == 0:
+        await asyncio.sleep(0.001)
+    waiting = asyncio.create_task(executor.run(lambda: "never"))
+    await asyncio.sleep(0)
+
+    executor.shutdown()
+    release.set()
+
+    assert await running is True
+    with pytest.raises(RuntimeError, match="shut down"):
+        await waiting
+    with pytest.raises(RuntimeError, match="shut down"):
+        await executor.run(lambda: "late")
+
+
+@pytest.fixture
+def xtts_model():
+    """A loaded XTTS model whose config differs from inference()'s defaults."""
+    tts_module.tts = MagicMock()
+    model = tts_module.tts.synthesizer.tts_model
+    model.config.repetition_penalty = 5.0
+    model.config.temperature = 0.75
+    model.config.top_k = 50
+    model.config.top_p = 0.85
+    model.config.length_penalty = 1.0
+    model.get_conditioning_latents.side_effect = lambda **kwargs: (
+        MagicMock(),
+        MagicMock(),
+    )
+    return model
+
+
+def test_speaker_latent_cache_recomputes_when_voice_file_changes(tmp_path, xtts_model):
+    """Test that latents are keyed on the voice file's content."""
+    speaker_wav = tmp_path / "speaker.wav"
+    speaker_wav.write_bytes(b"first voice")
+    cache = tts_module.SpeakerLatentCache(cache_dir=str(tmp_path / "latents"))
+
+    first = cache.get(str(speaker_wav))
+    assert cache.get(str(speaker_wav)) is first
+
+    speaker_wav.write_bytes(b"replacement voice")
+    second = cache.get(str(speaker_wav))
+
+    assert second is not first
+    assert xtts_model.get_conditioning_latents.call_count == 2
+    assert cache.stats["memory_hits"] == 1
+    assert cache.stats["misses"] == 2
+
+
+def test_generate_speech_uses_model_config_sampling(tmp_path, xtts_model):
+    """Test that inference gets the config's sampling values, not its defaults."""
+    speaker_wav = tmp_path / "speaker.wav"
+    speaker_wav.write_bytes(b"voice")
+    cache = tts_module.SpeakerLatentCache(cache_dir=str(tmp_path / "latents"))
+
+    with patch.object(tts_module, "speaker_latent_cache", cache):
+        tts_module.generate_speech(
+            str(speaker_wav), "Hello there.", str(tmp_path / "out.wav")
+        )
+
+    kwargs = xtts_model.inference.call_args.kwargs
+    assert kwargs["repetition_penalty"] == 5.0
+    assert kwargs["temperature"] == 0.75
+    assert kwargs["top_k"] == 50
+    assert kwargs["top_p"] == 0.85
+    assert kwargs["length_penalty"] == 1.0
+
+
+@pytest.fixture
+def audio_cache(tmp_path):
+    cache = tts_service.AudioCache(
+        cache_dir=str(tmp_path / "audio_cache"), max_bytes=10_000, enabled=True
+    )
+    with patch.object(tts_service, "audio_cache", cache):
+        yield cache
+
+
+def test_audio_cache_miss_then_hit(tmp_path, audio_cache):
+    """Test that a stored file is linked to later outputs for the same key."""
+    source = tmp_path / "first.wav"
+    write_wav(source)
+
+    assert audio_cache.fetch("key", str(tmp_path / "out" / "second.wav")) is False
+    audio_cache.store("key", str(source))
+    assert audio_cache.fetch("key", str(tmp_path / "out" / "second.wav")) is True
+
+    with wave.open(str(tmp_path / "out" / "second.wav"), "rb") as wav:
+        assert wav.getnframes() == 100
+    stats = audio_cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 1, 1)
+
+
+def test_audio_cache_hit_keeps_linked_file_mtime(tmp_path, audio_cache):
+    """Test that a hit does not touch files linked to the cache entry."""
+    source = tmp_path / "voice.wav"
+    write_wav(source)
+    audio_cache.store("key", str(source))
+    os.utime(source, (1_000_000, 1_000_000))
+
+    assert audio_cache.fetch("key", str(tmp_path / "other.wav")) is True
+    assert os.path.getmtime(source) == 1_000_000
+
+
+def test_audio_cache_evicts_least_recently_used(tmp_path, audio_cache):
+    """Test that the oldest unused entry is evicted once over the size limit."""
+    audio_cache.max_bytes = 15_000
+    for name in ("a", "b", "c"):
+        write_wav(tmp_path / f"{name}.wav", frames=2000)
+        audio_cache.store(name, str(tmp_path / f"{name}.wav"))
+    audio_cache.fetch("a", str(tmp_path / "a_again.wav"))
+
+    write_wav(tmp_path / "d.wav", frames=2000)
+    audio_cache.store("d", str(tmp_path / "d.wav"))
+
+    assert audio_cache.fetch("b", str(tmp_path / "b_again.wav")) is False
+    assert audio_cache.fetch("a", str(tmp_path / "a_again.wav")) is True
+    assert audio_cache.total_bytes <= audio_cache.max_bytes
+    assert audio_cache.stats["evictions"] == 1
+
+
+def test_audio_cache_key_reads_model_version_once(tmp_path, audio_cache):
+    """Test that keys reuse the model version and the speaker hash."""
+    speaker_wav = tmp_path / "speaker.wav"
+    speaker_wav.write_bytes(b"voice")
+
+    with patch.object(
+        tts_service, "get_model_version", return_value="1.0"
+    ) as version, patch.object(
+        tts_service.speaker_latent_cache, "file_hash", return_value="abc"
+    ) as file_hash:
+        first = audio_cache.make_key("Hello there.", str(speaker_wav))
+        second = audio_cache.make_key("Hello  there.", str(speaker_wav))
+
+    assert first == second
+    version.assert_called_once()
+    file_hash.assert_called_once()
+
+
+def test_get_wav_duration(tmp_path):
+    """Test that the duration is read from the WAV header."""
+    assert tts_service.get_wav_duration(write_wav(tmp_path / "a.wav", 250)) == 0.25
+
+
+def test_concatenate_wavs(tmp_path):
+    """Test that segments are joined in order without touching linked files."""
+    first = write_wav(tmp_path / "first.wav", frames=100)
+    second = tmp_path / "second.wav"
+    with wave.open(str(second), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(1000)
+        wav.writeframes(b"\x01\x00" * 50)
+    output = tmp_path / "output.wav"
+    cached = tmp_path / "cached.wav"
+    write_wav(cached, frames=10)
+    os.link(cached, output)
+
+    duration = tts_service.concatenate_wavs([first, str(second)], str(output))
+
+    assert duration == 0.15
+    with wave.open(str(output), "rb") as wav:
+        frames = wav.readframes(wav.getnframes())
+    assert frames == b"\x00\x00" * 100 + b"\x01\x00" * 50
+    assert tts_service.get_wav_duration(str(cached)) == 0.01
+
+
+def test_concatenate_wavs_rejects_mismatched_formats(tmp_path):
+    """Test that segments with different sample rates are not joined."""
+    first = write_wav(tmp_path / "first.wav", framerate=1000)
+    second = write_wav(tmp_path / "second.wav", framerate=2000)
+
+    with pytest.raises(ValueError):
+        tts_service.concatenate_wavs([first, second], str(tmp_path / "output.wav"))
+
+    assert sorted(os.listdir(tmp_path)) == ["first.wav", "second.wav"]
+
+
+def test_encoded_variant_is_stale_when_wav_is_newer(tmp_path):
+    """Test that a variant older than its WAV file is not served."""
+    wav_path = write_wav(tmp_path / "line.wav")
+    ogg_path = tmp_path / "line.ogg"
+    ogg_path.write_bytes(b"ogg")
+
+    os.utime(wav_path, (1_000, 1_000))
+    os.utime(ogg_path, (2_000, 2_000))
+    assert tts_service.get_encoded_variant(wav_path, "ogg") == str(ogg_path)
+
+    os.utime(wav_path, (3_000, 3_000))
+    assert tts_service.get_encoded_variant(wav_path, "ogg") is None
+    assert tts_service.get_encoded_variant(wav_path, "mp3") is None
+    assert tts_service.get_encoded_variant(wav_path, "wav") == wav_path
+
+
+async def drain(encoder):
+    while encoder._tasks:
+        await asyncio.gather(*encoder._tasks)
+
+
+@pytest.mark.asyncio
+async def test_audio_encoder_drops_format_without_encoder(tmp_path):
+    """Test that a missing encoder is tried once rather than on every request."""
+    encoder = tts_service.AudioEncoder(formats=["ogg", "mp3"])
+    wav_path = write_wav(tmp_path / "line.wav")
+
+    def encode(path, fmt):
+        if fmt == "ogg":
+            raise FileNotFoundError(2, "No such file or directory", "ffmpeg")
+        return write_wav(tts_service.get_variant_path(path, fmt))
+
+    with patch.object(tts_service, "encode_variant", side_effect=encode) as mock:
+        encoder.schedule(wav_path)
+        await drain(encoder)
+        encoder.schedule(wav_path)
+        encoder.schedule(write_wav(tmp_path / "other.wav"))
+        await drain(encoder)
+
+    assert encoder.formats == ["mp3"]
+    assert encoder.get_stats()["disabled_formats"] == ["ogg"]
+    assert [call.args[1] for call in mock.call_args_list] == [
+        "ogg",
+        "mp3",
+        "mp3",
+        "mp3",
+    ]
+    encoder.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_audio_encoder_keeps_format_after_transient_error(tmp_path):
+    """Test that a failure unrelated to the encoder does not disable the format."""
+    encoder = tts_service.AudioEncoder(formats=["ogg"])
+    wav_path = write_wav(tmp_path / "line.wav")
+
+    def encode(path, fmt):
+        if path == wav_path:
+            raise OSError(28, "No space left on device")
+        return write_wav(tts_service.get_variant_path(path, fmt))
+
+    with patch.object(tts_service, "encode_variant", side_effect=encode):
+        encoder.schedule(wav_path)
+        await drain(encoder)
+        encoder.schedule(write_wav(tmp_path / "other.wav"))
+        await drain(encoder)
+
+    assert encoder.formats == ["ogg"]
+    assert encoder.stats["failed"] == encoder.stats["encoded"] == 1
+    encoder.shutdown()
+
+
+def test_is_encoder_missing():
+    """Test that only errors naming a missing ffmpeg or codec count as missing."""
+    command = "Command:['ffmpeg', '-i', 'in.wav', '-acodec', 'libopus', 'out.ogg']"
+    assert tts_service.is_encoder_missing(
+        FileNotFoundError(2, "No such file or directory", "ffmpeg")
+    )
+    assert tts_service.is_encoder_missing(
+        RuntimeError(
+            f"Encoding failed.\n\n{command}\n\nOutput from ffmpeg/avlib:\n\n"
+            "Unknown encoder 'libopus'"
+        )
+    )
+    assert not tts_service.is_encoder_missing(
+        FileNotFoundError(2, "No such file or directory", "/tmp/line.wav")
+    )
+    assert not tts_service.is_encoder_missing(
+        RuntimeError(
+            f"Encoding failed.\n\n{command}\n\nOutput from ffmpeg/avlib:\n\n"
+            "in.wav: Invalid data found when processing input"
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_audio_encoder_retries_failed_file_only_after_it_changes(tmp_path):
+    """Test that a file that failed to encode is skipped until rewritten."""
+    encoder = tts_service.AudioEncoder(formats=["ogg"])
+    good_path = write_wav(tmp_path / "good.wav")
+    bad_path = write_wav(tmp_path / "bad.wav")
+
+    def encode(path, fmt):
+        if path == bad_path:
+            raise RuntimeError("corrupt input")
+        return write_wav(tts_service.get_variant_path(path, fmt))
+
+    with patch.object(tts_service, "encode_variant", side_effect=encode) as mock:
+        encoder.schedule(good_path)
+        await drain(encoder)
+        encoder.schedule(bad_path)
+        await drain(encoder)
+        encoder.schedule(bad_path)
+        await drain(encoder)
+        assert mock.call_count == 2
+
+        os.utime(bad_path, (5_000, 5_000))
+        encoder.schedule(bad_path)
+        await drain(encoder)
+
+    assert mock.call_count == 3
+    assert encoder.formats == ["ogg"]
+    assert encoder.stats["failed"] == 2
+    encoder.shutdown()
+
+
+def test_streaming_wav_header(tmp_path):
+    """Test that the open-ended header describes the PCM format players need."""
+    header = tts_service.streaming_wav_header(1, 2, 24000)
+
+    fields = struct.unpack("<4sI4s4sIHHIIHH4sI", header)
+    assert len(header) == 44
+    assert fields == (
+        b"RIFF",
+        0xFFFFFFFF,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        1,
+        24000,
+        48000,
+        2,
+        16,
+        b"data",
+        0xFFFFFFFF,
+    )
+
+    streamed = tmp_path / "streamed.wav"
+    streamed.write_bytes(header + b"\x01\x00" * 10)
+    with wave.open(str(streamed), "rb") as wav:
+        assert (wav.getnchannels(), wav.getsampwidth(), wav.getframerate()) == (
+            1,
+            2,
+            24000,
+        )
+        assert wav.readframes(100) == b"\x01\x00" * 10
+
+
+@pytest.mark.asyncio
+async def test_wait_for_tts_model_waits_for_background_load():
+    """Test synthesis waits while the model loads instead of failing."""
+    tts_module.model_state["status"] = "loading"
+
+    async def finish_loading():
+        await asyncio.sleep(0.05)
+        tts_module.model_state["status"] = "ready"
+
+    with patch.object(tts_service, "TTS_MODEL_WAIT_INTERVAL", 0.01):
+        loader = asyncio.create_task(finish_loading())
+        await tts_service.wait_for_tts_model(timeout=5)
+        await loader
+
+    assert tts_module.get_model_status()["status"] == "ready"
+
+
+@pytest.mark.asyncio
+async def test_wait_for_tts_model_fails_when_model_is_unavailable():
+    """Test a failed load or a load that takes too long raises straight away."""
+    tts_module.model_state.update(status="failed", error="checkpoint missing")
+    with pytest.raises(tts_service.TTSModelNotReadyError, match="checkpoint missing"):
+        await tts_service.wait_for_tts_model(timeout=5)
+
+    tts_module.model_state["status"] = "loading"
+    with patch.object(tts_service, "TTS_MODEL_WAIT_INTERVAL", 0.01):
+        with pytest.raises(tts_service.TTSModelNotReadyError, match="within"):
+            await tts_service.wait_for_tts_model(timeout=0.03)
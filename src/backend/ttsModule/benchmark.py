@@ -0,0 +1,125 @@
+"""
+Compare serial XTTS synthesis with the micro-batching engine.
+
+Runs the same sentences once strictly one after another and once submitted
+concurrently through BatchingSynthesisEngine, and reports throughput for
+each. Runs on CPU unless --device says otherwise.
+
+Usage:
+    python -m ttsModule.benchmark [--requests 12] [--concurrency 4] [--device cpu]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+SENTENCES = [
+    "Good morning, how can I help you today?",
+    "I checked that for you.",
+    "The weather in Dublin is twelve degrees with light rain.",
+    "Sure, I have added that to your shopping list.",
+    "Your next meeting starts in fifteen minutes.",
+    "I could not find anything matching that request, could you rephrase it?",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--speaker", default="morgan")
+    return parser.parse_args()
+
+
+def report(name: str, elapsed: float, results) -> dict:
+    audio = sum(result.duration for result in results)
+    row = {
+        "mode": name,
+        "requests": len(results),
+        "seconds": elapsed,
+        "requests_per_second": len(results) / elapsed,
+        "audio_seconds_per_second": audio / elapsed,
+    }
+    print(
+        f"{name:>8}: {row['requests']} requests in {elapsed:.2f}s, "
+        f"{row['requests_per_second']:.2f} req/s, "
+        f"{row['audio_seconds_per_second']:.2f}x real time"
+    )
+    return row
+
+
+async def run(args):
+    from api.services.tts_service import (
+        BatchingSynthesisEngine,
+        resolve_speaker_wav,
+        synthesis_executor,
+        tts_generate_speech,
+    )
+
+    from ttsModule.ttsModule import load_model
+
+    if load_model() is None:
+        raise SystemExit("TTS model failed to load")
+
+    speaker_wav_path = resolve_speaker_wav(args.speaker, None)
+    texts = [SENTENCES[i % len(SENTENCES)] for i in range(args.requests)]
+    output_dir = tempfile.mkdtemp(prefix="tts-benchmark-")
+
+    def output_path(mode: str, index: int) -> str:
+        return os.path.join(output_dir, f"{mode}_{index}.wav")
+
+    # Warm up the model and the speaker latent cache
+    await synthesis_executor.run(
+        tts_generate_speech, speaker_wav_path, texts[0], output_path("warmup", 0)
+    )
+
+    started = time.perf_counter()
+    serial = []
+    for index, text in enumerate(texts):
+        serial.append(
+            await synthesis_executor.run(
+                tts_generate_speech,
+                speaker_wav_path,
+                text,
+                output_path("serial", index),
+            )
+        )
+    report("serial", time.perf_counter() - started, serial)
+
+    engine = BatchingSynthesisEngine(executor=synthesis_executor)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def submit(index: int, text: str):
+        async with semaphore:
+            return await engine.synthesize(
+                speaker_wav_path, text, output_path("batched", index)
+            )
+
+    started = time.perf_counter()
+    batched = await asyncio.gather(
+        *(submit(index, text) for index, text in enumerate(texts))
+    )
+    report("batched", time.perf_counter() - started, batched)
+
+    stats = engine.get_stats()
+    print(
+        f"{stats['batches']} batches, average size {stats['avg_batch_size']:.2f}, "
+        f"largest {stats['largest_batch']}; audio written to {output_dir}"
+    )
+    synthesis_executor.shutdown()
+
+
+def main():
+    args = parse_args()
+    # The model, and with it the device, is only loaded by load_model() in run()
+    os.environ["TTS_DEVICE"] = args.device
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import os
-import torch
+import time
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 
 # Set environment variable for PyTorch 2.6+
 os.environ["TORCH_LOAD_WEIGHTS_ONLY"] = "0"
@@ -9,49 +13,283 @@ os.environ["TORCH_LOAD_WEIGHTS_ONLY"] = "0"
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Try to add necessary classes to safe_globals (for PyTorch 2.6+)
-try:
-    if hasattr(torch.serialization, "add_safe_globals"):
-        # Register ALL classes that might be needed for deserialization
-        # This is the key to making it work with PyTorch 2.6+
-        from TTS.tts.configs.xtts_config import XttsConfig
-        from TTS.tts.models.xtts import Xtts, XttsAudioConfig, XttsArgs
-        from TTS.config.shared_configs import BaseDatasetConfig
-        from TTS.tts.models.base_tts import BaseTTS
-        from TTS.encoder.configs.base_encoder_config import BaseEncoderConfig
-        from TTS.utils.generic_utils import get_user_data_dir
-
-        # Add ALL relevant classes to safe_globals
-        classes = [
-            XttsConfig,
-            Xtts,
-            XttsAudioConfig,
-            BaseDatasetConfig,
-            BaseTTS,
-            BaseEncoderConfig,
-            XttsArgs,
-        ]
-        torch.serialization.add_safe_globals(classes)
-        logger.info("Successfully added TTS model classes to PyTorch safe_globals")
-except Exception as e:
-    logger.warning(f"Error adding classes to PyTorch safe_globals: {e}")
-
-# Initialize device for TTS
-device = "cuda" if torch.cuda.is_available() else "cpu"
-logger.info(f"Using device: {device}")
-
-# Only import TTS after setting up the environment and safe_globals
-try:
-    from TTS.api import TTS
-
-    tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
-    logger.info(f"TTS Model successfully loaded onto {device}")
-except Exception as e:
-    logger.error(f"Failed to load TTS model: {e}")
-    tts = None
-
-
-def generate_speech(speaker_wav_path: str, text: str, output_path: str):
+TTS_MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+TTS_LANGUAGE = "en"
+
+# The model is loaded by load_model(), normally in the background after startup,
+# so importing this module stays cheap
+tts = None
+device: Optional[str] = None
+model_state: Dict[str, Any] = {
+    "status": "not_loaded",  # not_loaded -> loading -> ready | failed
+    "error": None,
+    "device": None,
+    "started_at": None,
+    "loaded_at": None,
+}
+_load_lock = threading.Lock()
+
+
+def _register_safe_globals(torch):
+    """Try to add necessary classes to safe_globals (for PyTorch 2.6+)."""
+    try:
+        if hasattr(torch.serialization, "add_safe_globals"):
+            # Register ALL classes that might be needed for deserialization
+            # This is the key to making it work with PyTorch 2.6+
+            from TTS.tts.configs.xtts_config import XttsConfig
+            from TTS.tts.models.xtts import Xtts, XttsAudioConfig, XttsArgs
+            from TTS.config.shared_configs import BaseDatasetConfig
+            from TTS.tts.models.base_tts import BaseTTS
+            from TTS.encoder.configs.base_encoder_config import BaseEncoderConfig
+
+            # Add ALL relevant classes to safe_globals
+            classes = [
+                XttsConfig,
+                Xtts,
+                XttsAudioConfig,
+                BaseDatasetConfig,
+                BaseTTS,
+                BaseEncoderConfig,
+                XttsArgs,
+            ]
+            torch.serialization.add_safe_globals(classes)
+            logger.info("Successfully added TTS model classes to PyTorch safe_globals")
+    except Exception as e:
+        logger.warning(f"Error adding classes to PyTorch safe_globals: {e}")
+
+
+def load_model():
+    """Load the XTTS model if it is not loaded yet. Blocks until done."""
+    global tts, device
+
+    with _load_lock:
+        if tts is not None:
+            return tts
+
+        model_state.update(status="loading", error=None, started_at=time.time())
+        try:
+            import torch
+
+            _register_safe_globals(torch)
+
+            # Initialize device for TTS
+            device = os.getenv("TTS_DEVICE") or (
+                "cuda" if torch.cuda.is_available() else "cpu"
+            )
+            logger.info(f"Using device: {device}")
+
+            # Only import TTS after setting up the environment and safe_globals
+            from TTS.api import TTS
+
+            tts = TTS(TTS_MODEL_NAME).to(device)
+            model_state.update(status="ready", device=device, loaded_at=time.time())
+            logger.info(f"TTS Model successfully loaded onto {device}")
+        except Exception as e:
+            logger.error(f"Failed to load TTS model: {e}")
+            model_state.update(status="failed", error=str(e))
+            tts = None
+
+    return tts
+
+
+def start_background_load() -> bool:
+    """Start loading the model on a background thread, unless already loading or loaded."""
+    if model_state["status"] in ("loading", "ready"):
+        return False
+    model_state["status"] = "loading"
+    threading.Thread(target=load_model, name="tts-model-load", daemon=True).start()
+    return True
+
+
+def get_model_status() -> Dict[str, Any]:
+    """Readiness of the TTS model: not_loaded, loading, ready or failed."""
+    status = dict(model_state)
+    if status["status"] == "loading" and status["started_at"]:
+        status["loading_for"] = time.time() - status["started_at"]
+    return status
+
+
+def get_model_version() -> str:
+    """Identify the loaded model, e.g. for keying cached audio."""
+    from importlib.metadata import PackageNotFoundError, version
+
+    # The maintained fork is published as coqui-tts, the original as TTS
+    for distribution in ("coqui-tts", "TTS"):
+        try:
+            return f"{TTS_MODEL_NAME}@{version(distribution)}"
+        except PackageNotFoundError:
+            continue
+    return TTS_MODEL_NAME
+
+
+LATENT_CACHE_DIR = os.getenv(
+    "TTS_LATENT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "latents"),
+)
+LATENT_CACHE_MAX_ENTRIES = int(os.getenv("TTS_LATENT_CACHE_MAX_ENTRIES", "32"))
+
+
+class SpeakerLatentCache:
+    """
+    Caches XTTS speaker conditioning latents per reference WAV.
+
+    Entries are keyed by a hash of the reference file contents, so a voice
+    file that is replaced gets new latents. Recently used latents are kept
+    in memory and every entry is also written to disk to survive restarts.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = LATENT_CACHE_DIR,
+        max_entries: int = LATENT_CACHE_MAX_ENTRIES,
+    ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, Tuple[Any, Any]]" = OrderedDict()
+        # (path, size, mtime) -> content hash, to avoid re-reading unchanged files
+        self._hashes: Dict[Tuple[str, int, float], str] = {}
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def file_hash(self, speaker_wav_path: str) -> str:
+        stat = os.stat(speaker_wav_path)
+        file_key = (os.path.abspath(speaker_wav_path), stat.st_size, stat.st_mtime)
+        digest = self._hashes.get(file_key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(speaker_wav_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(block)
+            digest = sha.hexdigest()
+            self._hashes[file_key] = digest
+        return digest
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def _remember(self, key: str, latents: Tuple[Any, Any]):
+        with self._lock:
+            self._memory[key] = latents
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, speaker_wav_path: str) -> Tuple[Any, Any]:
+        """Return (gpt_cond_latent, speaker_embedding) for a reference WAV."""
+        key = self.file_hash(speaker_wav_path)
+
+        with self._lock:
+            latents = self._memory.get(key)
+            if latents is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return latents
+
+        disk_path = self._disk_path(key)
+        if os.path.exists(disk_path):
+            try:
+                import torch
+
+                data = torch.load(disk_path, map_location=device)
+                latents = (data["gpt_cond_latent"], data["speaker_embedding"])
+                self.stats["disk_hits"] += 1
+                self._remember(key, latents)
+                return latents
+            except Exception as e:
+                logger.warning(
+                    f"Ignoring unreadable latent cache file {disk_path}: {e}"
+                )
+
+        self.stats["misses"] += 1
+        gpt_cond_latent, speaker_embedding = (
+            tts.synthesizer.tts_model.get_conditioning_latents(
+                audio_path=[speaker_wav_path], **conditioning_settings()
+            )
+        )
+        latents = (gpt_cond_latent, speaker_embedding)
+        self._remember(key, latents)
+
+        try:
+            import torch
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{disk_path}.tmp"
+            torch.save(
+                {
+                    "gpt_cond_latent": gpt_cond_latent.cpu(),
+                    "speaker_embedding": speaker_embedding.cpu(),
+                },
+                tmp_path,
+            )
+            os.replace(tmp_path, disk_path)
+        except Exception as e:
+            logger.warning(f"Failed to write latent cache file {disk_path}: {e}")
+
+        logger.info(f"Computed speaker latents for {speaker_wav_path}")
+        return latents
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = sum(self.stats.values())
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+speaker_latent_cache = SpeakerLatentCache()
+
+
+def supports_cached_latents() -> bool:
+    """Whether the loaded model can synthesise from precomputed speaker latents."""
+    model = getattr(getattr(tts, "synthesizer", None), "tts_model", None)
+    return model is not None and hasattr(model, "get_conditioning_latents")
+
+
+def conditioning_settings() -> Dict[str, Any]:
+    """Speaker conditioning options from the model config, as XTTS uses them."""
+    config = tts.synthesizer.tts_model.config
+    return {
+        "gpt_cond_len": config.gpt_cond_len,
+        "gpt_cond_chunk_len": config.gpt_cond_chunk_len,
+        "max_ref_length": config.max_ref_len,
+        "sound_norm_refs": config.sound_norm_refs,
+    }
+
+
+def sampling_settings() -> Dict[str, Any]:
+    """
+    Sampling options from the model config.
+
+    inference() has its own defaults (repetition_penalty=10.0 among others)
+    that differ from the tuned values in the model config, so they are passed
+    explicitly, as tts.tts() does.
+    """
+    config = tts.synthesizer.tts_model.config
+    return {
+        "temperature": config.temperature,
+        "length_penalty": config.length_penalty,
+        "repetition_penalty": config.repetition_penalty,
+        "top_k": config.top_k,
+        "top_p": config.top_p,
+    }
+
+
+class SpeechResult(NamedTuple):
+    """A synthesized file with its length, known without reading it back."""
+
+    path: str
+    num_samples: int
+    sample_rate: int
+
+    @property
+    def duration(self) -> float:
+        return self.num_samples / float(self.sample_rate)
+
+
+def generate_speech(speaker_wav_path: str, text: str, output_path: str) -> SpeechResult:
     """
     Text to speech generation using Coqui XTTS.
 
@@ -60,7 +298,7 @@ def generate_speech(speaker_wav_path: str, text: str, output_path: str):
     output_path: Path to save the generated .wav file.
     """
     if tts is None:
-        raise RuntimeError("TTS model is not loaded")
+        raise RuntimeError(f"TTS model is not ready ({model_state['status']})")
 
     if not os.path.exists(speaker_wav_path):
         raise FileNotFoundError(f"Speaker WAV file not found at {speaker_wav_path}")
@@ -68,15 +306,57 @@ def generate_speech(speaker_wav_path: str, text: str, output_path: str):
     try:
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-        # Generate the speech
-        tts.tts_to_file(
-            text=text,
-            speaker_wav=speaker_wav_path,
-            language="en",
-            file_path=output_path,
-        )
+        if supports_cached_latents():
+            # Skip re-deriving the speaker conditioning on every call
+            gpt_cond_latent, speaker_embedding = speaker_latent_cache.get(
+                speaker_wav_path
+            )
+            wav = tts.synthesizer.tts_model.inference(
+                text,
+                TTS_LANGUAGE,
+                gpt_cond_latent,
+                speaker_embedding,
+                enable_text_splitting=True,
+                **sampling_settings(),
+            )["wav"]
+        else:
+            # Generate the speech
+            wav = tts.tts(
+                text=text,
+                speaker_wav=speaker_wav_path,
+                language=TTS_LANGUAGE,
+            )
+        tts.synthesizer.save_wav(wav=wav, path=output_path)
+
         logger.info(f"Speech successfully generated at: {output_path}")
-        return output_path
+        return SpeechResult(output_path, len(wav), tts.synthesizer.output_sample_rate)
     except Exception as e:
         logger.error(f"Error generating speech: {e}")
         raise
+
+
+def generate_speech_batch(
+    requests: List[Tuple[str, str, str]],
+    on_result: Optional[Callable[[int, Union[SpeechResult, Exception]], None]] = None,
+) -> List[Union[SpeechResult, Exception]]:
+    """
+    Synthesize several (speaker_wav_path, text, output_path) requests in one call.
+
+    XTTS decodes a single sequence at a time, so the requests run back to back
+    inside one inference context, sharing cached speaker latents. Each result
+    is passed to on_result as soon as it is ready. A failure is returned in
+    place of its result instead of failing the whole batch.
+    """
+    import torch
+
+    results: List[Union[SpeechResult, Exception]] = []
+    with torch.inference_mode():
+        for index, (speaker_wav_path, text, output_path) in enumerate(requests):
+            try:
+                result = generate_speech(speaker_wav_path, text, output_path)
+            except Exception as e:
+                result = e
+            results.append(result)
+            if on_result:
+                on_result(index, result)
+    return results